@@ -0,0 +1,191 @@
+import argparse
+import logging
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+from metrics import MetricsTable, CSV, FORMATS
+
+# The totals read from each edge of the emissions edgeData output, in SUMO's units (mg and ml)
+EMISSIONS = ("CO2", "CO", "HC", "PMx", "NOx", "fuel")
+EDGE_EMISSION_COLUMNS = (("begin", "d"), ("end", "d"), ("edge", None), ("sampledSeconds", "d")) + tuple((e, "d") for e in EMISSIONS)
+INTERVAL_EMISSION_COLUMNS = (("begin", "d"), ("end", "d"), ("edges", "l"), ("sampledSeconds", "d")) + tuple((e, "d") for e in EMISSIONS)
+FCD_COLUMNS = (("begin", "d"), ("edge", None), ("samples", "l"), ("meanSpeed", "d"))
+# Times are averaged over every trip in the tripinfo output
+TRIP_ATTRIBUTES = ("duration", "waitingTime", "timeLoss", "departDelay", "routeLength")
+
+EMISSIONS_FILE_NAME = "emissionsOutput.xml"
+TRIPINFO_FILE_NAME = "tripinfo.xml"
+FCD_FILE_NAME = "fcd.xml"
+DEFAULT_FCD_INTERVAL = 60
+
+def _iterparse(fileLocation):
+    """
+    Starts streaming an XML file, returning its root element (which should be cleared once
+    each of its children has been handled so memory stays bounded) and the iterator of
+    (event, element) pairs
+    """
+    context = ElementTree.iterparse(fileLocation, events=("start", "end"))
+    event, root = next(context)
+    return root, context
+
+def analyseEmissions(emissionsFile, edgeTable=None, intervalTable=None):
+    """
+    Streams SUMO's emissions edgeData output, writing the totals of every edge in every
+    interval to edgeTable and the totals of every interval to intervalTable (both optional
+    MetricsTables). Returns the totals over the whole run.
+    """
+    totals = dict.fromkeys(EMISSIONS, 0.0)
+    totals["sampledSeconds"] = 0.0
+    root, context = _iterparse(emissionsFile)
+    begin = end = 0.0
+    intervalTotals = None
+    edges = 0
+    for event, element in context:
+        tag = element.tag
+        if event == "start":
+            if tag == "interval":
+                begin = float(element.get("begin"))
+                end = float(element.get("end"))
+                intervalTotals = [0.0] * (len(EMISSIONS) + 1)
+                edges = 0
+            continue
+        if tag == "edge":
+            values = [float(element.get("sampledSeconds", 0))] + [float(element.get(e + "_abs", 0)) for e in EMISSIONS]
+            if edgeTable:
+                edgeTable.append(begin, end, element.get("id"), *values)
+            for i, value in enumerate(values):
+                intervalTotals[i] = intervalTotals[i] + value
+            edges = edges + 1
+            element.clear()
+        elif tag == "interval":
+            if intervalTable:
+                intervalTable.append(begin, end, edges, *intervalTotals)
+            totals["sampledSeconds"] = totals["sampledSeconds"] + intervalTotals[0]
+            for e, value in zip(EMISSIONS, intervalTotals[1:]):
+                totals[e] = totals[e] + value
+            root.clear()
+    return totals
+
+def analyseTripinfo(tripinfoFile):
+    """
+    Streams SUMO's tripinfo output, returning the number of trips and the mean of each of
+    TRIP_ATTRIBUTES
+    """
+    sums = dict.fromkeys(TRIP_ATTRIBUTES, 0.0)
+    trips = 0
+    root, context = _iterparse(tripinfoFile)
+    for event, element in context:
+        if event == "end" and element.tag == "tripinfo":
+            for attribute in TRIP_ATTRIBUTES:
+                sums[attribute] = sums[attribute] + float(element.get(attribute, 0))
+            trips = trips + 1
+            root.clear()
+    summary = {"trips": trips}
+    for attribute, total in sums.items():
+        summary["mean %s" % attribute] = total / trips if trips else None
+    return summary
+
+def analyseFcd(fcdFile, table=None, interval=DEFAULT_FCD_INTERVAL):
+    """
+    Streams SUMO's floating car data output, writing the number of samples and the mean
+    speed on every edge in each interval (of the given length in seconds) to table. Only
+    the current interval is held in memory. Returns the number of samples and mean speed
+    over the whole run.
+    """
+    root, context = _iterparse(fcdFile)
+    currentBegin = None
+    edges = dict()
+    samples = 0
+    speedTotal = 0.0
+
+    def flush():
+        if table:
+            for edge, (count, total) in edges.items():
+                table.append(currentBegin, edge, count, total / count)
+        edges.clear()
+
+    for event, element in context:
+        if element.tag != "timestep":
+            continue
+        if event == "start":
+            begin = math.floor(float(element.get("time")) / interval) * interval
+            if begin != currentBegin:
+                if currentBegin is not None:
+                    flush()
+                currentBegin = begin
+        else:
+            for vehicle in element.iter("vehicle"):
+                speed = float(vehicle.get("speed", 0))
+                # Lanes are named <edge>_<index>
+                edge = vehicle.get("lane", "").rsplit("_", 1)[0]
+                sample = edges.get(edge)
+                if sample:
+                    sample[0] = sample[0] + 1
+                    sample[1] = sample[1] + speed
+                else:
+                    edges[edge] = [1, speed]
+                samples = samples + 1
+                speedTotal = speedTotal + speed
+            root.clear()
+    if currentBegin is not None:
+        flush()
+    return {"fcdSamples": samples, "fcdMeanSpeed": speedTotal / samples if samples else None}
+
+def analyseOutputs(outputDirectory, resultsDirectory=None, fileFormat=CSV, fcdInterval=DEFAULT_FCD_INTERVAL):
+    """
+    Analyses whichever of the emissions, tripinfo and FCD outputs SUMO wrote to the given
+    directory. Per edge and per interval results are written as tables to resultsDirectory
+    (the output directory by default) and the totals for the whole run are returned, ready to
+    be compared with other scenarios.
+    """
+    resultsDirectory = resultsDirectory or outputDirectory
+    os.makedirs(resultsDirectory, exist_ok=True)
+
+    def table(name, columns):
+        return MetricsTable(os.path.join(resultsDirectory, "%s.%s" % (name, fileFormat)), columns, fileFormat)
+
+    summary = dict()
+    emissionsFile = os.path.join(outputDirectory, EMISSIONS_FILE_NAME)
+    if os.path.exists(emissionsFile):
+        edgeTable = table("edgeEmissions", EDGE_EMISSION_COLUMNS)
+        intervalTable = table("intervalEmissions", INTERVAL_EMISSION_COLUMNS)
+        try:
+            totals = analyseEmissions(emissionsFile, edgeTable, intervalTable)
+        finally:
+            edgeTable.close()
+            intervalTable.close()
+        summary.update(("total %s" % name, value) for name, value in totals.items())
+    else:
+        logging.warning("No emissions output found in %s", outputDirectory)
+
+    tripinfoFile = os.path.join(outputDirectory, TRIPINFO_FILE_NAME)
+    if os.path.exists(tripinfoFile):
+        summary.update(analyseTripinfo(tripinfoFile))
+
+    fcdFile = os.path.join(outputDirectory, FCD_FILE_NAME)
+    if os.path.exists(fcdFile):
+        fcdTable = table("fcdEdges", FCD_COLUMNS)
+        try:
+            summary.update(analyseFcd(fcdFile, fcdTable, fcdInterval))
+        finally:
+            fcdTable.close()
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyses the SUMO outputs of one or more runs and compares their totals side by side")
+    parser.add_argument("outputDirectories", nargs="+", help="directories SUMO wrote each run's outputs to")
+    parser.add_argument("--format", dest="fileFormat", default=CSV, choices=FORMATS)
+    parser.add_argument("--fcd-interval", dest="fcdInterval", type=float, default=DEFAULT_FCD_INTERVAL)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+    summaries = [analyseOutputs(directory, fileFormat=args.fileFormat, fcdInterval=args.fcdInterval) for directory in args.outputDirectories]
+    names = [os.path.basename(os.path.normpath(directory)) for directory in args.outputDirectories]
+    measures = []
+    for summary in summaries:
+        measures.extend(measure for measure in summary if measure not in measures)
+    print("%-28s" % "" + "".join("%20s" % name[-20:] for name in names))
+    for measure in measures:
+        values = [summary.get(measure) for summary in summaries]
+        print("%-28s" % measure + "".join("%20s" % ("-" if value is None else "%.6g" % value) for value in values))
@@ -0,0 +1,120 @@
+import importlib
+import types
+
+try:
+    from traci import constants
+except ImportError:
+    # SUMO's python tools are not installed, only the fake backend can be used. The
+    # fake backend uses the same variable IDs as TraCI so nothing else changes
+    from fakebackend import constants
+
+# The backends that can be selected by name
+SOCKET = "traci"
+LIBSUMO = "libsumo"
+FAKE = "fake"
+BACKENDS = (SOCKET, LIBSUMO, FAKE)
+# The TraCI domains used, bound to the adapter when a backend is selected. libsumo's domains
+# are classes rather than modules
+DOMAINS = ("vehicle", "lane", "trafficlight", "simulation")
+
+class Backend():
+    """
+    A single adapter for whichever implementation of the TraCI API is being used.
+    Every module accesses the simulation through this object so that the socket based
+    traci module, the in-process libsumo module or the pure Python fake backend can be
+    swapped without any other changes. Attribute access is passed straight through
+    to the selected implementation (e.g. traci.vehicle.getSpeed), each attribute is
+    looked up once and kept on the adapter until the backend or profiler changes.
+    """
+
+    def __init__(self):
+        self._module = None
+        self._name = None
+        self._profiler = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not yet bound to the adapter, if no backend has
+        # been selected yet fall back to the socket based TraCI
+        if self._module is None:
+            self.use(SOCKET)
+            return getattr(self, name)
+        attr = getattr(self._module, name)
+        if self._profiler is not None:
+            attr = _instrument(attr, name, self._profiler)
+        self.__dict__[name] = attr
+        return attr
+
+    def _bind(self):
+        # Drops the attributes bound from the previous backend, then binds its domains
+        # (wrapped when instrumented) so they never need looking up again
+        for name in [name for name in self.__dict__ if not name.startswith("_")]:
+            del self.__dict__[name]
+        for name in DOMAINS:
+            domain = getattr(self._module, name, None)
+            if domain is not None:
+                self.__dict__[name] = domain if self._profiler is None else _InstrumentedDomain(domain, name, self._profiler)
+
+    def getName(self):
+        return self._name
+
+    def instrument(self, profiler):
+        """
+        Routes every call made through the adapter via the given profiler so that calls can
+        be counted and timed, passing None removes the instrumentation
+        """
+        self._profiler = profiler
+        if self._module is not None:
+            self._bind()
+
+    def isFake(self):
+        return self._name == FAKE
+
+    def use(self, backend=SOCKET):
+        """
+        Selects the backend to use, this can either be one of the names in BACKENDS or
+        an object implementing the TraCI API (such as a populated FakeTraCI instance)
+        """
+        if backend == FAKE:
+            from fakebackend import FakeTraCI
+            module = FakeTraCI()
+        elif backend in (SOCKET, LIBSUMO):
+            module = importlib.import_module(backend)
+        elif isinstance(backend, str):
+            raise ValueError("Unknown backend %s, available backends: %s" % (backend, BACKENDS))
+        else:
+            module = backend
+            backend = getattr(module, "backendName", module.__class__.__name__)
+        self._module = module
+        self._name = backend
+        self._bind()
+        return module
+
+class _InstrumentedDomain():
+    """
+    Wraps a TraCI domain (e.g. traci.vehicle) so that every command called on it is
+    reported to a profiler
+    """
+
+    def __init__(self, domain, name, profiler):
+        self._domain = domain
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attr = _instrument(getattr(self._domain, name), "%s.%s" % (self._name, name), self._profiler)
+        self.__dict__[name] = attr
+        return attr
+
+def _instrument(attr, name, profiler):
+    # Exceptions and constants are passed through untouched, domains are wrapped when bound
+    if isinstance(attr, (type, int, float, str, tuple)):
+        return attr
+    if callable(attr):
+        def instrumentedCall(*args, **kwargs):
+            return profiler.timeTraCICall(name, attr, args, kwargs)
+        return instrumentedCall
+    if isinstance(attr, types.ModuleType) and attr.__name__.endswith("constants"):
+        return attr
+    return _InstrumentedDomain(attr, name, profiler)
+
+traci = Backend()
@@ -0,0 +1,225 @@
+from backend import traci
+from commandbuffer import commandBuffer
+from fakebackend import FakeTraCI
+from profiling import profiler
+from scenario_manager import getMainProjectDirectory, SCENARIO_NUMBER_CONFIGS
+from scheduler import ControlScheduler, addSchedulerArguments, createScheduler
+from simulationmanager import SimulationManager
+
+from collections import namedtuple
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tracemalloc
+
+benchmarkCaseTuple = namedtuple("benchmarkCase", "junctions lanes edgeLength spacing queueLength vehsPerHour steps")
+
+# Each case is an arterial road with a cross street at every junction. Before the run starts
+# every lane is filled with queues of queueLength vehicles, one vehicle for every spacing
+# metres on average, so platoons can form straight away even without traffic lights
+BENCHMARK_CASES = {
+    "small"  : benchmarkCaseTuple(4,   2, 200, 25, 4, 900, 300),
+    "medium" : benchmarkCaseTuple(40,  2, 200, 25, 4, 900, 150),
+    "large"  : benchmarkCaseTuple(400, 2, 200, 25, 4, 900, 100),
+}
+# The distance between the vehicles of a queue, close enough for them to platoon
+QUEUE_SPACING = 7.5
+DEFAULT_CASES = ("small", "medium")
+DEFAULT_SCENARIOS = (2, 3, 4)
+DEFAULT_BASELINE_LOCATION = "benchmarks/baselines.json"
+# Runs are deterministic, so the counts of work done are compared against the baseline and
+# any increase beyond CALLS_TOLERANCE is a regression. Times depend on the machine and what
+# else it is doing, so they are only reported when they are more than the tolerance slower
+DEFAULT_TOLERANCE = 0.25
+CALLS_TOLERANCE = 0.05
+COUNTER_MEASURES = ("traciCallsPerStep", "commandsPerStep", "bytesPerVehicle")
+# The calls made to each TraCI domain per step are also compared, under traciCalls.<domain>
+DOMAIN_CALLS = "traciCalls.%s"
+TIME_MEASURES = ("controlTimePerStep", "stepTimeP95")
+
+def buildArterialNetwork(case, signalled=True):
+    """
+    Builds a fake network for the given case. An east/west arterial passes through every
+    junction, each junction also has a north to south cross street and a traffic light
+    controlling every lane entering it.
+    """
+    sim = FakeTraCI()
+    junctions = case.junctions
+    eastbound = ["e%s" % i for i in range(junctions + 1)]
+    westbound = ["w%s" % i for i in range(junctions + 1)]
+    for edgeID in eastbound + westbound:
+        sim.addEdge(edgeID, case.edgeLength, case.lanes)
+    for i in range(junctions):
+        crossIn = sim.addEdge("s%s_in" % i, case.edgeLength, case.lanes)
+        sim.addEdge("s%s_out" % i, case.edgeLength, case.lanes)
+        # Eastbound edge i and westbound edge i + 1 both end at junction i
+        controlledLanes = [lane.id for edge in (sim.edges[eastbound[i]], sim.edges[westbound[i + 1]], crossIn)
+                           for lane in edge.lanes]
+        sim.addTrafficLight("J%s" % i, controlledLanes, signalled=signalled)
+        sim.addFlow("s%s" % i, ["s%s_in" % i, "s%s_out" % i], vehsPerHour=case.vehsPerHour)
+    westbound.reverse()
+    sim.addFlow("east", eastbound, vehsPerHour=case.vehsPerHour * case.lanes)
+    sim.addFlow("west", westbound, vehsPerHour=case.vehsPerHour * case.lanes)
+
+    # Fill the network so that the benchmark measures a busy network straight away
+    for name, route in (("east", eastbound), ("west", westbound)):
+        for index, edgeID in enumerate(route):
+            for lane in range(case.lanes):
+                queuePos = case.edgeLength - 1
+                while queuePos > case.spacing:
+                    for i in range(case.queueLength):
+                        pos = queuePos - i * QUEUE_SPACING
+                        if pos <= case.spacing:
+                            break
+                        sim.addVehicle("%s_%s_%s_%s" % (name, edgeID, lane, int(pos)), route[index:], departPos=pos, departLane=lane)
+                    queuePos = queuePos - case.spacing * case.queueLength
+    return sim
+
+def buildArterialConflicts(case):
+    """
+    Gets the movement conflicts of each junction in the case's network (in the same form as
+    topology.Topology.getConflicts), both directions of the arterial can cross together but
+    conflict with the cross street
+    """
+    conflicts = dict()
+    lanes = range(case.lanes)
+    for i in range(case.junctions):
+        arterial = ["e%s_%s" % (i, lane) for lane in lanes] + ["w%s_%s" % (i + 1, lane) for lane in lanes]
+        cross = ["s%s_in_%s" % (i, lane) for lane in lanes]
+        junctionConflicts = {lane: frozenset(cross + [lane]) for lane in arterial}
+        junctionConflicts.update({lane: frozenset(arterial + [lane]) for lane in cross})
+        conflicts["J%s" % i] = junctionConflicts
+    return conflicts
+
+def runBenchmark(caseName, scenarioNum, measureMemory=True, createRunScheduler=ControlScheduler):
+    """
+    Runs a single benchmark case against the fake backend using the manager configuration
+    of the given scenario number. Each run's scheduler is made by createRunScheduler.
+    Returns the measurements
+    """
+    case = BENCHMARK_CASES[caseName]
+    config = SCENARIO_NUMBER_CONFIGS[scenarioNum]
+    result = {"case": caseName, "scenarioNum": scenarioNum}
+
+    def run():
+        # Platoon colours are random, seed so every run is identical
+        random.seed(0)
+        # With coordination enabled the _no_TLS maps are used, so vehicles aren't stopped by lights
+        sim = buildArterialNetwork(case, signalled=not config.enableCoordination)
+        traci.use(sim)
+        traci.start(["sumo", "--step-length", "0.1"])
+        manager = SimulationManager(config.enablePlatoons, config.enableCoordination, config.enableZipping, config.maxVehiclesPerPlatoon,
+                                    conflicts=buildArterialConflicts(case), scheduler=createRunScheduler())
+        vehicleSteps = 0
+        commandsIssued = commandBuffer.totalIssued
+        for step in range(case.steps):
+            profiler.startStep()
+            manager.handleSimulationStep()
+            with profiler.phase("simulationStep"):
+                traci.simulationStep()
+            profiler.endStep()
+            vehicleSteps = vehicleSteps + len(manager.vehicles)
+        traci.close()
+        return manager, vehicleSteps / case.steps, (commandBuffer.totalIssued - commandsIssued) / case.steps
+
+    profiler.enable()
+    manager, averageVehicles, commandsPerStep = run()
+    profiler.disable()
+    summary = profiler.getSummary()
+    steps = summary["steps"]
+    result["averageVehicles"] = averageVehicles
+    result["stepTimeP50"] = summary["stepTimeP50"]
+    result["stepTimeP95"] = summary["stepTimeP95"]
+    result["stepTimeP99"] = summary["stepTimeP99"]
+    # The fake backend's own step isn't part of the control logic, so it is reported separately
+    result["controlTimePerStep"] = (summary["stepTimeTotal"] - profiler.getPhaseTotal("simulationStep") * 1000) / steps
+    # Only commands sent through the backend's domains are counted, not the benchmark's own
+    # calls to start, step and close the simulation
+    domainCalls = profiler.getDomainCallCounts()
+    result["traciCallsPerStep"] = sum(domainCalls.values()) / steps
+    for domain, count in domainCalls.items():
+        result[DOMAIN_CALLS % domain] = count / steps
+    result["commandsPerStep"] = commandsPerStep
+    result["workSkippedPerStep"] = sum(manager.scheduler.totalSkipped.values()) / steps
+
+    if measureMemory:
+        # Measured in a second run as tracing allocations slows everything down. Only memory
+        # allocated outside of the fake backend is counted
+        tracemalloc.start()
+        manager, averageVehicles, commandsPerStep = run()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, "*fakebackend.py"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        tracemalloc.stop()
+        memory = sum(stat.size for stat in snapshot.statistics("filename"))
+        result["bytesPerVehicle"] = memory / (len(manager.vehicles) or 1)
+    return result
+
+def compareToBaseline(results, baselines, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the results to the recorded baselines, returning a list of regressions in the
+    counted measures and a list of the times that were slower than the tolerance allows
+    """
+    regressions = []
+    slower = []
+    for result in results:
+        baseline = baselines.get(_getKey(result))
+        if not baseline:
+            continue
+        counters = COUNTER_MEASURES + tuple(measure for measure in baseline if measure.startswith(DOMAIN_CALLS % ""))
+        for measures, allowed, found in ((counters, CALLS_TOLERANCE, regressions), (TIME_MEASURES, tolerance, slower)):
+            for measure in measures:
+                if measure in result and measure in baseline and result[measure] > baseline[measure] * (1 + allowed):
+                    found.append("%s %s: %.3f (baseline %.3f)" % (_getKey(result), measure, result[measure], baseline[measure]))
+    return regressions, slower
+
+def _getKey(result):
+    return "%s/%s" % (result["case"], result["scenarioNum"])
+
+def _formatResult(result):
+    return ("%-14s vehicles %8.0f  control ms/step %9.3f  step ms p50 %9.3f p95 %9.3f p99 %9.3f  TraCI calls/step %9.1f  commands/step %7.1f  skipped/step %7.1f  bytes/vehicle %s" % (
+        _getKey(result), result["averageVehicles"], result["controlTimePerStep"], result["stepTimeP50"],
+        result["stepTimeP95"], result["stepTimeP99"], result["traciCallsPerStep"], result.get("commandsPerStep", 0), result.get("workSkippedPerStep", 0),
+        "%.0f" % result["bytesPerVehicle"] if "bytesPerVehicle" in result else "-"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the platooning and intersection control logic against the fake backend")
+    parser.add_argument("--cases", nargs="+", default=list(DEFAULT_CASES), choices=list(BENCHMARK_CASES.keys()))
+    parser.add_argument("--scenarios", nargs="+", type=int, default=list(DEFAULT_SCENARIOS), choices=[n for n, c in SCENARIO_NUMBER_CONFIGS.items() if c.enableManager])
+    parser.add_argument("--baseline", default=os.path.join(getMainProjectDirectory(), DEFAULT_BASELINE_LOCATION))
+    parser.add_argument("--record", action="store_true", help="save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--no-memory", dest="measureMemory", action="store_false", help="skip the (slower) memory measurement")
+    addSchedulerArguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.WARNING)
+
+    results = []
+    for caseName in args.cases:
+        for scenarioNum in args.scenarios:
+            result = runBenchmark(caseName, scenarioNum, args.measureMemory, lambda: createScheduler(args))
+            print(_formatResult(result))
+            results.append(result)
+
+    baselines = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.record:
+        baselines.update({_getKey(result): result for result in results})
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Baseline saved to %s" % args.baseline)
+    else:
+        regressions, slower = compareToBaseline(results, baselines, args.tolerance)
+        for measure in slower:
+            print("SLOWER (not a failure, times vary between runs and machines) %s" % measure)
+        for regression in regressions:
+            print("REGRESSION %s" % regression)
+        if regressions:
+            sys.exit(1)
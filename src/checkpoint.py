@@ -0,0 +1,68 @@
+import os
+import pickle
+
+from backend import traci
+from commandbuffer import commandBuffer
+from routes import routeRegistry
+from statecache import stateCache
+from vehiclestore import COMMAND_COLUMNS, COMMAND_OBJECT_COLUMNS
+
+# SUMO's own state is saved alongside the checkpoint with this extension added
+SIMULATION_STATE_EXTENSION = ".sumostate.xml"
+
+def getSimulationStateLocation(checkpointFile):
+    return checkpointFile + SIMULATION_STATE_EXTENSION
+
+def saveCheckpoint(checkpointFile, manager, **info):
+    """
+    Saves the current state of the simulation and of the simulation manager (its vehicles,
+    platoons and intersection controllers, along with the vehicle store and route registry
+    they refer to) so that runs can later be started from this point. Any extra keyword
+    arguments are saved with it (ex. the map and scenario) and returned when it is loaded.
+    The manager's metrics recorder is not saved.
+    """
+    traci.simulation.saveState(getSimulationStateLocation(checkpointFile))
+    snapshot = {
+        "time": traci.simulation.getTime(),
+        "info": info,
+        "manager": manager,
+        "store": stateCache.store,
+        "routes": routeRegistry,
+    }
+    # Written to a temporary file first so that a checkpoint shared between runs is never
+    # seen half written
+    temporaryFile = "%s.%s.tmp" % (checkpointFile, os.getpid())
+    with open(temporaryFile, "wb") as f:
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporaryFile, checkpointFile)
+
+def loadCheckpoint(checkpointFile, metrics=None, topology=None):
+    """
+    Restores a checkpoint written by saveCheckpoint into the running simulation, which must
+    have been started with the same network. Returns the restored manager (None if there
+    wasn't one when it was saved), the time it was saved at and the info saved with it.
+    Every vehicle is subscribed to again and the last values sent to each vehicle are sent
+    again, as SUMO's saved state doesn't include them.
+    """
+    traci.simulation.loadState(getSimulationStateLocation(checkpointFile))
+    with open(checkpointFile, "rb") as f:
+        snapshot = pickle.load(f)
+
+    stateCache.reset()
+    stateCache.setTopology(topology)
+    stateCache.store = store = snapshot["store"]
+    routeRegistry.restore(snapshot["routes"])
+    commandBuffer.reset()
+    manager = snapshot["manager"]
+    if manager:
+        manager.metrics = metrics
+        for vehicleID in manager.vehicles:
+            stateCache.subscribe(vehicleID)
+
+    for vehicleID, row in store.rowsByName.items():
+        if store.active[row] and stateCache.isSubscribed(vehicleID):
+            for attr in list(COMMAND_COLUMNS) + list(COMMAND_OBJECT_COLUMNS):
+                value = store.getLastCommanded(row, attr)
+                if value is not None:
+                    commandBuffer.queue(vehicleID, attr, value)
+    return manager, snapshot["time"], snapshot["info"]
@@ -0,0 +1,66 @@
+import logging
+from backend import traci
+
+class CommandBuffer():
+    """
+    Collects the vehicle commands issued during a step so they can be sent together
+    just before the simulation steps. Repeated commands to the same vehicle and
+    attribute are coalesced, so only the last value set during a step is sent.
+    """
+
+    def __init__(self):
+        self._commands = dict()
+        self._suppressedThisStep = 0
+        self.issuedLastStep = 0
+        self.suppressedLastStep = 0
+        self.totalIssued = 0
+        self.totalSuppressed = 0
+
+    def flush(self):
+        """
+        Sends every buffered command to SUMO and updates the per-step counters
+        """
+        for (vehicleID, command), args in self._commands.items():
+            try:
+                getattr(traci.vehicle, command)(vehicleID, *args)
+            except traci.TraCIException:
+                logging.error("Could not %s for %s with %s", command, vehicleID, args)
+        self.issuedLastStep = len(self._commands)
+        self.suppressedLastStep = self._suppressedThisStep
+        self.totalIssued = self.totalIssued + self.issuedLastStep
+        self.totalSuppressed = self.totalSuppressed + self.suppressedLastStep
+        self._commands = dict()
+        self._suppressedThisStep = 0
+
+    def queue(self, vehicleID, command, *args):
+        """
+        Buffers a traci.vehicle command, replacing any earlier one for the same vehicle
+        and command in this step
+        """
+        key = (vehicleID, command)
+        if key in self._commands:
+            # Re-insert so commands keep the order they were last set in
+            del self._commands[key]
+            self._suppressedThisStep = self._suppressedThisStep + 1
+        self._commands[key] = args
+
+    def queueMany(self, command, vehicleIDs, argsList):
+        """
+        Buffers the same command for many vehicles, each with their own arguments
+        """
+        commands = self._commands
+        for vehicleID, args in zip(vehicleIDs, argsList):
+            key = (vehicleID, command)
+            if key in commands:
+                del commands[key]
+                self._suppressedThisStep = self._suppressedThisStep + 1
+            commands[key] = args
+
+    def reset(self):
+        """
+        Drops any buffered commands and clears the counters, this should be called
+        at the start of every run
+        """
+        self.__init__()
+
+commandBuffer = CommandBuffer()
@@ -0,0 +1,579 @@
+import heapq
+import pickle
+
+class TraCIException(Exception):
+    """Raised in the same situations that TraCI would raise its own TraCIException"""
+
+class constants():
+    """The subset of TraCI variable IDs understood by the fake backend (values match TraCI)"""
+    VAR_ACCELERATION = 0x72
+    VAR_LANE_ID = 0x51
+    VAR_LANE_INDEX = 0x52
+    VAR_LANEPOSITION = 0x56
+    VAR_LEADER = 0x68
+    VAR_LENGTH = 0x44
+    VAR_MAXSPEED = 0x41
+    VAR_ROAD_ID = 0x50
+    VAR_ROUTE_ID = 0x53
+    VAR_ROUTE_INDEX = 0x69
+    VAR_SPEED = 0x40
+
+DEFAULT_LANE_SPEED = 13.89
+DEFAULT_STEP_LENGTH = 0.1
+# Below this speed a vehicle is treated as stopped, otherwise vehicles creep
+# towards obstacles forever
+STOPPED_SPEED = 0.05
+
+class _Lane():
+    __slots__ = ("id", "edge", "index", "length", "maxSpeed", "vehicles", "trafficLight")
+
+    def __init__(self, laneID, edge, index, length, maxSpeed):
+        self.id = laneID
+        self.edge = edge
+        self.index = index
+        self.length = length
+        self.maxSpeed = maxSpeed
+        # Vehicles on the lane ordered from the front of the lane to the back
+        self.vehicles = []
+        self.trafficLight = None
+
+class _Edge():
+    __slots__ = ("id", "lanes")
+
+    def __init__(self, edgeID, lanes):
+        self.id = edgeID
+        self.lanes = lanes
+
+class _TrafficLight():
+    __slots__ = ("id", "controlledLanes", "cycle", "signalled")
+
+    def __init__(self, tlsID, controlledLanes, cycle, signalled):
+        self.id = tlsID
+        self.controlledLanes = list(controlledLanes)
+        self.cycle = cycle
+        self.signalled = signalled
+
+    def isRed(self, lane, time):
+        # Controlled lanes are split into two groups that take it in turn to get a green light
+        if not self.signalled:
+            return False
+        group = self.controlledLanes.index(lane.id) % 2
+        return int(time / self.cycle) % 2 != group
+
+class _Vehicle():
+    __slots__ = ("id", "route", "routeIndex", "lane", "pos", "speed", "acceleration", "length", "maxSpeed",
+                 "accel", "decel", "minGap", "tau", "imperfection", "speedFactor", "speedMode", "color",
+                 "commandedSpeed", "targetLaneIndex", "rank")
+
+    def __init__(self, vehID, route, length, maxSpeed, accel, decel):
+        self.id = vehID
+        self.route = tuple(route)
+        self.routeIndex = 0
+        self.lane = None
+        self.pos = 0.0
+        self.speed = 0.0
+        self.acceleration = 0.0
+        self.length = length
+        self.maxSpeed = maxSpeed
+        self.accel = accel
+        self.decel = decel
+        self.minGap = 2.5
+        self.tau = 1.0
+        self.imperfection = 0.5
+        self.speedFactor = 1.0
+        self.speedMode = 31
+        self.color = (255, 255, 0, 255)
+        self.commandedSpeed = -1
+        self.targetLaneIndex = None
+        self.rank = 0
+
+class _Flow():
+    __slots__ = ("id", "route", "begin", "end", "period", "count", "nextDepart", "vehicleParams")
+
+    def __init__(self, flowID, route, begin, end, period, vehicleParams):
+        self.id = flowID
+        self.route = tuple(route)
+        self.begin = begin
+        self.end = end
+        self.period = period
+        self.count = 0
+        self.nextDepart = begin
+        self.vehicleParams = vehicleParams
+
+class _Domain():
+    def __init__(self, sim):
+        self._sim = sim
+
+class _VehicleDomain(_Domain):
+
+    def _get(self, vehID):
+        vehicle = self._sim.vehicles.get(vehID)
+        if vehicle is None:
+            raise TraCIException("Vehicle '%s' is not known" % vehID)
+        return vehicle
+
+    def getIDList(self):
+        return tuple(self._sim.vehicles)
+
+    def getIDCount(self):
+        return len(self._sim.vehicles)
+
+    def getAcceleration(self, vehID):
+        return self._get(vehID).acceleration
+
+    def getLength(self, vehID):
+        return self._get(vehID).length
+
+    def getMaxSpeed(self, vehID):
+        return self._get(vehID).maxSpeed
+
+    def getRoute(self, vehID):
+        return self._get(vehID).route
+
+    def getRoadID(self, vehID):
+        return self._get(vehID).lane.edge.id
+
+    def getLaneID(self, vehID):
+        return self._get(vehID).lane.id
+
+    def getLaneIndex(self, vehID):
+        return self._get(vehID).lane.index
+
+    def getLanePosition(self, vehID):
+        return self._get(vehID).pos
+
+    def getLeader(self, vehID, dist=0.):
+        return self._sim.getLeader(self._get(vehID), dist)
+
+    def getRouteID(self, vehID):
+        return self._sim._getRouteID(self._get(vehID))
+
+    def getRouteIndex(self, vehID):
+        return self._get(vehID).routeIndex
+
+    def getSpeed(self, vehID):
+        return self._get(vehID).speed
+
+    def changeLane(self, vehID, laneIndex, duration):
+        self._get(vehID).targetLaneIndex = laneIndex
+
+    def setColor(self, vehID, color):
+        self._get(vehID).color = color
+
+    def setImperfection(self, vehID, imperfection):
+        self._get(vehID).imperfection = imperfection
+
+    def setMinGap(self, vehID, minGap):
+        self._get(vehID).minGap = minGap
+
+    def setSpeed(self, vehID, speed):
+        self._get(vehID).commandedSpeed = speed
+
+    def setSpeedFactor(self, vehID, speedFactor):
+        self._get(vehID).speedFactor = speedFactor
+
+    def setSpeedMode(self, vehID, speedMode):
+        self._get(vehID).speedMode = speedMode
+
+    def setTau(self, vehID, tau):
+        self._get(vehID).tau = tau
+
+    def subscribe(self, vehID, varIDs=(constants.VAR_ROAD_ID, constants.VAR_LANEPOSITION), begin=0, end=2**31 - 1, parameters=None):
+        self._get(vehID)
+        self._sim.subscriptions[vehID] = (tuple(varIDs), dict(parameters or {}))
+        self._sim.subscriptionResults = None
+
+    def subscribeLeader(self, vehID, dist=0., begin=0, end=2**31 - 1):
+        self.subscribe(vehID, (constants.VAR_LEADER,), begin, end, {constants.VAR_LEADER: ("d", dist)})
+
+    def unsubscribe(self, vehID):
+        self._sim.subscriptions.pop(vehID, None)
+        self._sim.subscriptionResults = None
+
+    def getAllSubscriptionResults(self):
+        return self._sim.getSubscriptionResults()
+
+    def getSubscriptionResults(self, vehID):
+        return self._sim.getSubscriptionResults().get(vehID, {})
+
+class _LaneDomain(_Domain):
+
+    def getIDList(self):
+        return tuple(self._sim.lanes)
+
+    def _getLane(self, laneID):
+        lane = self._sim.lanes.get(laneID)
+        if lane is None:
+            raise TraCIException("Lane '%s' is not known" % laneID)
+        return lane
+
+    def getLength(self, laneID):
+        return self._getLane(laneID).length
+
+    def getMaxSpeed(self, laneID):
+        return self._getLane(laneID).maxSpeed
+
+class _TrafficLightDomain(_Domain):
+
+    def getIDList(self):
+        return tuple(self._sim.trafficLights)
+
+    def getControlledLanes(self, tlsID):
+        trafficLight = self._sim.trafficLights.get(tlsID)
+        if trafficLight is None:
+            raise TraCIException("Traffic light '%s' is not known" % tlsID)
+        return list(trafficLight.controlledLanes)
+
+class _SimulationDomain(_Domain):
+
+    def getArrivedIDList(self):
+        return tuple(self._sim.arrived)
+
+    def getDeltaT(self):
+        return self._sim.stepLength
+
+    def getDepartedIDList(self):
+        return tuple(self._sim.departed)
+
+    def getPendingVehicles(self):
+        return tuple(vehID for vehID, route, spec, placement in self._sim._insertionBacklog)
+
+    def getMinExpectedNumber(self):
+        return len(self._sim.vehicles) + self._sim.getNumberOfPendingVehicles()
+
+    def getTime(self):
+        return self._sim.time
+
+    def loadState(self, fileName):
+        self._sim.loadState(fileName)
+
+    def saveState(self, fileName):
+        self._sim.saveState(fileName)
+
+class FakeTraCI():
+    """
+    A deterministic, pure Python stand in for the subset of the TraCI API used by this
+    project. Networks are built from edges (with one or more lanes), traffic lights
+    and vehicles or flows, then vehicles follow a simple car following model along their
+    routes. It is intended for benchmarking and testing the control logic without SUMO,
+    it makes no attempt to reproduce SUMO's behaviour exactly.
+    """
+    backendName = "fake"
+    TraCIException = TraCIException
+    constants = constants
+
+    def __init__(self, stepLength=DEFAULT_STEP_LENGTH):
+        self.stepLength = stepLength
+        self.scale = 1
+        self.time = 0.0
+        self.edges = dict()
+        self.lanes = dict()
+        self.trafficLights = dict()
+        self.vehicles = dict()
+        self.departed = []
+        self.arrived = []
+        self.subscriptions = dict()
+        self.subscriptionResults = None
+        self.started = False
+        self._flows = []
+        self._pending = []
+        self._insertionBacklog = []
+        self._sequence = 0
+        self.vehicle = _VehicleDomain(self)
+        self.lane = _LaneDomain(self)
+        self.trafficlight = _TrafficLightDomain(self)
+        self.simulation = _SimulationDomain(self)
+
+    # Building the network and demand
+
+    def addEdge(self, edgeID, length, numLanes=1, maxSpeed=DEFAULT_LANE_SPEED):
+        """Adds an edge with the given number of lanes, lanes are named <edgeID>_<index> like in SUMO"""
+        edge = _Edge(edgeID, [])
+        for index in range(numLanes):
+            lane = _Lane("%s_%s" % (edgeID, index), edge, index, float(length), maxSpeed)
+            edge.lanes.append(lane)
+            self.lanes[lane.id] = lane
+        self.edges[edgeID] = edge
+        return edge
+
+    def addTrafficLight(self, tlsID, controlledLanes, cycle=30, signalled=True):
+        """
+        Adds a traffic light controlling the given lanes. If signalled the lanes take it in
+        turn to get a green light every cycle seconds, otherwise vehicles pass freely
+        """
+        trafficLight = _TrafficLight(tlsID, controlledLanes, cycle, signalled)
+        for laneID in controlledLanes:
+            self.lanes[laneID].trafficLight = trafficLight
+        self.trafficLights[tlsID] = trafficLight
+        return trafficLight
+
+    def addFlow(self, flowID, route, begin=0, end=3600, vehsPerHour=600, **vehicleParams):
+        """Adds a flow of evenly spaced vehicles, vehicles are named <flowID>.<n> like in SUMO"""
+        self._checkRoute(route)
+        self._flows.append(_Flow(flowID, route, float(begin), float(end), 3600.0 / vehsPerHour, vehicleParams))
+
+    def addVehicle(self, vehID, route, depart=0, length=5.0, maxSpeed=55.55, accel=2.6, decel=4.5, departPos=None, departLane=0):
+        """
+        Adds a single vehicle that will depart at the given time. If a departPos is given the
+        vehicle is placed at that position on the given lane index of its first edge without
+        checking for space, this allows a network to be filled before the simulation starts
+        """
+        self._checkRoute(route)
+        self._sequence = self._sequence + 1
+        placement = (departLane, float(departPos)) if departPos is not None else None
+        heapq.heappush(self._pending, (float(depart), self._sequence, vehID, tuple(route), (length, maxSpeed, accel, decel), placement))
+
+    def _checkRoute(self, route):
+        for edgeID in route:
+            if edgeID not in self.edges:
+                raise TraCIException("Edge '%s' is not known" % edgeID)
+
+    # The top level TraCI functions
+
+    def start(self, cmd=None, port=None, label="default", **kwargs):
+        """Starts the simulation, the --step-length and --scale options of a SUMO command are honoured"""
+        cmd = list(cmd or [])
+        for option, attr in (("--step-length", "stepLength"), ("--scale", "scale")):
+            if option in cmd:
+                setattr(self, attr, float(cmd[cmd.index(option) + 1]))
+        self.started = True
+        return (0, "fake")
+
+    def switch(self, label):
+        pass
+
+    def close(self, wait=True):
+        self.started = False
+
+    def getVersion(self):
+        return (0, "fake")
+
+    def simulationStep(self, step=0.):
+        """Advances the simulation by one step, or until the given time if it is later"""
+        self.departed = []
+        self.arrived = []
+        targetTime = max(step, self.time + self.stepLength)
+        while self.time + self.stepLength <= targetTime + 1e-9:
+            self._step()
+
+    def saveState(self, fileName):
+        """Saves every vehicle and the demand still to depart, the network itself isn't saved"""
+        state = {
+            "time": self.time,
+            "vehicles": [tuple(vehicle.lane.id if slot == "lane" else getattr(vehicle, slot) for slot in _Vehicle.__slots__)
+                         for vehicle in self.vehicles.values()],
+            "flows": {flow.id: (flow.count, flow.nextDepart) for flow in self._flows},
+            "pending": list(self._pending),
+            "insertionBacklog": list(self._insertionBacklog),
+            "sequence": self._sequence,
+        }
+        with open(fileName, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    def loadState(self, fileName):
+        """
+        Replaces every vehicle and the demand still to depart with those saved by saveState.
+        Like SUMO, subscriptions to vehicles don't survive this
+        """
+        with open(fileName, "rb") as f:
+            state = pickle.load(f)
+        self.time = state["time"]
+        self.vehicles = dict()
+        for values in state["vehicles"]:
+            vehicle = _Vehicle.__new__(_Vehicle)
+            for slot, value in zip(_Vehicle.__slots__, values):
+                setattr(vehicle, slot, value)
+            vehicle.lane = self.lanes[vehicle.lane]
+            self.vehicles[vehicle.id] = vehicle
+        for flow in self._flows:
+            if flow.id in state["flows"]:
+                flow.count, flow.nextDepart = state["flows"][flow.id]
+        self._pending = state["pending"]
+        heapq.heapify(self._pending)
+        self._insertionBacklog = state["insertionBacklog"]
+        self._sequence = state["sequence"]
+        self.departed = []
+        self.arrived = []
+        self.subscriptions = dict()
+        self.subscriptionResults = None
+        for lane in self.lanes.values():
+            lane.vehicles = []
+        for vehicle in self.vehicles.values():
+            vehicle.lane.vehicles.append(vehicle)
+        self._sortLanes()
+
+    # Simulation
+
+    def getLeader(self, vehicle, dist):
+        """Gets the vehicle in front on the same lane within dist metres, returning (ID, gap)"""
+        if vehicle.rank > 0:
+            leader = vehicle.lane.vehicles[vehicle.rank - 1]
+            gap = leader.pos - leader.length - vehicle.pos - vehicle.minGap
+            if gap <= dist:
+                return (leader.id, gap)
+        return None
+
+    def getNumberOfPendingVehicles(self):
+        return len(self._pending) + len(self._insertionBacklog) + sum(1 for f in self._flows if f.nextDepart <= f.end)
+
+    def getSubscriptionResults(self):
+        if self.subscriptionResults is None:
+            results = dict()
+            for vehID, (varIDs, parameters) in self.subscriptions.items():
+                vehicle = self.vehicles[vehID]
+                results[vehID] = {var: self._getVariable(vehicle, var, parameters) for var in varIDs}
+            self.subscriptionResults = results
+        return self.subscriptionResults
+
+    def _getRouteID(self, vehicle):
+        # Vehicles are never rerouted so each keeps the implicit route SUMO would give it
+        return "!%s" % vehicle.id
+
+    def _getVariable(self, vehicle, var, parameters):
+        if var == constants.VAR_SPEED:
+            return vehicle.speed
+        elif var == constants.VAR_LANEPOSITION:
+            return vehicle.pos
+        elif var == constants.VAR_LANE_ID:
+            return vehicle.lane.id
+        elif var == constants.VAR_LANE_INDEX:
+            return vehicle.lane.index
+        elif var == constants.VAR_ROAD_ID:
+            return vehicle.lane.edge.id
+        elif var == constants.VAR_ROUTE_ID:
+            return self._getRouteID(vehicle)
+        elif var == constants.VAR_ROUTE_INDEX:
+            return vehicle.routeIndex
+        elif var == constants.VAR_LEADER:
+            return self.getLeader(vehicle, parameters.get(var, ("d", 0.))[1])
+        elif var == constants.VAR_ACCELERATION:
+            return vehicle.acceleration
+        elif var == constants.VAR_LENGTH:
+            return vehicle.length
+        elif var == constants.VAR_MAXSPEED:
+            return vehicle.maxSpeed
+        raise TraCIException("Variable %s is not supported by the fake backend" % var)
+
+    def _step(self):
+        self.time = round(self.time + self.stepLength, 6)
+        self._moveVehicles()
+        self._insertVehicles()
+        self._sortLanes()
+        self.subscriptionResults = None
+
+    def _insertVehicles(self):
+        # Gather everything due to depart, vehicles that can't fit on their first
+        # edge wait in a backlog like they would in SUMO
+        for flow in self._flows:
+            while flow.nextDepart <= self.time and flow.nextDepart <= flow.end:
+                self._sequence = self._sequence + 1
+                params = flow.vehicleParams
+                spec = (params.get("length", 5.0), params.get("maxSpeed", 55.55), params.get("accel", 2.6), params.get("decel", 4.5))
+                self._insertionBacklog.append(("%s.%s" % (flow.id, flow.count), flow.route, spec, None))
+                flow.count = flow.count + 1
+                flow.nextDepart = flow.begin + flow.count * flow.period / self.scale
+        while self._pending and self._pending[0][0] <= self.time:
+            depart, sequence, vehID, route, spec, placement = heapq.heappop(self._pending)
+            self._insertionBacklog.append((vehID, route, spec, placement))
+
+        waiting = []
+        for vehID, route, spec, placement in self._insertionBacklog:
+            if placement:
+                lane = self.edges[route[0]].lanes[placement[0]]
+                pos = placement[1]
+            else:
+                lane = self._getFreeLane(self.edges[route[0]], spec[0])
+                pos = spec[0]
+            if lane is None:
+                waiting.append((vehID, route, spec, placement))
+                continue
+            vehicle = _Vehicle(vehID, route, *spec)
+            vehicle.lane = lane
+            vehicle.speed = lane.maxSpeed
+            vehicle.pos = pos
+            # Lanes are put back in order once every vehicle has been inserted
+            lane.vehicles.append(vehicle)
+            self.vehicles[vehID] = vehicle
+            self.departed.append(vehID)
+        self._insertionBacklog = waiting
+
+    def _getFreeLane(self, edge, length):
+        # Picks the lane with the most space at its start
+        bestLane = None
+        bestSpace = length + 2.5
+        for lane in edge.lanes:
+            if not lane.vehicles:
+                return lane
+            last = lane.vehicles[-1]
+            space = last.pos - last.length
+            if space > bestSpace:
+                bestLane = lane
+                bestSpace = space
+        return bestLane
+
+    def _moveVehicles(self):
+        dt = self.stepLength
+        for lane in self.lanes.values():
+            leader = None
+            stopLine = lane.trafficLight is not None and lane.trafficLight.isRed(lane, self.time)
+            for vehicle in lane.vehicles:
+                self._updateSpeed(vehicle, leader, stopLine, dt)
+                leader = vehicle
+
+        for vehicle in list(self.vehicles.values()):
+            vehicle.pos = vehicle.pos + vehicle.speed * dt
+            lane = vehicle.lane
+            if vehicle.targetLaneIndex is not None and vehicle.targetLaneIndex != lane.index:
+                if 0 <= vehicle.targetLaneIndex < len(lane.edge.lanes):
+                    vehicle.lane = lane.edge.lanes[vehicle.targetLaneIndex]
+                vehicle.targetLaneIndex = None
+            while vehicle.pos > vehicle.lane.length:
+                vehicle.pos = vehicle.pos - vehicle.lane.length
+                vehicle.routeIndex = vehicle.routeIndex + 1
+                if vehicle.routeIndex >= len(vehicle.route):
+                    self._removeVehicle(vehicle)
+                    break
+                nextLanes = self.edges[vehicle.route[vehicle.routeIndex]].lanes
+                vehicle.lane = nextLanes[min(vehicle.lane.index, len(nextLanes) - 1)]
+
+        for lane in self.lanes.values():
+            lane.vehicles = []
+        for vehicle in self.vehicles.values():
+            vehicle.lane.vehicles.append(vehicle)
+
+    def _removeVehicle(self, vehicle):
+        del self.vehicles[vehicle.id]
+        self.subscriptions.pop(vehicle.id, None)
+        self.arrived.append(vehicle.id)
+
+    def _sortLanes(self):
+        for lane in self.lanes.values():
+            if len(lane.vehicles) > 1:
+                lane.vehicles.sort(key=lambda v: -v.pos)
+            for rank, vehicle in enumerate(lane.vehicles):
+                vehicle.rank = rank
+
+    def _updateSpeed(self, vehicle, leader, stopLine, dt):
+        # A simplified version of the Krauss car following model
+        if vehicle.commandedSpeed >= 0:
+            desired = vehicle.commandedSpeed
+        else:
+            desired = min(vehicle.maxSpeed * vehicle.speedFactor, vehicle.lane.maxSpeed)
+        if desired > vehicle.speed:
+            speed = min(desired, vehicle.speed + vehicle.accel * dt)
+        else:
+            speed = max(desired, vehicle.speed - vehicle.decel * dt)
+
+        obstacles = []
+        if leader is not None:
+            obstacles.append((leader.pos - leader.length - vehicle.pos - vehicle.minGap, leader.speed))
+        if stopLine:
+            obstacles.append((vehicle.lane.length - vehicle.pos, 0.0))
+        tau = max(vehicle.tau, dt)
+        for gap, leaderSpeed in obstacles:
+            safe = leaderSpeed + (gap - leaderSpeed * tau) / (tau + (vehicle.speed + leaderSpeed) / (2 * vehicle.decel))
+            speed = min(speed, max(safe, 0.0))
+        if speed < STOPPED_SPEED and (obstacles or desired < STOPPED_SPEED):
+            speed = 0.0
+        vehicle.acceleration = (speed - vehicle.speed) / dt
+        vehicle.speed = speed
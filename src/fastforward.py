@@ -0,0 +1,151 @@
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+from collections import namedtuple
+
+from backend import traci
+
+flowTuple = namedtuple("flowTuple", "begin end period")
+
+# SUMO's default end time for flows without one
+DEFAULT_FLOW_END = 86400
+# Jumps shorter than this many steps aren't worth leaving the normal loop for
+MINIMUM_JUMP_STEPS = 2
+
+class DepartureSchedule():
+    """
+    The times vehicles are due to depart, taken from the flows and vehicles of a route file.
+    Flows are treated as departing every period (divided by the traffic scale when it is above
+    1) from their begin time until their end. Flows with a departure probability could
+    depart on any step so while one is running there is always a departure due.
+    """
+
+    def __init__(self, flows=(), departures=(), randomFlows=(), scale=1):
+        """
+        flows are flowTuples of periodic flows, departures the times of single vehicles and
+        randomFlows the (begin, end) of flows that depart at random
+        """
+        scale = max(scale, 1)
+        self._flows = [flowTuple(flow.begin, flow.end, flow.period / scale) for flow in flows]
+        self._departures = sorted(departures)
+        self._randomFlows = list(randomFlows)
+
+    def getNextDeparture(self, time):
+        """
+        Gets the time of the next departure at or after the given time (a departure at the
+        given time happens in the coming step), None if there are no more
+        """
+        nextDeparture = None
+        for begin, end in self._randomFlows:
+            if begin <= time < end:
+                return time
+            if begin >= time:
+                nextDeparture = begin if nextDeparture is None else min(nextDeparture, begin)
+        for flow in self._flows:
+            if time <= flow.begin:
+                departure = flow.begin
+            else:
+                departure = flow.begin + math.ceil((time - flow.begin) / flow.period - 1e-9) * flow.period
+            if departure <= flow.end and (nextDeparture is None or departure < nextDeparture):
+                nextDeparture = departure
+        for departure in self._departures:
+            if departure >= time:
+                if nextDeparture is None or departure < nextDeparture:
+                    nextDeparture = departure
+                break
+        return nextDeparture
+
+def _getTime(value, default=0.0):
+    # Departure times can also be given as triggers (ex. "triggered") which can't be predicted
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def loadDepartureSchedule(configFile, scale=1):
+    """
+    Reads the departure schedule of every route file listed in a .sumocfg file
+    """
+    directory = os.path.dirname(configFile)
+    routeFiles = []
+    for event, element in ElementTree.iterparse(configFile):
+        if element.tag == "route-files":
+            routeFiles.extend(os.path.join(directory, f.strip()) for f in element.get("value").split(",") if f.strip())
+
+    flows = []
+    departures = []
+    randomFlows = []
+    for routeFile in routeFiles:
+        for event, element in ElementTree.iterparse(routeFile):
+            tag = element.tag
+            if tag == "flow":
+                begin = _getTime(element.get("begin"))
+                end = _getTime(element.get("end"), DEFAULT_FLOW_END)
+                if element.get("vehsPerHour"):
+                    flows.append(flowTuple(begin, end, 3600.0 / float(element.get("vehsPerHour"))))
+                elif element.get("period"):
+                    flows.append(flowTuple(begin, end, _getTime(element.get("period"))))
+                elif element.get("number"):
+                    flows.append(flowTuple(begin, end, (end - begin) / max(int(element.get("number")), 1)))
+                else:
+                    randomFlows.append((begin, end))
+                element.clear()
+            elif tag in ("vehicle", "trip"):
+                departures.append(_getTime(element.get("depart")))
+                element.clear()
+    return DepartureSchedule(flows, departures, randomFlows, scale)
+
+class FastForward():
+    """
+    Advances SUMO several steps at once while there is nothing for the simulation manager to
+    do (see SimulationManager.isIdle), stopping just before the next vehicle is due to depart
+    or the manager next needs to act, ex. the first vehicle could reach a lane controlled by an
+    intersection controller or a platoon reaches the end of its lane.
+    Without a manager there is never anything to control, so the simulation is run straight
+    to the end.
+    """
+
+    def __init__(self, schedule=None, minimumJumpSteps=MINIMUM_JUMP_STEPS):
+        self.schedule = schedule
+        self.minimumJumpSteps = minimumJumpSteps
+        self.jumps = 0
+        self.stepsSkipped = 0
+
+    def getSteps(self, manager, maxSteps):
+        """
+        Gets the number of steps that can be taken at once (at most maxSteps), 1 if the
+        manager needs to run on the next step
+        """
+        if maxSteps < self.minimumJumpSteps:
+            return 1
+        if not manager:
+            return maxSteps
+        if not manager.isIdle() or traci.simulation.getPendingVehicles():
+            return 1
+        if not self.schedule:
+            # Departures can't be predicted so the manager runs every step
+            return 1
+
+        time = traci.simulation.getTime()
+        stepLength = traci.simulation.getDeltaT()
+        nextTime = self.schedule.getNextDeparture(time)
+        timeToAction = manager.getTimeToNextAction()
+        if timeToAction is not None and (nextTime is None or time + timeToAction < nextTime):
+            nextTime = time + timeToAction
+        if nextTime is None:
+            return maxSteps
+        # Stop a step early so the manager sees the state just before it happens
+        steps = int(math.floor((nextTime - time) / stepLength + 1e-9)) - 1
+        return min(steps, maxSteps) if steps >= self.minimumJumpSteps else 1
+
+    def step(self, steps):
+        """
+        Advances the simulation by the given number of steps
+        """
+        if steps > 1:
+            traci.simulationStep(traci.simulation.getTime() + steps * traci.simulation.getDeltaT())
+            self.jumps = self.jumps + 1
+            self.stepsSkipped = self.stepsSkipped + steps - 1
+        else:
+            traci.simulationStep()
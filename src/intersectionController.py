@@ -1,58 +1,85 @@
-import traci
-import logging
-from simlib import flatten
+from backend import traci
+from reservations import ReservationTable
+from statecache import stateCache
+from vehicle import Vehicle
+from profiling import profiler
+from tracing import tracer
 
 class IntersectionController():
 
-    def __init__(self, intersection, zip=True):
-        lanes = traci.trafficlight.getControlledLanes(intersection)
+    def __init__(self, intersection, zip=True, conflicts=None, controlledLanes=None):
+        """
+        conflicts gives the lanes each controlled lane conflicts with (see
+        topology.Topology.getConflicts), if it isn't given every lane is treated as
+        conflicting with every other. The controlled lanes are requested from SUMO unless given.
+        """
+        lanes = controlledLanes or traci.trafficlight.getControlledLanes(intersection)
         self.lanesServed = set(lanes)
+        self.reservations = ReservationTable(self.lanesServed, conflicts)
         self.name = intersection
         self.platoons = []
-        self.platoonsZipped = set()
-        self.platoonZips = []
+        self._platoonSet = set()
         self.zip = zip
+        # When zipping, the order vehicles will cross the junction in is kept between steps.
+        # Vehicles are added when they join a platoon under this controller (waiting until
+        # they are on a controlled lane) and dropped once they are through the junction or
+        # leave the platoon. The vehicles taken from each platoon, and its membership version
+        # at the time, are kept so only platoons whose members have changed are looked at again
+        self._crossingOrder = []
+        self._waitingVehicles = []
+        self._vehicleOwners = dict()
+        self._ownedVehicles = dict()
+        self._memberVersions = dict()
+        # Statistics for the most recent update, read by the metrics recorder
+        self.reservedTime = 0
+        self.throughputLastStep = 0
+        # Platoons or vehicles left alone in the most recent update as they were beyond the horizon
+        self.skippedLastStep = 0
 
     def addPlatoon(self, platoon):
         """
         Adds a platoon to this intersection controller
         """
         self.platoons.append(platoon)
+        self._platoonSet.add(platoon)
         if self.zip:
             platoon.addControlledLanes(self.lanesServed)
 
-    def calculateNewReservedTime(self, pv, reservedTime):
+    def getCrossingTime(self, pv, speed):
         """
         Calculates the time that is needed to be reserved for a given platoon or vehicle (pv)
+        to cross the junction at the given speed
         """
-        # If this platoon is the first to post a reservation, the distance to the junction needs to be included
-        if reservedTime == 0:
-            lenThruJunc = self._getLanePosition(pv) + pv.getLength()
-        else:
-            lenThruJunc = pv.getLength() * 2 if self.zip else 1
-        return (0.5 if self.zip else 1.5) + reservedTime + (lenThruJunc / (pv.getSpeed() or 1))
+        lenThruJunc = pv.getLength() * 2 if self.zip else pv.getLength()
+        return (0.5 if self.zip else 1.5) + (lenThruJunc / (speed or 1))
 
-    def _eligibleZippings(self, platoon):
-        if len(self.platoonZips) >= 1:
-            z = self.platoonZips[-1]
-            if platoon.getLanePositionFromFront() - z[-1].getLanePositionFromFront() < 10 and platoon.getLanePositionFromFront() - z[-1].getLanePositionFromFront() > 0:
-                return z
+    def reserve(self, pv, time):
+        """
+        Reserves a slot for a platoon or vehicle (pv) to cross the junction, returning how
+        long it has to wait from the given time until its slot starts (0 if it can go as
+        soon as it arrives)
+        """
+        # Arrival is worked out at the speed the platoon could travel at rather than its
+        # current speed, so a platoon slowed down to meet its slot keeps that slot
+        freeSpeed = min(pv.getMaxSpeed(), stateCache.getLaneMaxSpeed(pv.getLane()))
+        eta = time + self._getLanePosition(pv) / freeSpeed
+        start = self.reservations.reserve(pv, pv.getLane(), eta, self.getCrossingTime(pv, freeSpeed))
+        return start - time if start > eta else 0
 
     def removeIrreleventPlatoons(self):
         """
         Function to remove any platoons from the intersection that have either left the sphere of influence or left the map
         """
         # Check if we need to remove any before adding new ones to the controller
-        for p in self.platoons:
-            if not p.isActive() or all([l not in self.lanesServed for l in p.getLanesOfAllVehicles()]):
+        self.throughputLastStep = 0
+        for p in list(self.platoons):
+            # A platoon whose lead vehicle is still on a controlled lane is always relevant
+            if not p.isActive() or (p.getLeadVehicle().getLane() not in self.lanesServed and
+                                    all([l not in self.lanesServed for l in p.getLanesOfAllVehicles()])):
+                # Platoons that are still active have made it through the junction
+                if p.isActive():
+                    self.throughputLastStep = self.throughputLastStep + p.getNumberOfVehicles()
                 self.removePlatoon(p)
-                if self.zip:
-                    for zip in self.platoonZips:
-                        for platoon in zip:
-                            if platoon == p:
-                                zip.remove(platoon)
-                        if not zip:
-                            self.platoonZips.remove(zip)
 
     def findAndAddReleventPlatoons(self, platoons):
         """
@@ -64,33 +91,95 @@ class IntersectionController():
 
         platoons.sort(key=platoonPosition)
         for p in platoons:
-            if p.getLane() in self.lanesServed and p not in self.platoons:
+            if p.isActive() and p.getLane() in self.lanesServed and p not in self._platoonSet:
                 self.addPlatoon(p)
 
     def getVehicleZipOrderThroughJunc(self):
         """
         Gets the order that a platoon should [pass through the junction if zipping is enabled
         """
-        def distSort(elem):
-            return elem.getLanePositionFromFront()
-
         if self.zip:
-            prelimList = flatten([self._zipPlatoons(z) for z in self.platoonZips])
-            prelimList.sort(key=distSort)
-            return prelimList
+            return self._crossingOrder
+
+    def _releaseVehicle(self, v):
+        # Stops tracking a vehicle's place in the crossing order, the caller removes it from the lists
+        owner = self._vehicleOwners.pop(v)
+        self._ownedVehicles[owner].discard(v)
+        self.reservations.release(v)
+
+    def _addMembers(self, p):
+        """
+        Takes on the vehicles that have joined the given platoon since it was last looked at
+        """
+        owned = self._ownedVehicles.setdefault(p, set())
+        for v in p.getAllVehicles():
+            if v in owned:
+                continue
+            previousOwner = self._vehicleOwners.get(v)
+            if previousOwner is None:
+                self._waitingVehicles.append(v)
+            else:
+                # Moved over from another platoon under this controller, it keeps its place
+                self._ownedVehicles[previousOwner].discard(v)
+            self._vehicleOwners[v] = p
+            owned.add(v)
 
-    def _generatePlatoonZips(self):
+    def _removeMembers(self, p):
         """
-        Generates all the zips for the platoons in the scenario
+        Gives up the vehicles that have left the given platoon since it was last looked at,
+        returning True if there were any
         """
+        left = self._ownedVehicles[p].difference(p.getAllVehicles())
+        for v in left:
+            self._releaseVehicle(v)
+        return bool(left)
+
+    def _updateCrossingOrder(self):
+        """
+        Brings the crossing order up to date with the vehicles that joined, crossed or
+        left since the last step, then sorts it by distance to the junction. Only platoons
+        whose membership has changed are compared against the vehicles taken from them.
+        Vehicles on different lanes move relative to each other, so the order is sorted
+        every step, as it is nearly sorted already this takes a single pass.
+        """
+        changed = []
         for p in self.platoons:
-            if p not in self.platoonsZipped:
-                eligibleZipping = self._eligibleZippings(p)
-                if eligibleZipping:
-                    eligibleZipping.append(p)
-                else:
-                    self.platoonZips.append([p])
-                self.platoonsZipped.add(p)
+            version = p.getMembershipVersion()
+            if self._memberVersions.get(p) != version:
+                self._memberVersions[p] = version
+                changed.append(p)
+        # Every platoon takes on its new vehicles first, so those moving between platoons
+        # (ex. split off the back of one) are handed over rather than given up
+        for p in changed:
+            self._addMembers(p)
+        left = False
+        for p in changed:
+            left = self._removeMembers(p) or left
+
+        order = self._crossingOrder
+        crossed = [v for v in order if v not in self._vehicleOwners or not v.isActive() or v.getLane() not in self.lanesServed]
+        if crossed or left:
+            for v in crossed:
+                # Through the junction (or out of the simulation)
+                if v in self._vehicleOwners:
+                    self._releaseVehicle(v)
+            order = [v for v in order if v in self._vehicleOwners]
+        arrived = []
+        waiting = []
+        for v in self._waitingVehicles:
+            if v not in self._vehicleOwners:
+                continue
+            if not v.isActive():
+                self._releaseVehicle(v)
+            elif v.getLane() in self.lanesServed:
+                arrived.append(v)
+            else:
+                waiting.append(v)
+        self._waitingVehicles = waiting
+        if arrived:
+            order = order + arrived
+        order.sort(key=Vehicle.getLanePositionFromFront)
+        self._crossingOrder = order
 
     def _getLanePosition(self, v):
         """
@@ -102,9 +191,11 @@ class IntersectionController():
                 return v.getLanePositionFromFront()
         return 1000
 
-    def getNewSpeed(self, pv, reservedTime):
+    def getNewSpeed(self, pv, timeUntilSlot):
         """
-        Gets the speed the platoon or vehicle should adhere to in order to pass through the intersection safely
+        Gets the speed the platoon or vehicle should adhere to in order to pass through the intersection safely.
+        timeUntilSlot is the time from now until its reserved slot starts, as returned by reserve, which
+        is 0 if it can cross as soon as it arrives
         """
         distanceToTravel = self._getLanePosition(pv)
         currentSpeed = pv.getSpeed()
@@ -114,7 +205,7 @@ class IntersectionController():
         # route.
         if distanceToTravel > 20:
             pv.setSpeedMode(23)
-            speed = distanceToTravel / (reservedTime or 1)
+            speed = distanceToTravel / (timeUntilSlot or 1)
             speed = max([speed, 0.5])
             if speed >= currentSpeed:
                 speed = pv.getMaxSpeed()
@@ -122,7 +213,7 @@ class IntersectionController():
             speed = pv.getMaxSpeed()
         else:
             return pv.getMaxSpeed()
-        if reservedTime == 0:
+        if timeUntilSlot == 0:
             return pv.getMaxSpeed()
         return speed
 
@@ -131,69 +222,100 @@ class IntersectionController():
         Removes a platoon from this controller and then resets its behaviour to default
         """
         self.platoons.remove(platoon)
+        self._platoonSet.discard(platoon)
+        self.reservations.release(platoon)
+        for v in platoon.getAllVehicles():
+            self.reservations.release(v)
+        if self.zip:
+            self._memberVersions.pop(platoon, None)
+            removed = self._ownedVehicles.pop(platoon, ())
+            if removed:
+                for v in removed:
+                    del self._vehicleOwners[v]
+                    self.reservations.release(v)
+                self._crossingOrder = [v for v in self._crossingOrder if v in self._vehicleOwners]
+                self._waitingVehicles = [v for v in self._waitingVehicles if v in self._vehicleOwners]
         # Resume normal speed behaviour
         platoon.removeTargetSpeed()
         platoon.setSpeedMode(31)
         if self.zip:
             platoon.removeControlledLanes(self.lanesServed)
 
-    def update(self):
+    def update(self, time=None, horizon=None):
         """
         Performs various functions to update the junction's state.
         1. Ensures that all vehicles being managed by the junction, have thier automatic
            stopping behaviour deactived (otherwise they are too cautious at the intersection)
         2. Removes platoons that are no longer in the sphere of influence of the function
-        3. Updates the speed of all platoons being managed by the controller.
+        3. Updates the speed of all platoons being managed by the controller, so that each
+           arrives at the junction when its reserved slot starts.
+        The current simulation time can be given to save querying it. If a horizon is given
+        only platoons (or vehicles) within that many metres of the junction are controlled,
+        others are left to drive normally until they reach it.
         """
-        reservedTime = 0
+        if time is None:
+            time = traci.simulation.getTime()
+        self.reservations.expire(time)
+        self.skippedLastStep = 0
+        zipOrder = None
         if self.zip:
-            self._generatePlatoonZips()
-            for v in self.getVehicleZipOrderThroughJunc():
+            with profiler.phase("intersection.zipOrder"):
+                self._updateCrossingOrder()
+                zipOrder = self.getVehicleZipOrderThroughJunc()
+            for v in zipOrder:
                 if v.isActive() and v.getLane() in self.lanesServed:
-                    speed = self.getNewSpeed(v, reservedTime)
+                    if horizon is not None and self._getLanePosition(v) > horizon:
+                        self.skippedLastStep = self.skippedLastStep + 1
+                        self.reservations.release(v)
+                        v.setSpeed(-1)
+                        continue
+                    speed = self.getNewSpeed(v, self.reserve(v, time))
                     v.setSpeed(speed)
-                    reservedTime = self.calculateNewReservedTime(v, reservedTime)
+                else:
+                    # The vehicle is through the junction
+                    self.reservations.release(v)
         else:
             for p in self.platoons:
                 # Update the speeds of the platoon if it has not passed the junction
                 if p.getLane() in self.lanesServed:
-                    speed = self.getNewSpeed(p, reservedTime)
+                    if horizon is not None and self._getLanePosition(p) > horizon:
+                        # Any slot it holds would only hold up conflicting lanes, it reserves
+                        # again once it is within the horizon
+                        self.skippedLastStep = self.skippedLastStep + 1
+                        self.reservations.release(p)
+                        p.removeTargetSpeed()
+                        continue
+                    speed = self.getNewSpeed(p, self.reserve(p, time))
                     if speed == -1:
                         p.removeTargetSpeed()
                     else:
                         p.setTargetSpeed(speed)
-                    reservedTime = self.calculateNewReservedTime(p, reservedTime)
-        self._logIntersectionStatus(reservedTime)
+        # The time until the last reserved slot ends
+        latestEnd = self.reservations.getLatestEnd()
+        reservedTime = latestEnd - time if latestEnd else 0
+        self.reservedTime = reservedTime
+        if tracer.summary:
+            with profiler.phase("intersection.logging"):
+                self._logIntersectionStatus(reservedTime, zipOrder)
 
-    def _logIntersectionStatus(self, reservation=None):
+    def _logIntersectionStatus(self, reservation=None, zipOrder=None):
         """
-        A function that logs the status of this intersection.
+        A function that logs the status of this intersection. In zip mode the order
+        already calculated by update should be given so that it isn't worked out again.
         """
         if self.platoons:
-            logging.info("------------%s Information------------", self.name)
+            log = tracer.logger
+            if not tracer.full:
+                log.info("%s: %s platoons, total time reserved: %s", self.name, len(self.platoons), reservation)
+                return
+            log.info("------------%s Information------------", self.name)
             if self.zip:
-                for v in self.getVehicleZipOrderThroughJunc():
+                for v in zipOrder or ():
                     if v.isActive():
-                        setSpeed = v._previouslySetValues['setSpeed'] if 'setSpeed' in v._previouslySetValues else "None"
-                        logging.info("Vehicle: %s, Target: %s, Current: %s", v.getName(), setSpeed, v.getSpeed())
-                logging.info("------------Platoon Zips------------")
-                for zip in self.platoonZips:
-                    logging.info("Zip: %s", [p.getID() for p in zip])
+                        setSpeed = v.getLastSetValue("setSpeed")
+                        log.info("Vehicle: %s, Target: %s, Current: %s", v.getName(), setSpeed, v.getSpeed())
             else:
                 for p in self.platoons:
-                    logging.info("Platoon: %s, Target: %s, Current: %s ", p.getID(), p.getTargetSpeed(), p.getSpeed())
+                    log.info("Platoon: %s, Target: %s, Current: %s ", p.getID(), p.getTargetSpeed(), p.getSpeed())
             if reservation:
-                logging.info("Total time reserved: %s", reservation)
-
-    def _zipPlatoons(self, platoons):
-        """
-        Zips all the vehicles in the given platoons into one continuous set
-        """
-        ret = []
-        iterations = max([len(p.getAllVehicles()) for p in platoons])
-        for i in range(0, iterations):
-            for p in platoons:
-                if len(p.getAllVehicles()) > i:
-                    if p.getAllVehicles()[i].getLane() in self.lanesServed:
-                        ret.append(p.getAllVehicles()[i])
-        return ret
\ No newline at end of file
+                log.info("Total time reserved: %s", reservation)
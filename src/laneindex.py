@@ -0,0 +1,80 @@
+from bisect import bisect_right
+
+from platoon import Platoon
+from statecache import stateCache
+
+# SUMO's default minimum gap, used for vehicles that haven't had theirs set
+DEFAULT_MIN_GAP = 2.5
+
+class LaneIndex():
+    """
+    The platoons on each lane in order of their lead vehicle's position, built from one
+    step's vehicle states so "which platoon is ahead of this point" is a binary search.
+    Vehicles that aren't in a platoon are held too, as nothing behind them can reach a
+    platoon beyond them. Platoons created during the step (ex. split off another) are
+    inserted as they are made, and platoons that are disbanded stay in place: the vehicles
+    of a merged platoon now belong to the platoon ahead of it, while those of any other
+    disbanded platoon are no longer in a platoon. Platoons are found by the lane their lead
+    vehicle is on, so a platoon whose rear vehicle is on another lane can't be reached.
+    As with SUMO's leader lookup, the search carries on to the next lane on the route if
+    there is nothing further along the lane, so a platoon just past a junction can be found.
+    """
+
+    def __init__(self, platoons=(), vehicles=()):
+        """
+        platoons are the active platoons and vehicles those that aren't in a platoon
+        """
+        self._lanes = dict()
+        entries = dict()
+        for i, item in enumerate(list(platoons) + list(vehicles)):
+            vehicle = item.getLeadVehicle() if isinstance(item, Platoon) else item
+            # The order an item was added breaks ties, so items are never compared
+            entries.setdefault(vehicle.getLane(), []).append((vehicle.getLanePosition(), i, item))
+        for lane, laneEntries in entries.items():
+            laneEntries.sort()
+            self._lanes[lane] = ([position for position, i, item in laneEntries], [item for position, i, item in laneEntries])
+
+    def add(self, platoon):
+        """
+        Adds a platoon created since the index was built
+        """
+        lead = platoon.getLeadVehicle()
+        positions, items = self._lanes.setdefault(lead.getLane(), ([], []))
+        i = bisect_right(positions, lead.getLanePosition())
+        positions.insert(i, lead.getLanePosition())
+        items.insert(i, platoon)
+
+    def getPlatoonAhead(self, lane, position, distance, nextLane=None):
+        """
+        Gets the platoon directly in front of the given position on a lane, if the back of its
+        rear vehicle is within distance metres. None if there isn't one or a vehicle that isn't
+        in a platoon is in between. If nothing is further along the lane the search continues
+        from the start of nextLane (the lane the vehicle will be on after this one), with
+        whatever distance is left once the end of the lane is reached.
+        """
+        entries = self._lanes.get(lane)
+        if entries:
+            positions, items = entries
+            for i in range(bisect_right(positions, position), len(items)):
+                item = items[i]
+                if not isinstance(item, Platoon):
+                    return None
+                if not item.isActive():
+                    if item._disbandReason == "Merged":
+                        continue
+                    return None
+                rear = item.getAllVehicles()[-1]
+                if not rear.isActive() or rear.getLane() != lane:
+                    return None
+                gap = rear.getLanePosition() - rear.getLength() - position
+                return item if gap <= distance else None
+        if nextLane is None:
+            return None
+        remaining = distance - (stateCache.getLaneLength(lane) - position)
+        if remaining < 0:
+            return None
+        return self.getPlatoonAhead(nextLane, 0, remaining)
+
+def getMinGap(vehicle):
+    minGap = vehicle.getLastSetValue("setMinGap")
+    return DEFAULT_MIN_GAP if minGap is None else minGap
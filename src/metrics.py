@@ -0,0 +1,150 @@
+from array import array
+import csv
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet output is optional, CSV is always available
+    pyarrow = None
+
+CSV = "csv"
+PARQUET = "parquet"
+FORMATS = (CSV, PARQUET)
+DEFAULT_CHUNK_SIZE = 10000
+
+# The tables recorded during a run, each column is (name, typecode) where a typecode of
+# None means the column holds strings
+STEP_COLUMNS = (("step", "l"), ("time", "d"), ("vehicles", "l"), ("activePlatoons", "l"), ("stoppedVehicles", "l"),
+                ("commandsIssued", "l"), ("commandsSuppressed", "l"), ("workSkipped", "l"))
+QUEUE_COLUMNS = (("step", "l"), ("edge", None), ("stoppedVehicles", "l"))
+PLATOON_COLUMNS = (("step", "l"), ("platoon", None), ("size", "l"), ("speed", "d"), ("lane", None))
+DISBAND_COLUMNS = (("step", "l"), ("platoon", None), ("size", "l"), ("reason", None))
+INTERSECTION_COLUMNS = (("step", "l"), ("intersection", None), ("platoons", "l"), ("reservedTime", "d"), ("throughput", "l"))
+
+class MetricsTable():
+    """
+    A columnar buffer for a single table of samples. Each column is preallocated to hold
+    one chunk of rows, once full the chunk is appended to the table's file and the buffer
+    is reused, so the memory used stays the same however long the run is.
+    """
+
+    def __init__(self, fileLocation, columns, fileFormat=CSV, chunkSize=DEFAULT_CHUNK_SIZE):
+        self.fileLocation = fileLocation
+        self.columnNames = [name for name, typecode in columns]
+        self._typecodes = [typecode for name, typecode in columns]
+        self._format = fileFormat
+        self._chunkSize = chunkSize
+        self._columns = [array(typecode, [0]) * chunkSize if typecode else [None] * chunkSize for typecode in self._typecodes]
+        self._rows = 0
+        self._file = None
+        self._writer = None
+        self.totalRows = 0
+
+    def append(self, *row):
+        for column, value in zip(self._columns, row):
+            column[self._rows] = value
+        self._rows = self._rows + 1
+        if self._rows == self._chunkSize:
+            self.flush()
+
+    def close(self):
+        self.flush()
+        if self._format == PARQUET:
+            if self._writer:
+                self._writer.close()
+        elif self._file:
+            self._file.close()
+        # Make sure every table has a file, even if nothing was recorded in it
+        elif not self.totalRows:
+            with open(self.fileLocation, "w", newline="") as f:
+                csv.writer(f).writerow(self.columnNames)
+
+    def flush(self):
+        """
+        Writes the rows currently buffered to the table's file
+        """
+        if not self._rows:
+            return
+        columns = [column[:self._rows] for column in self._columns]
+        if self._format == PARQUET:
+            batch = pyarrow.table({name: (column.tolist() if typecode else column)
+                                   for name, typecode, column in zip(self.columnNames, self._typecodes, columns)})
+            if not self._writer:
+                self._writer = pyarrow.parquet.ParquetWriter(self.fileLocation, batch.schema)
+            self._writer.write_table(batch)
+        else:
+            if not self._file:
+                self._file = open(self.fileLocation, "w", newline="")
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(self.columnNames)
+            self._writer.writerows(zip(*columns))
+            self._file.flush()
+        self.totalRows = self.totalRows + self._rows
+        self._rows = 0
+
+class MetricsRecorder():
+    """
+    Records time series of the simulation while it runs: a row per step, queue lengths per
+    edge, platoon sizes, platoon disbands and the state of each intersection controller.
+    Each is streamed to its own CSV (or Parquet) file in the given directory.
+    """
+
+    def __init__(self, outputDirectory, fileFormat=CSV, chunkSize=DEFAULT_CHUNK_SIZE):
+        if fileFormat not in FORMATS:
+            raise ValueError("Unknown metrics format %s, available formats: %s" % (fileFormat, FORMATS))
+        if fileFormat == PARQUET and not pyarrow:
+            raise ValueError("pyarrow must be installed to record metrics as %s" % PARQUET)
+        os.makedirs(outputDirectory, exist_ok=True)
+
+        def table(name, columns):
+            fileLocation = os.path.join(outputDirectory, "%s.%s" % (name, fileFormat))
+            return MetricsTable(fileLocation, columns, fileFormat, chunkSize)
+
+        self.steps = table("steps", STEP_COLUMNS)
+        self.queues = table("queues", QUEUE_COLUMNS)
+        self.platoons = table("platoons", PLATOON_COLUMNS)
+        self.disbands = table("disbands", DISBAND_COLUMNS)
+        self.intersections = table("intersections", INTERSECTION_COLUMNS)
+        self.step = 0
+        # Totals over the whole run, these are returned with the run's other metrics
+        self.disbandReasons = dict()
+        self.intersectionThroughput = dict()
+
+    def close(self):
+        for table in (self.steps, self.queues, self.platoons, self.disbands, self.intersections):
+            table.close()
+
+    def getSummary(self):
+        """
+        Gets totals for the whole run
+        """
+        summary = {"totalThroughput": sum(self.intersectionThroughput.values())}
+        for reason, count in self.disbandReasons.items():
+            summary["disbanded: %s" % reason] = count
+        return summary
+
+    def recordDisband(self, platoon):
+        reason = platoon._disbandReason
+        self.disbands.append(self.step, platoon.getID(), platoon.getNumberOfVehicles(), reason)
+        self.disbandReasons[reason] = self.disbandReasons.get(reason, 0) + 1
+
+    def recordStep(self, time, manager, stoppedCount, commandsIssued, commandsSuppressed, workSkipped=0):
+        """
+        Records everything for a single step of the manager, workSkipped is the work the
+        manager's scheduler skipped during the step
+        """
+        step = self.step
+        activePlatoons = manager.getActivePlatoons()
+        self.steps.append(step, time, len(manager.vehicles), len(activePlatoons), sum(stoppedCount.values()),
+                          commandsIssued, commandsSuppressed, workSkipped)
+        for edge, count in stoppedCount.items():
+            self.queues.append(step, edge, count)
+        for platoon in activePlatoons:
+            self.platoons.append(step, platoon.getID(), platoon.getNumberOfVehicles(), platoon.getSpeed(), platoon.getLane())
+        for controller in manager.intersections:
+            self.intersections.append(step, controller.name, len(controller.platoons), controller.reservedTime,
+                                      controller.throughputLastStep)
+            self.intersectionThroughput[controller.name] = self.intersectionThroughput.get(controller.name, 0) + controller.throughputLastStep
+        self.step = step + 1
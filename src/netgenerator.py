@@ -0,0 +1,223 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import subprocess
+import xml.etree.ElementTree as ElementTree
+
+# Written alongside each generated map so that it is registered as a scenario location
+GENERATED_MAP_FILE_NAME = "generated.json"
+NO_TLS_MODIFIER = "_no_TLS"
+DEFAULT_SPACING = 200
+DEFAULT_SPEED = 13.89
+DEFAULT_FLOW_END = 5000
+# The single all green phase the no TLS variant's traffic lights are given, so intersection
+# controllers still find them but never have to wait for a light
+NO_TLS_PHASE_DURATION = 1000
+
+def _getNodeID(row, col):
+    return "J%s_%s" % (row, col)
+
+def _getEdgeID(fromNode, toNode):
+    return "%sto%s" % (fromNode, toNode)
+
+def buildGrid(rows, cols, spacing=DEFAULT_SPACING, horizontalLanes=1, verticalLanes=1, horizontalFlow=300, verticalFlow=300):
+    """
+    Lays out a grid of rows by cols junctions spacing metres apart, with a road leading off
+    the edge of the network from every junction on the outside. Every row and column has a
+    flow in each direction along its whole length (in vehicles per hour).
+    Returns the nodes (id, x, y, type), edges (id, from, to, lanes) and flows (id, from edge,
+    to edge, vehicles per hour).
+    """
+    if rows < 1 or cols < 1:
+        raise ValueError("A grid needs at least one row and column of junctions")
+    nodes = []
+    edges = []
+    flows = []
+    for row in range(rows):
+        for col in range(cols):
+            nodes.append((_getNodeID(row, col), col * spacing, row * spacing, "traffic_light"))
+
+    def addRoad(fromNode, toNode, lanes):
+        edges.append((_getEdgeID(fromNode, toNode), fromNode, toNode, lanes))
+        edges.append((_getEdgeID(toNode, fromNode), toNode, fromNode, lanes))
+
+    for row in range(rows):
+        for col in range(cols):
+            if col + 1 < cols:
+                addRoad(_getNodeID(row, col), _getNodeID(row, col + 1), horizontalLanes)
+            if row + 1 < rows:
+                addRoad(_getNodeID(row, col), _getNodeID(row + 1, col), verticalLanes)
+
+    # The fringe, where vehicles enter and leave the network
+    for row in range(rows):
+        west, east = "W%s" % row, "E%s" % row
+        nodes.append((west, -spacing, row * spacing, "priority"))
+        nodes.append((east, cols * spacing, row * spacing, "priority"))
+        addRoad(west, _getNodeID(row, 0), horizontalLanes)
+        addRoad(east, _getNodeID(row, cols - 1), horizontalLanes)
+        flows.append(("eastflow%s" % row, _getEdgeID(west, _getNodeID(row, 0)), _getEdgeID(_getNodeID(row, cols - 1), east), horizontalFlow))
+        flows.append(("westflow%s" % row, _getEdgeID(east, _getNodeID(row, cols - 1)), _getEdgeID(_getNodeID(row, 0), west), horizontalFlow))
+    for col in range(cols):
+        south, north = "S%s" % col, "N%s" % col
+        nodes.append((south, col * spacing, -spacing, "priority"))
+        nodes.append((north, col * spacing, rows * spacing, "priority"))
+        addRoad(south, _getNodeID(0, col), verticalLanes)
+        addRoad(north, _getNodeID(rows - 1, col), verticalLanes)
+        flows.append(("northflow%s" % col, _getEdgeID(south, _getNodeID(0, col)), _getEdgeID(_getNodeID(rows - 1, col), north), verticalFlow))
+        flows.append(("southflow%s" % col, _getEdgeID(north, _getNodeID(rows - 1, col)), _getEdgeID(_getNodeID(0, col), south), verticalFlow))
+    return nodes, edges, flows
+
+def _writeNodes(fileLocation, nodes):
+    root = ElementTree.Element("nodes")
+    for nodeID, x, y, nodeType in nodes:
+        ElementTree.SubElement(root, "node", id=nodeID, x=str(x), y=str(y), type=nodeType)
+    ElementTree.ElementTree(root).write(fileLocation)
+
+def _writeEdges(fileLocation, edges, speed):
+    root = ElementTree.Element("edges")
+    for edgeID, fromNode, toNode, lanes in edges:
+        ElementTree.SubElement(root, "edge", id=edgeID, to=toNode, numLanes=str(lanes), speed=str(speed), attrib={"from": fromNode})
+    ElementTree.ElementTree(root).write(fileLocation)
+
+def _writeRoutes(fileLocation, flows, flowEnd):
+    # The same vehicle type and departure settings as the hand made maps
+    root = ElementTree.Element("routes")
+    ElementTree.SubElement(root, "vType", id="normal_car", vClass="passenger", departspeed="max")
+    for flowID, fromEdge, toEdge, vehsPerHour in flows:
+        if vehsPerHour > 0:
+            ElementTree.SubElement(root, "flow", id=flowID, type="normal_car", begin="0", end=str(flowEnd), vehsPerHour=str(vehsPerHour),
+                                   to=toEdge, departPos="last", attrib={"from": fromEdge})
+    ElementTree.ElementTree(root).write(fileLocation)
+
+def _writeConfig(fileLocation, mapName):
+    root = ElementTree.Element("configuration")
+    inputElement = ElementTree.SubElement(root, "input")
+    ElementTree.SubElement(inputElement, "net-file", value="%s.net.xml" % mapName)
+    ElementTree.SubElement(inputElement, "route-files", value="%s.rou.xml" % mapName)
+    ElementTree.ElementTree(root).write(fileLocation)
+
+def _writeAllGreenPrograms(netFile, fileLocation):
+    """
+    Writes a program for every traffic light in a network that keeps all of its links green
+    """
+    root = ElementTree.Element("tlLogics")
+    for event, element in ElementTree.iterparse(netFile):
+        if element.tag == "tlLogic":
+            links = len(element.find("phase").get("state"))
+            program = ElementTree.SubElement(root, "tlLogic", id=element.get("id"), type="static", programID=element.get("programID"), offset="0")
+            ElementTree.SubElement(program, "phase", duration=str(NO_TLS_PHASE_DURATION), state="G" * links)
+            element.clear()
+    ElementTree.ElementTree(root).write(fileLocation)
+
+def _writeGeneratedMapInfo(mapDirectory, name, defaultTrafficScale, parameters=None):
+    # Marks the map as generated so findGeneratedMaps registers it under its name
+    with open(os.path.join(mapDirectory, GENERATED_MAP_FILE_NAME), "w") as f:
+        json.dump({"name": name, "mapName": name, "defaultTrafficScale": defaultTrafficScale, "parameters": parameters or dict()}, f, indent=2)
+
+def _runNetconvert(args):
+    from sumolib import checkBinary
+    subprocess.run([checkBinary("netconvert")] + args + ["--no-turnarounds", "true", "--no-warnings", "true"], check=True)
+
+def writeScenario(name, nodes, edges, flows, mapsDirectory, speed=DEFAULT_SPEED, flowEnd=DEFAULT_FLOW_END, defaultTrafficScale=1, parameters=None):
+    """
+    Writes a map and its no TLS variant to mapsDirectory (a folder for each, as with the hand
+    made maps) and registers it as a scenario location under the given name. The network is
+    built from its nodes and edges with netconvert, the traffic lights of the no TLS variant
+    are left green for the intersection controllers to manage.
+    """
+    for mapName in (name, name + NO_TLS_MODIFIER):
+        os.makedirs(os.path.join(mapsDirectory, mapName), exist_ok=True)
+
+    def getLocation(mapName, extension):
+        return os.path.join(mapsDirectory, mapName, mapName + extension)
+
+    nodeFile = getLocation(name, ".nod.xml")
+    edgeFile = getLocation(name, ".edg.xml")
+    netFile = getLocation(name, ".net.xml")
+    _writeNodes(nodeFile, nodes)
+    _writeEdges(edgeFile, edges, speed)
+    _runNetconvert(["--node-files", nodeFile, "--edge-files", edgeFile, "--output-file", netFile])
+
+    programFile = getLocation(name + NO_TLS_MODIFIER, ".tll.xml")
+    _writeAllGreenPrograms(netFile, programFile)
+    _runNetconvert(["--sumo-net-file", netFile, "--tllogic-files", programFile, "--output-file", getLocation(name + NO_TLS_MODIFIER, ".net.xml")])
+
+    for mapName in (name, name + NO_TLS_MODIFIER):
+        _writeRoutes(getLocation(mapName, ".rou.xml"), flows, flowEnd)
+        _writeConfig(getLocation(mapName, ".sumocfg"), mapName)
+    _writeGeneratedMapInfo(os.path.join(mapsDirectory, name), name, defaultTrafficScale, parameters)
+    logging.info("Generated %s (%s junctions, %s edges, %s flows)", name, sum(1 for n in nodes if n[3] == "traffic_light"), len(edges), len(flows))
+
+def generateGrid(mapsDirectory, rows, cols, name=None, spacing=DEFAULT_SPACING, lanes=1, flow=300, speed=DEFAULT_SPEED,
+                 flowEnd=DEFAULT_FLOW_END, defaultTrafficScale=1):
+    """
+    Generates a grid of rows by cols signalled junctions with the given number of lanes on
+    every road and a flow (vehicles per hour) in each direction along every row and column
+    """
+    name = name or "Grid%sx%sL%s" % (rows, cols, lanes)
+    nodes, edges, flows = buildGrid(rows, cols, spacing, lanes, lanes, flow, flow)
+    writeScenario(name, nodes, edges, flows, mapsDirectory, speed, flowEnd, defaultTrafficScale,
+                  dict(kind="grid", rows=rows, cols=cols, spacing=spacing, lanes=lanes, flow=flow))
+    return name
+
+def generateArterial(mapsDirectory, junctions, name=None, spacing=DEFAULT_SPACING, lanes=2, sideLanes=1, flow=900, sideFlow=150,
+                     speed=DEFAULT_SPEED, flowEnd=DEFAULT_FLOW_END, defaultTrafficScale=1):
+    """
+    Generates an arterial road through the given number of signalled junctions, each crossed
+    by a side road. The arterial and the side roads have their own lane counts and flows.
+    """
+    name = name or "Arterial%sL%s" % (junctions, lanes)
+    nodes, edges, flows = buildGrid(1, junctions, spacing, lanes, sideLanes, flow, sideFlow)
+    writeScenario(name, nodes, edges, flows, mapsDirectory, speed, flowEnd, defaultTrafficScale,
+                  dict(kind="arterial", junctions=junctions, spacing=spacing, lanes=lanes, sideLanes=sideLanes, flow=flow, sideFlow=sideFlow))
+    return name
+
+def findGeneratedMaps(mapsDirectory):
+    """
+    Gets the (name, mapName, defaultTrafficScale) of every map generated into mapsDirectory
+    """
+    generatedMaps = []
+    for generatedFile in sorted(glob.glob(os.path.join(mapsDirectory, "*", GENERATED_MAP_FILE_NAME))):
+        try:
+            with open(generatedFile) as f:
+                info = json.load(f)
+            generatedMaps.append((info["name"], info["mapName"], info["defaultTrafficScale"]))
+        except (OSError, ValueError, KeyError):
+            logging.warning("Could not read generated map %s", generatedFile)
+    return generatedMaps
+
+def getDefaultMapsDirectory():
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "maps")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates grid and arterial maps (with no TLS variants) and registers them as scenario locations")
+    parser.add_argument("--maps", dest="mapsDirectory", default=getDefaultMapsDirectory(), help="directory to write the maps to")
+    parser.add_argument("--name", help="name to register the map under, by default it is named after its layout")
+    parser.add_argument("--spacing", type=float, default=DEFAULT_SPACING, help="distance between junctions in metres")
+    parser.add_argument("--speed", type=float, default=DEFAULT_SPEED, help="speed limit of every road in m/s")
+    parser.add_argument("--end", dest="flowEnd", type=float, default=DEFAULT_FLOW_END, help="time flows stop departing")
+    parser.add_argument("--scale", dest="defaultTrafficScale", type=float, default=1, help="the map's default traffic scale")
+    layouts = parser.add_subparsers(dest="layout", required=True)
+    grid = layouts.add_parser("grid", help="a grid of junctions with flows along every row and column")
+    grid.add_argument("rows", type=int)
+    grid.add_argument("cols", type=int)
+    grid.add_argument("--lanes", type=int, default=1)
+    grid.add_argument("--flow", type=float, default=300, help="vehicles per hour in each direction of every row and column")
+    arterial = layouts.add_parser("arterial", help="an arterial road through a line of junctions, each crossed by a side road")
+    arterial.add_argument("junctions", type=int)
+    arterial.add_argument("--lanes", type=int, default=2)
+    arterial.add_argument("--side-lanes", dest="sideLanes", type=int, default=1)
+    arterial.add_argument("--flow", type=float, default=900, help="vehicles per hour in each direction of the arterial")
+    arterial.add_argument("--side-flow", dest="sideFlow", type=float, default=150, help="vehicles per hour in each direction of every side road")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+    common = dict(name=args.name, spacing=args.spacing, speed=args.speed, flowEnd=args.flowEnd, defaultTrafficScale=args.defaultTrafficScale)
+    if args.layout == "grid":
+        name = generateGrid(args.mapsDirectory, args.rows, args.cols, lanes=args.lanes, flow=args.flow, **common)
+    else:
+        name = generateArterial(args.mapsDirectory, args.junctions, lanes=args.lanes, sideLanes=args.sideLanes, flow=args.flow,
+                                sideFlow=args.sideFlow, **common)
+    print("Run it with: python scenario_runner.py %s <scenario number>" % name)
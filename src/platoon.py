@@ -1,28 +1,59 @@
-import logging
-import traci
 import random
+from commandbuffer import commandBuffer
+from statecache import stateCache
+from routes import routeRegistry
+from tracing import tracer
+
+try:
+    import numpy
+except ImportError:
+    # Followers are controlled one vehicle at a time instead
+    numpy = None
+
+# Followers within this many metres of the vehicle in front follow the platoon's speed
+FOLLOWING_DISTANCE = 5
 
 class Platoon():
 
-    def __init__(self, startingVehicles, maxVehicles=0):
-        """Create a platoon, setting default values for all variables"""
-        logging.info("Creating a new platoon with: %s", startingVehicles)
+    def __init__(self, startingVehicles, maxVehicles=0, manager=None):
+        """Create a platoon, setting default values for all variables.
+        If a manager is given it is notified of any changes in membership, lane or
+        active status so it can keep its indexes up to date"""
+        if tracer.summary:
+            tracer.logger.info("Creating a new platoon with: %s", [v.getName() for v in startingVehicles])
         self._vehicles = list(startingVehicles)
 
         self._active = True
         self._color = (random.randint(0, 255), random.randint(
             0, 255), random.randint(0, 255))
         self._currentSpeed = self.getLeadVehicle().getSpeed()
+        # The lead vehicle's speed at the update before last, to tell if it is holding its speed
+        self._previousSpeed = None
         self._disbandReason = None
         self._eligibleForMerging = False
+        # The speed followers should keep to this step, set by update
+        self._followerSpeed = None
         self._lane = self.getLeadVehicle().getLane()
         self._lanePosition = self.getLeadVehicle().getLanePosition()
         self._controlledLanes = set()
+        # The route state the last path convergence check was made against, and the index
+        # of the first vehicle found not to follow the lead vehicle (None if they all do)
+        self._convergenceKey = None
+        self._divergingIndex = None
+        # Set when membership changes, so the platoon is updated on the next step even if
+        # the scheduler would otherwise skip it
+        self._dirty = False
+        # Goes up every time vehicles join or leave, so others can tell when membership has changed
+        self._membershipVersion = 0
         self._targetSpeed = -1
         self._maxVehicles = maxVehicles
+        self._manager = manager
 
+        if self._manager:
+            self._manager.platoonCreated(self)
         self.getLeadVehicle().setColor(self._color)
         self.startBehaviour(startingVehicles[1:])
+        self._dirty = True
 
     def addControlledLanes(self, lanes):
         for lane in lanes:
@@ -30,12 +61,27 @@ class Platoon():
 
     def addVehicle(self, vehicle):
         """Adds a single vehicle to this platoon"""
-        if self._maxVehicles and len(self._vehicles) + 1 > self._maxVehicles:
+        self.addVehicles([vehicle, ])
+
+    def addVehicles(self, vehicles):
+        """Adds the given vehicles to the back of this platoon (in order), setting up their
+        platoon behaviour together and updating the platoon once. Vehicles already in the
+        platoon are skipped so none can appear twice"""
+        vehicles = [v for v in vehicles if v not in self._vehicles]
+        if not self.canAddVehicles(vehicles):
             raise ValueError("Cannot add a new vehicle to the platoon, we've exceeded the maximum allowed")
-        self._vehicles.append(vehicle)
-        self.startBehaviour([vehicle, ])
-        logging.info("Adding %s to platoon %s, New length: %s",
-                     vehicle.getName(), self.getID(), len(self._vehicles))
+        if not vehicles:
+            return
+        self._vehicles.extend(vehicles)
+        self._membershipVersion = self._membershipVersion + 1
+        if self._manager:
+            for vehicle in vehicles:
+                self._manager.platoonVehicleAdded(self, vehicle)
+        self.startBehaviour(vehicles)
+        self._dirty = True
+        if tracer.full:
+            tracer.logger.info("Adding %s to platoon %s, New length: %s",
+                               [v.getName() for v in vehicles], self.getID(), len(self._vehicles))
 
     def canAddVehicles(self, vehicles):
         """ Determines if we can add the given vehicles to this platoon.
@@ -53,22 +99,42 @@ class Platoon():
     def checkVehiclePathsConverge(self, vehicles):
         # Check that the given vehicles are going to follow the lead
         # vehicle into the next edge
-        leadVehicleRoute = self.getLeadVehicle().getRemainingRoute()
-        if len(leadVehicleRoute) > 1:
-            leadVehicleNextEdge = leadVehicleRoute[1]
-            for vehicle in vehicles:
-                if leadVehicleNextEdge not in vehicle.getRoute():
-                    return False
-        return True
+        leadVehicle = self.getLeadVehicle()
+        if not leadVehicle.isActive():
+            return False
+        return routeRegistry.converges(leadVehicle.getRouteID(), leadVehicle.getRouteIndex(),
+                                       [v.getRouteID() for v in vehicles])
+
+    def _getDivergingIndex(self):
+        """
+        Gets the index of the first vehicle whose path no longer follows the lead vehicle onto
+        its next edge, None if they all do. This only changes when the lead vehicle moves onto
+        its next edge, the membership changes or a route changes, so otherwise the previous
+        result is used.
+        """
+        leadVehicle = self.getLeadVehicle()
+        key = (leadVehicle.getRouteID(), leadVehicle.getRouteIndex(), len(self._vehicles), stateCache.store.routeChanges)
+        if key != self._convergenceKey:
+            self._convergenceKey = key
+            self._divergingIndex = routeRegistry.getFirstDiverging(key[0], key[1], [v.getRouteID() for v in self._vehicles])
+        return self._divergingIndex
 
     def disband(self):
         """Marks a platoon as dead and returns vehicles to normal"""
         self.stopBehaviour()
         self._active = False
-        logging.info("Disbanding platoon: %s", self.getID())
+        if self._manager:
+            self._manager.platoonDisbanded(self)
+        if tracer.summary:
+            tracer.logger.info("Disbanding platoon: %s (%s)", self.getID(), self._disbandReason)
 
     def getAcceleration(self):
-        return max([v.getAcceleration() for v in self.getAllVehicles()])
+        return max([v.getAcceleration() for v in self.getActiveVehicles()], default=0)
+
+    def getActiveVehicles(self):
+        """Retrieve the vehicles in this platoon that are still in the simulation, the others
+        can't be read from until the platoon is disbanded on its next update"""
+        return [v for v in self._vehicles if v.isActive()]
 
     def getAllVehicles(self):
         """Retrieve the list of all the vehicles in this platoon"""
@@ -93,11 +159,11 @@ class Platoon():
 
     def getLanePositionFromFront(self, lane=None):
         if lane:
-            vehiclesInLane = [v for v in self.getAllVehicles() if v.getLane() == lane]
+            vehiclesInLane = [v for v in self.getActiveVehicles() if v.getLane() == lane]
             if vehiclesInLane:
-                return traci.lane.getLength(lane) - vehiclesInLane[0].getLanePositionFromFront()
+                return stateCache.getLaneLength(lane) - vehiclesInLane[0].getLanePositionFromFront()
         else:
-            return traci.lane.getLength(self._lane) - self._lanePosition
+            return stateCache.getLaneLength(self._lane) - self._lanePosition
 
     def getLeadVehicle(self):
         return self._vehicles[0]
@@ -107,19 +173,26 @@ class Platoon():
             Done by taking the distance between the vehicle's front
             bumper and the end of the lane
         """
-        laneLen = traci.lane.getLength(self._lane)
-        front = laneLen - self.getLeadVehicle().getLanePosition()
-        rear = laneLen - self._vehicles[-1].getLanePosition()
-        rearVehicleLength = self._vehicles[-1].getLength() * 2
+        vehicles = self.getActiveVehicles()
+        if not vehicles:
+            return 0
+        laneLen = stateCache.getLaneLength(self._lane)
+        front = laneLen - vehicles[0].getLanePosition()
+        rear = laneLen - vehicles[-1].getLanePosition()
+        rearVehicleLength = vehicles[-1].getLength() * 2
         return rear - front + rearVehicleLength
 
     def getLengthOfSingleVehicle(self):
-        return self.getLeadVehicle().getLength()
+        vehicles = self.getActiveVehicles()
+        return vehicles[0].getLength() if vehicles else 0
+
+    def getMembershipVersion(self):
+        return self._membershipVersion
 
     def getMaxSpeed(self):
         """ Gets the maximum speed of the platoon
         """
-        return max([v.getMaxSpeed() for v in self.getAllVehicles()])
+        return max([v.getMaxSpeed() for v in self.getActiveVehicles()], default=0)
 
     def getNumberOfVehicles(self):
         return len(self._vehicles)
@@ -127,17 +200,47 @@ class Platoon():
     def getTargetSpeed(self):
         return self._targetSpeed
 
+    def isDirty(self, speedTolerance=0):
+        """
+        Returns True if the platoon needs updating on this step: its membership has changed,
+        its lead vehicle has changed lane or its speed has moved more than speedTolerance
+        from the last update, or it is under the control of an intersection
+        """
+        leadVehicle = self.getLeadVehicle()
+        # A platoon whose lead vehicle has left needs updating so it is disbanded
+        if self._dirty or self._targetSpeed != -1 or self._controlledLanes or not leadVehicle.isActive():
+            return True
+        return leadVehicle.getLane() != self._lane or abs(leadVehicle.getSpeed() - self._currentSpeed) > speedTolerance
+
+    def isSteady(self):
+        """
+        Returns True if updating the platoon would send nothing new while its lead vehicle stays
+        on its lane: the lead vehicle is holding its speed, nothing is waiting to merge or
+        controlling it, and every follower is in the lead vehicle's lane following at the
+        platoon's speed
+        """
+        leadVehicle = self.getLeadVehicle()
+        if self.isDirty() or self.canMerge() or self._currentSpeed == 0 or self._previousSpeed != self._currentSpeed:
+            return False
+        lane = leadVehicle.getLane()
+        for veh in self._vehicles[1:]:
+            if not veh.isActive() or veh.getLane() != lane or veh.getLastSetValue("setSpeed") != self._followerSpeed:
+                return False
+            leader = veh.getLeader()
+            if not leader or leader[1] > FOLLOWING_DISTANCE:
+                return False
+        return True
+
     def isActive(self):
         """Is the platoon currently active within the scenario"""
         return self._active
 
     def mergePlatoon(self, platoon):
-        """Merges the given platoon into the current platoon"""
-        if self.checkVehiclePathsConverge(platoon.getAllVehicles()) and platoon.getLane() == self.getLane():
-            platoon.disband()
+        """Merges the given platoon into the current platoon, its vehicles all join in one go"""
+        if self.checkVehiclePathsConverge(platoon.getAllVehicles()) and platoon.getLane() == self.getLane() and self.canAddVehicles(platoon.getAllVehicles()):
             platoon._disbandReason = "Merged"
-            for vehicle in platoon.getAllVehicles():
-                self.addVehicle(vehicle)
+            platoon.disband()
+            self.addVehicles(platoon.getAllVehicles())
         self._eligibleForMerging = False
         platoon._eligibleForMerging = False
 
@@ -181,6 +284,21 @@ class Platoon():
         for v in self.getAllVehicles():
             v.setSpeedMode(speedMode)
 
+    def split(self, index):
+        """
+        Splits the vehicles from the given index onwards off into a new platoon behind this
+        one (with the same manager and maximum size), which is returned
+        """
+        if not 0 < index < len(self._vehicles):
+            raise ValueError("A platoon of %s vehicles can't be split at %s" % (len(self._vehicles), index))
+        tail = self._vehicles[index:]
+        del self._vehicles[index:]
+        self._dirty = True
+        self._membershipVersion = self._membershipVersion + 1
+        if tracer.summary:
+            tracer.logger.info("Splitting %s from platoon %s", [v.getName() for v in tail], self.getID())
+        return Platoon(tail, self._maxVehicles, self._manager)
+
     def startBehaviour(self, vehicles):
         """A function to start platooning a specific set of vehicles"""
         if self.isActive():
@@ -231,13 +349,17 @@ class Platoon():
                 self.disband()
 
             # Location Info Update
+            previousLane = self._lane
             self._lane = self.getLeadVehicle().getLane()
+            if self._manager and previousLane != self._lane:
+                self._manager.platoonLaneChanged(self, previousLane)
             self._lanePosition = self.getLeadVehicle().getLanePosition()
 
             # Speed Update
             leadVehicleSpeed = self.getLeadVehicle().getSpeed()
             if self._currentSpeed != 0 and leadVehicleSpeed == 0:
                 self._eligibleForMerging = True
+            self._previousSpeed = self._currentSpeed
             self._currentSpeed = leadVehicleSpeed
             if self._targetSpeed != -1:
                 self._updateSpeed(self._targetSpeed)
@@ -248,11 +370,16 @@ class Platoon():
 
             # Route updates
             # Check that all cars still want to continue onto the
-            # next edge, otherwise disband the platoon
-            if not self._currentSpeed == 0:
-                if not self.checkVehiclePathsConverge(self.getAllVehicles()):
+            # next edge, otherwise the vehicles from the first one that
+            # doesn't are split off into their own platoon
+            if not self._currentSpeed == 0 and self.isActive():
+                divergingIndex = self._getDivergingIndex()
+                if divergingIndex:
+                    self.split(divergingIndex)
+                elif divergingIndex == 0:
                     self._disbandReason = "Platoon paths now diverge"
-                    self.disband()            
+                    self.disband()
+        self._dirty = False
 
     def _updateSpeed(self, speed, inclLeadingVeh=True):
         """ Sets the speed of all vehicles in the platoon
@@ -264,24 +391,99 @@ class Platoon():
         if inclLeadingVeh and self.getLeadVehicle().getLane() not in self._controlledLanes:
             self.getLeadVehicle().setSpeed(speed)
 
-        leadVehEdge = self.getLeadVehicle().getEdge()
-        targetLane = self.getLeadVehicle().getLaneIndex()
-
-        # Non leading vehicles should follow the speed of the vehicle in front
-        vehicles = self._vehicles[1:]
-        for veh in vehicles:
-            try:
-                if veh.getEdge() == leadVehEdge:
-                    veh.setTargetLane(targetLane)
-            except traci.TraCIException:
-                logging.error("Could not change lane of %s", veh.getName())
-            # Only set the speed if the vehicle is not in a lane controlled by a third party.
-            if veh.getLane() not in self._controlledLanes:
-                # If we're in range of the leader and they are moving
-                # follow thier speed
-                # Otherwise follow vehicle speed limit rules to catch up
+        # Followers are all updated together, by the manager once every platoon has been
+        # updated, or straight away if this platoon has no manager
+        self._followerSpeed = speed
+        if not self._manager:
+            updateFollowers([self])
+
+def updateFollowers(platoons):
+    """
+    Sets the lane and speed of every follower in the given platoons in one pass.
+    Followers on the same edge as their lead vehicle are moved into its lane. Followers
+    within FOLLOWING_DISTANCE of the vehicle in front follow the platoon's speed while it
+    is moving, otherwise they fall back to SUMO's speed rules to catch up. Followers in
+    lanes controlled by an intersection are left to the intersection, and those that have
+    left the simulation are skipped. The vehicle store's columns are worked on as arrays
+    when numpy is installed.
+    """
+    if numpy is None:
+        _updateFollowersLoop(platoons)
+    else:
+        _updateFollowersArrays(platoons)
+
+def _updateFollowersLoop(platoons):
+    for platoon in platoons:
+        speed = platoon._followerSpeed
+        lead = platoon.getLeadVehicle()
+        if speed is None or not lead.isActive():
+            continue
+        leadVehEdge = lead.getEdge()
+        targetLane = lead.getLaneIndex()
+        moving = platoon._currentSpeed != 0
+        for veh in platoon._vehicles[1:]:
+            if not veh.isActive():
+                continue
+            # Lane changes are buffered, any failure is logged when the commands are sent
+            if veh.getEdge() == leadVehEdge:
+                veh.setTargetLane(targetLane)
+            # Only set the speed if the vehicle is not in a lane controlled by a third party
+            if veh.getLane() not in platoon._controlledLanes:
                 leadVeh = veh.getLeader()
-                if leadVeh and leadVeh[1] <= 5 and self._currentSpeed != 0:
+                if leadVeh and leadVeh[1] <= FOLLOWING_DISTANCE and moving:
                     veh.setSpeed(speed)
                 else:
                     veh.setSpeed(-1)
+
+def _updateFollowersArrays(platoons):
+    followers = []
+    counts = []
+    speeds = []
+    leadEdges = []
+    targetLanes = []
+    controlledLanes = []
+    for platoon in platoons:
+        vehicles = platoon._vehicles
+        lead = vehicles[0]
+        if platoon._followerSpeed is None or len(vehicles) < 2 or not lead.isActive():
+            continue
+        followers.extend(vehicles[1:])
+        counts.append(len(vehicles) - 1)
+        controlledLanes.append(platoon._controlledLanes)
+        # A stopped platoon's followers catch up rather than follow its speed
+        speeds.append(platoon._followerSpeed if platoon._currentSpeed != 0 else -1)
+        leadEdges.append(lead.getEdge())
+        targetLanes.append(lead.getLaneIndex())
+    if not followers:
+        return
+
+    store = stateCache.store
+    rows = numpy.array([v.getRow() for v in followers], dtype=numpy.intp)
+    # Views of the store's columns, only held for this call as the store can't grow while they exist
+    active = numpy.frombuffer(store.active, dtype=numpy.int8)
+    leaderGaps = numpy.frombuffer(store.leaderGap, dtype=numpy.float64)
+    commandedSpeeds = numpy.frombuffer(store.commandedSpeed, dtype=numpy.float64)
+    # Released vehicles have no row
+    isActive = (rows >= 0) & (active[rows] == 1)
+    rows = numpy.where(isActive, rows, 0)
+
+    # Lane changes are buffered, any failure is logged when the commands are sent
+    rowList = rows.tolist()
+    nameColumn = store.name
+    edgeColumn = store.edge
+    edges = numpy.array([edgeColumn[row] for row in rowList], dtype=object)
+    changing = numpy.flatnonzero(isActive & (edges == numpy.repeat(numpy.array(leadEdges, dtype=object), counts)))
+    laneIndexes = numpy.repeat(targetLanes, counts)[changing].tolist()
+    commandBuffer.queueMany("changeLane", [nameColumn[row] for row in rows[changing].tolist()], [(laneIndex, 0.5) for laneIndex in laneIndexes])
+
+    # Only set the speed if the vehicle is not in a lane controlled by a third party
+    free = isActive
+    if any(controlledLanes):
+        laneColumn = store.lane
+        controlledLanes = numpy.repeat(numpy.array(controlledLanes, dtype=object), counts).tolist()
+        free = free & numpy.array([laneColumn[row] not in lanes for row, lanes in zip(rowList, controlledLanes)], dtype=bool)
+    newSpeeds = numpy.where(leaderGaps[rows] <= FOLLOWING_DISTANCE, numpy.repeat(speeds, counts).astype(numpy.float64), -1.0)
+    # Only speeds that differ from the ones last sent are sent (nothing sent yet is NaN, which never matches)
+    changed = numpy.flatnonzero(free & (commandedSpeeds[rows] != newSpeeds))
+    commandedSpeeds[rows[changed]] = newSpeeds[changed]
+    commandBuffer.queueMany("setSpeed", [nameColumn[row] for row in rows[changed].tolist()], [(speed,) for speed in newSpeeds[changed].tolist()])
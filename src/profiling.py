@@ -0,0 +1,185 @@
+from array import array
+import contextlib
+import cProfile
+import io
+import pstats
+import time
+
+from backend import traci
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(values, p):
+    """
+    Gets the p-th percentile of the given (already sorted) values using the nearest rank
+    """
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+class _Phase():
+    """
+    Times a named phase of a step, used as a context manager
+    """
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._profiler.addPhaseTime(self._name, time.perf_counter() - self._start)
+
+class StepProfiler():
+    """
+    Instruments the simulation loop. When enabled it records the wall clock time of every
+    step and of named phases within each step, counts (and times) the TraCI calls made
+    grouped by command, and can run cProfile over a chosen window of steps.
+    When disabled every hook is a no-op.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._nullPhase = contextlib.nullcontext()
+        self.reset()
+
+    def reset(self):
+        self._phaseTotals = dict()
+        self._stepPhaseTimes = dict()
+        self._phaseStepTimes = dict()
+        self._stepTimes = array("d")
+        self._stepStart = None
+        self._step = 0
+        self.traciCallCounts = dict()
+        self.traciCallTimes = dict()
+        self._profileSteps = None
+        self._cProfile = None
+        self.profileStats = None
+
+    def enable(self, profileSteps=None):
+        """
+        Starts recording. If profileSteps is given as (first, last) cProfile is run from
+        the start of step first until the end of step last
+        """
+        self.reset()
+        self.enabled = True
+        self._profileSteps = profileSteps
+        traci.instrument(self)
+
+    def disable(self):
+        self.enabled = False
+        traci.instrument(None)
+        self._stopCProfile()
+
+    def phase(self, name):
+        """
+        Returns a context manager timing the named phase of the current step
+        """
+        if not self.enabled:
+            return self._nullPhase
+        return _Phase(self, name)
+
+    def addPhaseTime(self, name, duration):
+        self._stepPhaseTimes[name] = self._stepPhaseTimes.get(name, 0.0) + duration
+
+    def startStep(self):
+        if not self.enabled:
+            return
+        if self._profileSteps and self._step == self._profileSteps[0]:
+            self._cProfile = cProfile.Profile()
+            self._cProfile.enable()
+        self._stepPhaseTimes = dict()
+        self._stepStart = time.perf_counter()
+
+    def endStep(self):
+        if not self.enabled or self._stepStart is None:
+            return
+        self._stepTimes.append(time.perf_counter() - self._stepStart)
+        # Phase times are kept per step so that percentiles can be given for each phase
+        for name, duration in self._stepPhaseTimes.items():
+            if name not in self._phaseStepTimes:
+                self._phaseStepTimes[name] = array("d")
+                self._phaseTotals[name] = 0.0
+            self._phaseStepTimes[name].append(duration)
+            self._phaseTotals[name] = self._phaseTotals[name] + duration
+        if self._profileSteps and self._step == self._profileSteps[1]:
+            self._stopCProfile()
+        self._step = self._step + 1
+
+    def timeTraCICall(self, command, function, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.traciCallTimes[command] = self.traciCallTimes.get(command, 0.0) + time.perf_counter() - start
+            self.traciCallCounts[command] = self.traciCallCounts.get(command, 0) + 1
+
+    def _stopCProfile(self):
+        if self._cProfile:
+            self._cProfile.disable()
+            self.profileStats = pstats.Stats(self._cProfile)
+            self._cProfile = None
+
+    def getDomainCallCounts(self):
+        """
+        Gets the number of commands called on each TraCI domain (ex. vehicle), calls to the
+        top level functions (such as simulationStep) are left out
+        """
+        counts = dict()
+        for command, count in self.traciCallCounts.items():
+            # Commands called through a domain are named <domain>.<command> by the backend
+            domain, separator, name = command.partition(".")
+            if separator:
+                counts[domain] = counts.get(domain, 0) + count
+        return counts
+
+    def getPhaseTotal(self, name):
+        """
+        Gets the total time (in seconds) spent in the named phase over every step
+        """
+        return self._phaseTotals.get(name, 0.0)
+
+    def getSummary(self):
+        """
+        Gets the headline numbers of the run (all times are in milliseconds)
+        """
+        stepTimes = sorted(self._stepTimes)
+        summary = {"steps": len(stepTimes)}
+        for p in PERCENTILES:
+            summary["stepTimeP%s" % p] = percentile(stepTimes, p) * 1000
+        summary["stepTimeMax"] = (stepTimes[-1] if stepTimes else 0.0) * 1000
+        summary["stepTimeTotal"] = sum(stepTimes) * 1000
+        summary["traciCallsPerStep"] = sum(self.traciCallCounts.values()) / (len(stepTimes) or 1)
+        return summary
+
+    def getReport(self, topFunctions=20):
+        """
+        Gets a human readable report of where the time in each step was spent
+        """
+        summary = self.getSummary()
+        steps = summary["steps"] or 1
+        lines = ["------------Step timing (%s steps)------------" % summary["steps"]]
+        lines.append("Step time ms: " + ", ".join("p%s %.3f" % (p, summary["stepTimeP%s" % p]) for p in PERCENTILES) +
+                     ", max %.3f, total %.3f" % (summary["stepTimeMax"], summary["stepTimeTotal"]))
+        lines.append("------------Phases (ms)------------")
+        for name, total in sorted(self._phaseTotals.items(), key=lambda item: -item[1]):
+            times = sorted(self._phaseStepTimes[name])
+            lines.append("%-24s total %10.1f  mean %8.3f  p95 %8.3f  p99 %8.3f" % (
+                name, total * 1000, total * 1000 / steps, percentile(times, 95) * 1000, percentile(times, 99) * 1000))
+        lines.append("------------TraCI calls (%.1f per step)------------" % summary["traciCallsPerStep"])
+        for command, count in sorted(self.traciCallCounts.items(), key=lambda item: -item[1]):
+            lines.append("%-36s calls %9d  per step %8.2f  total ms %10.1f" % (
+                command, count, count / steps, self.traciCallTimes[command] * 1000))
+        if self.profileStats:
+            lines.append("------------cProfile (steps %s to %s)------------" % tuple(self._profileSteps))
+            stream = io.StringIO()
+            self.profileStats.stream = stream
+            self.profileStats.sort_stats("cumulative").print_stats(topFunctions)
+            lines.append(stream.getvalue())
+        return "\n".join(lines)
+
+profiler = StepProfiler()
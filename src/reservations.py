@@ -0,0 +1,108 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+reservationTuple = namedtuple("reservationTuple", "lane eta start end duration")
+
+# How far (in seconds) a platoon's arrival can move before its reservation is recalculated
+ETA_TOLERANCE = 1.0
+
+class ReservationTable():
+    """
+    Space-time reservations for a single junction. Every incoming lane is a conflict zone
+    holding the time slots granted to platoons (or vehicles) on it, kept sorted so that
+    admission is a binary search per conflicting zone. A slot is granted at the earliest
+    time after a platoon's arrival that doesn't overlap a slot in any conflicting zone, so
+    platoons on movements that don't conflict can cross at the same time.
+    Reservations are kept between steps and only recalculated when a platoon's arrival
+    time moves (see ETA_TOLERANCE).
+    """
+
+    def __init__(self, lanes, conflicts=None):
+        """
+        If no conflicts are given every lane conflicts with every other, so platoons cross
+        one at a time
+        """
+        everyLane = frozenset(lanes)
+        self._conflicts = {lane: (conflicts.get(lane) if conflicts and lane in conflicts else everyLane) | {lane} for lane in lanes}
+        self._starts = {lane: [] for lane in lanes}
+        self._ends = {lane: [] for lane in lanes}
+        self._keys = {lane: [] for lane in lanes}
+        self._reservations = dict()
+        self.recalculatedLastStep = 0
+
+    def expire(self, time):
+        """
+        Drops every slot that ended before the given time
+        """
+        self.recalculatedLastStep = 0
+        for lane, ends in self._ends.items():
+            expired = bisect_right(ends, time)
+            if expired:
+                for key in self._keys[lane][:expired]:
+                    self._reservations.pop(key, None)
+                del self._starts[lane][:expired]
+                del ends[:expired]
+                del self._keys[lane][:expired]
+
+    def _findStart(self, lane, earliest, duration):
+        start = earliest
+        moved = True
+        while moved:
+            moved = False
+            for zone in self._conflicts[lane]:
+                starts = self._starts[zone]
+                ends = self._ends[zone]
+                # Slots in a zone never overlap, so the first one ending after the
+                # start is the only one that can clash with it
+                i = bisect_right(ends, start)
+                while i < len(ends) and starts[i] < start + duration:
+                    start = ends[i]
+                    moved = True
+                    i = i + 1
+        return start
+
+    def getLatestEnd(self):
+        return max((ends[-1] for ends in self._ends.values() if ends), default=None)
+
+    def release(self, key):
+        """
+        Gives up the slot held by the given key (if any)
+        """
+        reservation = self._reservations.pop(key, None)
+        if not reservation:
+            return
+        starts = self._starts[reservation.lane]
+        keys = self._keys[reservation.lane]
+        # Only slots starting at the same time can be ahead of it
+        i = bisect_left(starts, reservation.start)
+        while i < len(starts) and starts[i] == reservation.start:
+            if keys[i] == key:
+                del starts[i]
+                del self._ends[reservation.lane][i]
+                del keys[i]
+                return
+            i = i + 1
+        raise RuntimeError("The slot reserved for %s at %s on %s is missing" % (key, reservation.start, reservation.lane))
+
+    def reserve(self, key, lane, eta, duration):
+        """
+        Gets the time the given key (a platoon or vehicle) may start crossing the junction
+        from the given lane. The existing slot is kept if the arrival time hasn't moved
+        and it is still long enough, otherwise a new one is granted at the earliest free
+        time after eta.
+        """
+        reservation = self._reservations.get(key)
+        if reservation:
+            if reservation.lane == lane and duration <= reservation.duration + ETA_TOLERANCE and \
+                    reservation.eta - ETA_TOLERANCE <= eta <= reservation.start + ETA_TOLERANCE:
+                return reservation.start
+            self.release(key)
+        self.recalculatedLastStep = self.recalculatedLastStep + 1
+        start = self._findStart(lane, eta, duration)
+        end = start + duration
+        i = bisect_right(self._starts[lane], start)
+        self._starts[lane].insert(i, start)
+        self._ends[lane].insert(i, end)
+        self._keys[lane].insert(i, key)
+        self._reservations[key] = reservationTuple(lane, eta, start, end, duration)
+        return start
@@ -0,0 +1,98 @@
+class RouteRegistry():
+    """
+    Interns the routes of every tracked vehicle so that vehicles sharing a route (e.g. every
+    vehicle from the same flow) share one tuple and one route ID. For each route the index of
+    every edge and the edge following each position are worked out once, and whether a
+    follower's route takes it onto the lead vehicle's next edge is remembered per
+    (lead route, lead route index, follower route). As a new route index or a new route
+    gives a new key, results never need to be thrown away.
+    """
+
+    def __init__(self):
+        self._routeIDs = dict()
+        self._routes = []
+        self._edgeIndexes = []
+        self._nextEdges = []
+        self._convergence = dict()
+
+    def converges(self, leadRouteID, leadRouteIndex, routeIDs):
+        """
+        Returns True if every one of the given routes goes onto the edge after the given
+        index of the lead route (or if the lead route has no edges left after it)
+        """
+        return self.getFirstDiverging(leadRouteID, leadRouteIndex, routeIDs) is None
+
+    def getFirstDiverging(self, leadRouteID, leadRouteIndex, routeIDs):
+        """
+        Gets the position in routeIDs of the first route that doesn't go onto the edge after
+        the given index of the lead route, None if they all do
+        """
+        convergence = self._convergence
+        for i, routeID in enumerate(routeIDs):
+            key = (leadRouteID, leadRouteIndex, routeID)
+            result = convergence.get(key)
+            if result is None:
+                nextEdge = self.getNextEdge(leadRouteID, leadRouteIndex)
+                result = convergence[key] = nextEdge is None or nextEdge in self._edgeIndexes[routeID]
+            if not result:
+                return i
+        return None
+
+    def getEdgeIndex(self, routeID, edge):
+        """
+        Gets the index of the first time the route visits the given edge, None if it never does
+        """
+        return self._edgeIndexes[routeID].get(edge)
+
+    def getNextEdge(self, routeID, routeIndex):
+        """
+        Gets the edge after the given index of a route, None if it is the last edge
+        """
+        nextEdges = self._nextEdges[routeID]
+        return nextEdges[routeIndex] if 0 <= routeIndex < len(nextEdges) else None
+
+    def getRoute(self, routeID):
+        return self._routes[routeID]
+
+    def getRouteCount(self):
+        return len(self._routes)
+
+    def intern(self, route):
+        """
+        Gets the ID of the given route (a sequence of edge IDs), registering it if it hasn't
+        been seen before
+        """
+        route = tuple(route)
+        routeID = self._routeIDs.get(route)
+        if routeID is None:
+            routeID = self._routeIDs[route] = len(self._routes)
+            self._routes.append(route)
+            edgeIndex = dict()
+            for i, edge in enumerate(route):
+                edgeIndex.setdefault(edge, i)
+            self._edgeIndexes.append(edgeIndex)
+            self._nextEdges.append(route[1:] + (None,))
+        return routeID
+
+    def restore(self, registry):
+        """
+        Takes on every route of another registry (ex. one loaded from a checkpoint), so the
+        route IDs held in its vehicle store stay valid
+        """
+        self._routeIDs = registry._routeIDs
+        self._routes = registry._routes
+        self._edgeIndexes = registry._edgeIndexes
+        self._nextEdges = registry._nextEdges
+        self._convergence = registry._convergence
+
+    def reset(self):
+        """
+        Forgets every route, this should be called at the start of every run
+        """
+        self._routeIDs.clear()
+        self._routes = []
+        self._edgeIndexes = []
+        self._nextEdges = []
+        self._convergence.clear()
+
+routeRegistry = RouteRegistry()
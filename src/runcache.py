@@ -0,0 +1,228 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+import xml.etree.ElementTree as ElementTree
+
+from backend import SOCKET, FAKE
+from topology import hashFile
+
+DEFAULT_RUN_CACHE_LOCATION = "output/runcache"
+# 1GB, emissions and fcd outputs of long runs can be large
+DEFAULT_MAX_SIZE = 1 << 30
+# Files in the sumocfg's input section that change what SUMO simulates
+CONFIG_INPUT_FILES = ("net-file", "route-files", "additional-files")
+ENTRY_FILE_NAME = "entry.json"
+# Where the files written to each of a run's directories are kept within its entry
+OUTPUT = "output"
+METRICS = "metrics"
+# The version reported by SUMO for each backend, only asked for once per process
+_sumoVersions = dict()
+
+def getDefaultRunCacheLocation():
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), DEFAULT_RUN_CACHE_LOCATION)
+
+def getConfigFiles(configFile):
+    """
+    Gets the .sumocfg file along with every network, route and additional file it reads
+    """
+    directory = os.path.dirname(configFile)
+    files = [configFile]
+    for event, element in ElementTree.iterparse(configFile):
+        if element.tag in CONFIG_INPUT_FILES:
+            files.extend(os.path.join(directory, f.strip()) for f in element.get("value").split(",") if f.strip())
+    return files
+
+def getCodeVersion(sourceDirectory=None):
+    """
+    Gets a hash of every python file in src, so results are never reused once the code has changed
+    """
+    sourceDirectory = sourceDirectory or os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for sourceFile in sorted(glob.glob(os.path.join(sourceDirectory, "*.py"))):
+        digest.update(os.path.basename(sourceFile).encode())
+        digest.update(hashFile(sourceFile))
+    return digest.hexdigest()
+
+def getSumoVersion(backend=SOCKET):
+    """
+    Gets the version of SUMO used by a backend (the first line of sumo --version), so results
+    are never reused once SUMO has been upgraded. libsumo comes from the same installation as
+    the binary. The fake backend doesn't use SUMO so its name is given instead.
+    """
+    if backend not in _sumoVersions:
+        if backend == FAKE:
+            version = FAKE
+        else:
+            try:
+                from sumolib import checkBinary
+                output = subprocess.run([checkBinary("sumo"), "--version"], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+                version = output.strip().splitlines()[0] if output.strip() else ""
+            except (ImportError, OSError, subprocess.CalledProcessError):
+                # The run itself will fail to start SUMO
+                version = "unknown"
+        _sumoVersions[backend] = version
+    return _sumoVersions[backend]
+
+def getRunKey(configFile, additionalFile, scenarioConfig, numOfSteps, trafficScale, seed, backend=SOCKET, **options):
+    """
+    Gets the key of a run, a hash of the contents of every file SUMO reads for it (the
+    .sumocfg and the network, route and additional files it lists), the scenario's config,
+    the number of steps, traffic scale and seed, the version of the code, the backend and the
+    version of SUMO it uses, and any other options that change its results
+    """
+    digest = hashlib.sha256()
+    for inputFile in getConfigFiles(configFile) + [additionalFile]:
+        digest.update(os.path.basename(inputFile).encode())
+        digest.update(hashFile(inputFile))
+    digest.update(getCodeVersion().encode())
+    digest.update(repr((backend, getSumoVersion(backend))).encode())
+    digest.update(repr((tuple(scenarioConfig), numOfSteps, trafficScale, seed, sorted(options.items()))).encode())
+    return digest.hexdigest()
+
+def _getSize(directory):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, directories, files in os.walk(directory) for f in files)
+
+class RunCache():
+    """
+    Keeps the metrics and output files of finished runs by their key (see getRunKey), so a
+    run that has already been done with the same inputs and code is restored rather than
+    simulated again. Every entry is a directory holding the metrics and a copy of each file
+    the run wrote. Once the cache grows beyond maxSize bytes the least recently used entries
+    are removed. Entries are written to a temporary directory and moved into place, so
+    processes of a sweep can share one cache.
+    """
+
+    def __init__(self, directory, maxSize=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _getEntryLocation(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, outputDirectory=None, metricsDirectory=None):
+        """
+        Gets the metrics of the run with the given key, copying its files back into the given
+        output and metrics directories. Returns None if it isn't cached.
+        """
+        entryLocation = self._getEntryLocation(key)
+        try:
+            with open(os.path.join(entryLocation, ENTRY_FILE_NAME)) as f:
+                entry = json.load(f)
+            for name, directory in ((OUTPUT, outputDirectory), (METRICS, metricsDirectory)):
+                if directory and entry["files"][name]:
+                    os.makedirs(directory, exist_ok=True)
+                    for fileName in entry["files"][name]:
+                        shutil.copy(os.path.join(entryLocation, name, fileName), directory)
+            # Marks the entry as recently used
+            os.utime(os.path.join(entryLocation, ENTRY_FILE_NAME))
+        except (OSError, ValueError, KeyError):
+            # Not cached or removed part way through by another process
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return entry["metrics"]
+
+    def put(self, key, metrics, outputFiles=(), metricsFiles=()):
+        """
+        Saves the metrics and files of the run with the given key, then removes the least
+        recently used entries until the cache fits within its size
+        """
+        entryLocation = self._getEntryLocation(key)
+        temporaryLocation = "%s.%s.tmp" % (entryLocation, os.getpid())
+        shutil.rmtree(temporaryLocation, ignore_errors=True)
+        files = dict()
+        for name, fileLocations in ((OUTPUT, outputFiles), (METRICS, metricsFiles)):
+            os.makedirs(os.path.join(temporaryLocation, name))
+            for fileLocation in fileLocations:
+                shutil.copy(fileLocation, os.path.join(temporaryLocation, name))
+            files[name] = [os.path.basename(f) for f in fileLocations]
+        with open(os.path.join(temporaryLocation, ENTRY_FILE_NAME), "w") as f:
+            json.dump({"key": key, "time": time.time(), "metrics": metrics, "files": files}, f, default=str)
+        try:
+            os.rename(temporaryLocation, entryLocation)
+        except OSError:
+            # Another process has already saved this run
+            shutil.rmtree(temporaryLocation, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is no larger than its maximum size
+        """
+        entries = []
+        for entryFile in glob.glob(os.path.join(self.directory, "*", ENTRY_FILE_NAME)):
+            entryLocation = os.path.dirname(entryFile)
+            try:
+                entries.append((os.path.getmtime(entryFile), _getSize(entryLocation), entryLocation))
+            except OSError:
+                continue
+        entries.sort()
+        totalSize = sum(size for lastUsed, size, entryLocation in entries)
+        for lastUsed, size, entryLocation in entries:
+            if totalSize <= self.maxSize:
+                break
+            logging.info("Removing %s from the run cache", os.path.basename(entryLocation))
+            shutil.rmtree(entryLocation, ignore_errors=True)
+            totalSize = totalSize - size
+
+    def clear(self):
+        for entryLocation in glob.glob(os.path.join(self.directory, "*")):
+            shutil.rmtree(entryLocation, ignore_errors=True)
+
+def snapshotFiles(directory):
+    """
+    Gets the modification time and size of every file in a directory
+    """
+    if not directory or not os.path.isdir(directory):
+        return dict()
+    snapshot = dict()
+    for fileLocation in glob.glob(os.path.join(directory, "*")):
+        if os.path.isfile(fileLocation):
+            stat = os.stat(fileLocation)
+            snapshot[os.path.abspath(fileLocation)] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+def getWrittenFiles(directory, snapshot, exclude=()):
+    """
+    Gets the files in a directory that are new or have changed since the snapshot was taken,
+    ie. the ones written by a run
+    """
+    exclude = [os.path.abspath(f) for f in exclude]
+    return sorted(f for f, stat in snapshotFiles(directory).items() if snapshot.get(f) != stat and f not in exclude)
+
+def addRunCacheArguments(parser):
+    """
+    Adds the options for using a run cache to an argparse parser
+    """
+    parser.add_argument("--run-cache", dest="runCache", nargs="?", const=getDefaultRunCacheLocation(), metavar="DIRECTORY",
+                        help="restore runs that have already been done from a cache (output/runcache by default)")
+    parser.add_argument("--run-cache-size", dest="runCacheSize", type=float, default=DEFAULT_MAX_SIZE / 1e6, metavar="MB",
+                        help="remove the least recently used runs once the cache is larger than this")
+
+def createRunCache(args):
+    """
+    Creates a run cache from the options added by addRunCacheArguments, None if it wasn't asked for
+    """
+    return RunCache(args.runCache, int(args.runCacheSize * 1e6)) if args.runCache else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows the size of a run cache, or clears it")
+    parser.add_argument("directory", nargs="?", default=getDefaultRunCacheLocation())
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+    runCache = RunCache(args.directory)
+    if args.clear:
+        runCache.clear()
+    entries = glob.glob(os.path.join(args.directory, "*", ENTRY_FILE_NAME))
+    print("%s runs cached in %s (%.1f MB)" % (len(entries), args.directory, _getSize(args.directory) / 1e6 if entries else 0))
@@ -1,7 +1,20 @@
 import logging
-import traci
+import os
+import shutil
+import time
+from backend import traci
 from simulationmanager import SimulationManager
+from checkpoint import saveCheckpoint, loadCheckpoint, getSimulationStateLocation
+from fastforward import FastForward, loadDepartureSchedule
+from analysis import analyseOutputs, TRIPINFO_FILE_NAME, FCD_FILE_NAME
+from runcache import getRunKey, snapshotFiles, getWrittenFiles
+from metrics import MetricsRecorder, CSV
+from profiling import profiler
+from tracing import tracer, OFF, FULL, TRACE_LEVELS
 from simlib import setUpSimulation
+from topology import loadTopology, hashFile
+from netgenerator import findGeneratedMaps
+from backend import SOCKET
 
 from collections import namedtuple
 
@@ -9,6 +22,7 @@ scenarioNumberConfigTuple = namedtuple("scenarioNumberConfig", "nameModifier ena
 scenarioMapConfigTuple = namedtuple("scenarioMapConfig", "mapName defaultTrafficScale")
 
 DEFAULT_OUTPUT_SAVE_LOCATION = "output/additional.xml"
+DEFAULT_TRACE_FILE_NAME = "trace.log"
 
 SCENARIO_NUMBER_CONFIGS = {
     1 : scenarioNumberConfigTuple("",        False, False, False, False, 0),
@@ -24,12 +38,79 @@ SCENARIO_LOCATION_CONFIG = {
     "Roundabout"   : scenarioMapConfigTuple("A13NorthCircularRoundabout", 1),
 }
 
-def runScenario(mapName, scenarioNum, numOfSteps=5000):
+def getMainProjectDirectory():
+    """ Gets the top level directory of the project (the one containing maps, output and src)
+    """
+    currPath = __file__.replace("\\", "/")
+    return "/".join(currPath.split("/")[:currPath.split("/").index("src")])
+
+# The maps directories whose generated maps have already been registered
+_registeredMapsDirectories = set()
+
+def registerGeneratedMaps(mapsDirectory=None):
+    """ Registers the maps written by netgenerator.py into mapsDirectory (the project's maps
+    folder by default) alongside the hand made ones. This is done when the scenario locations
+    are first needed rather than on import, so importing this module doesn't read the maps folder
+    """
+    mapsDirectory = mapsDirectory or "{0}/maps".format(getMainProjectDirectory())
+    if mapsDirectory not in _registeredMapsDirectories:
+        _registeredMapsDirectories.add(mapsDirectory)
+        for name, generatedMapName, defaultTrafficScale in findGeneratedMaps(mapsDirectory):
+            SCENARIO_LOCATION_CONFIG.setdefault(name, scenarioMapConfigTuple(generatedMapName, defaultTrafficScale))
+
+def getScenarioLocations():
+    """ Gets the config of every scenario location by name, including generated maps
+    """
+    registerGeneratedMaps()
+    return SCENARIO_LOCATION_CONFIG
+
+def getNetFileLocation(mapName, scenarioNum):
+    """ Gets the location of the network file used by the given map and scenario number
+    """
+    fullMapName = getScenarioLocations()[mapName].mapName + SCENARIO_NUMBER_CONFIGS[scenarioNum].nameModifier
+    return "{0}/maps/{1}/{1}.net.xml".format(getMainProjectDirectory(), fullMapName)
+
+def runScenario(mapName, scenarioNum, numOfSteps=5000, backend=SOCKET, gui=False, trafficScale=None, seed=None,
+                outputDirectory=None, label=None, port=None, metricsDirectory=None, metricsFormat=CSV,
+                profile=False, profileSteps=None, profileOutput=None, traceLevel=OFF, traceFile=None,
+                warmStartFile=None, checkpointFile=None, checkpointStep=None, scheduler=None, fastForward=False,
+                tripinfo=False, fcd=False, analyse=False, runCache=None):
     """ Runs a given scenario using the given scenario name and number.
+    The backend can be the name of any backend in backend.BACKENDS (headless SUMO over
+    a socket by default) or a populated FakeTraCI instance.
+    If no traffic scale is given the map's default is used. If an output directory is given
+    SUMO's outputs are written there instead of the shared output folder, and a label and port
+    can be given so that several runs can be connected to at once.
+    If a metrics directory is given, per step time series are streamed there while the
+    scenario runs (as CSV or Parquet files).
+    If profile is set every step is timed (along with phases within it and TraCI calls) and
+    a report is logged at the end. profileSteps (first, last) also runs cProfile over those
+    steps, saving the stats to profileOutput if given.
+    traceLevel (off, summary or full) controls tracing of platoons and intersections, full
+    traces are written to traceFile (trace.log in the output folder by default).
+    If checkpointFile and checkpointStep are given a checkpoint is saved after that many steps,
+    which later runs of the same map and scenario number can start from by passing it as
+    warmStartFile (see checkpoint). numOfSteps are then run on from the checkpoint and its
+    statistics are only gathered from that point.
+    A scheduler (see scheduler.ControlScheduler) can be given to run parts of the control
+    less often, the work it skipped is added to the metrics.
+    If fastForward is set SUMO is advanced several steps at once whenever there is nothing to
+    control, up to just before the next departure in the map's route files or the first time a
+    vehicle could reach an intersection (see fastforward). Per step metrics and statistics are
+    then only sampled on the steps the manager runs.
+    SUMO always writes emissions per edge, tripinfo and fcd also turn on its trip and floating
+    car data outputs. If analyse is set these outputs are streamed once the run ends (see
+    analysis) with per edge tables written to the metrics directory (or the output folder)
+    and the totals added to the metrics.
+    If a runCache (see runcache.RunCache) is given and this run has already been done with the
+    same map files, scenario, steps, traffic scale, seed, options, code and SUMO version, its metrics and
+    output files are restored from the cache instead of running it again. Runs using the GUI,
+    profiling or saving a checkpoint, or with a backend instance, are always run.
+    Returns a dict of metrics collected during the run.
     """
-    logging.info("Starting scenario for (name: %s | number: %s)")
+    logging.info("Starting scenario for (name: %s | number: %s)", mapName, scenarioNum)
     # Get config information
-    scenarioLocationConfig = SCENARIO_LOCATION_CONFIG.get(mapName)
+    scenarioLocationConfig = getScenarioLocations().get(mapName)
     scenarioNumberConfig = SCENARIO_NUMBER_CONFIGS.get(scenarioNum)
     if not scenarioLocationConfig:
         raise ValueError("Could not find a scenario for the given name %s, available names: %s" % (mapName, SCENARIO_LOCATION_CONFIG.keys()))
@@ -41,22 +122,132 @@ def runScenario(mapName, scenarioNum, numOfSteps=5000):
     mapName = baseScenarioName + scenarioNumberConfig.nameModifier
 
     # Get location of config files and place to store the output
-    currPath = __file__.replace("\\", "/")
-    mainProjectDirectory = "/".join(currPath.split("/")[:currPath.split("/").index("src")])
+    mainProjectDirectory = getMainProjectDirectory()
     mapLocation = "{0}/maps/{1}/{1}.sumocfg".format(mainProjectDirectory, mapName)
+    netFileLocation = "{0}/maps/{1}/{1}.net.xml".format(mainProjectDirectory, mapName)
     outputFileLocation = "{0}/{1}".format(mainProjectDirectory, DEFAULT_OUTPUT_SAVE_LOCATION)
+    if outputDirectory:
+        # SUMO writes outputs relative to the additional file, so give this run its own copy
+        os.makedirs(outputDirectory, exist_ok=True)
+        outputFileLocation = shutil.copy(outputFileLocation, outputDirectory)
+    # Every SUMO output is written next to the additional file
+    outputLocation = os.path.dirname(outputFileLocation)
+    if trafficScale is None:
+        trafficScale = scenarioLocationConfig.defaultTrafficScale
 
-    setUpSimulation(mapLocation, scenarioLocationConfig.defaultTrafficScale, outputFileLocation)
+    if isinstance(traceLevel, str):
+        traceLevel = TRACE_LEVELS[traceLevel]
+    if traceLevel == FULL and not traceFile:
+        traceFile = os.path.join(outputLocation, DEFAULT_TRACE_FILE_NAME)
+
+    extraOptions = []
+    if tripinfo:
+        extraOptions.extend(["--tripinfo-output", os.path.join(outputLocation, TRIPINFO_FILE_NAME)])
+    if fcd:
+        extraOptions.extend(["--fcd-output", os.path.join(outputLocation, FCD_FILE_NAME)])
+
+    startTime = time.time()
+    runKey = None
+    if runCache and isinstance(backend, str) and not gui and not profile and not checkpointFile:
+        warmStart = warmStartFile and (hashFile(warmStartFile), hashFile(getSimulationStateLocation(warmStartFile)))
+        schedule = scheduler and (sorted(scheduler.intervals.items()), scheduler.intersectionHorizon, scheduler.speedTolerance)
+        runKey = getRunKey(mapLocation, outputFileLocation, scenarioNumberConfig, numOfSteps, trafficScale, seed, backend=backend,
+                           metrics=bool(metricsDirectory), metricsFormat=metricsFormat, traceLevel=traceLevel, warmStart=warmStart,
+                           scheduler=schedule, fastForward=fastForward, tripinfo=tripinfo, fcd=fcd, analyse=analyse)
+        metrics = runCache.get(runKey, outputLocation, metricsDirectory)
+        if metrics is not None:
+            logging.info("Restored run %s from the run cache", runKey)
+            metrics.update(outputFileLocation=outputFileLocation, cacheHit=True)
+            return metrics
+        # Anything that changes in these folders while running is saved with the results
+        outputSnapshot = snapshotFiles(outputLocation)
+        metricsSnapshot = snapshotFiles(metricsDirectory)
+    setUpSimulation(mapLocation, trafficScale, outputFileLocation, backend, gui, seed, label, port, extraOptions)
     step = 0
-    manager = SimulationManager(scenarioNumberConfig.enablePlatoons, scenarioNumberConfig.enableCoordination, scenarioNumberConfig.enableZipping, scenarioNumberConfig.maxVehiclesPerPlatoon) if scenarioNumberConfig.enableManager else None
+    recorder = MetricsRecorder(metricsDirectory, metricsFormat) if metricsDirectory else None
+    # The network's topology is compiled once and then read from its cache
+    topology = loadTopology(netFileLocation)
+    if warmStartFile:
+        manager, checkpointTime, checkpointInfo = loadCheckpoint(warmStartFile, recorder, topology)
+        if checkpointInfo.get("mapName") != mapName or checkpointInfo.get("scenarioNum") != scenarioNum:
+            raise ValueError("Checkpoint %s was saved from %s scenario %s" % (warmStartFile, checkpointInfo.get("mapName"), checkpointInfo.get("scenarioNum")))
+        logging.info("Warm started from %s at time %s", warmStartFile, checkpointTime)
+        if manager:
+            if not scenarioNumberConfig.enableManager and not recorder:
+                manager = None
+            else:
+                manager.resetStatistics()
+                if scheduler:
+                    manager.scheduler = scheduler
+    else:
+        manager = SimulationManager(scenarioNumberConfig.enablePlatoons, scenarioNumberConfig.enableCoordination, scenarioNumberConfig.enableZipping, scenarioNumberConfig.maxVehiclesPerPlatoon, recorder, topology=topology, scheduler=scheduler) if scenarioNumberConfig.enableManager else None
+    if recorder and not manager:
+        # Without platooning or coordination the manager only observes, so metrics can still be recorded for the control
+        manager = SimulationManager(False, False, False, 0, recorder, topology=topology)
+    fastForwarder = FastForward(loadDepartureSchedule(mapLocation, trafficScale)) if fastForward else None
+    tracer.configure(traceLevel, traceFile)
+    if profile:
+        profiler.enable(profileSteps)
     while step < numOfSteps:
+        profiler.startStep()
         if manager:
             manager.handleSimulationStep()
-        traci.simulationStep()
-        step += 1
+        with profiler.phase("simulationStep"):
+            if fastForwarder:
+                # Never jump past the end of the run or the step a checkpoint is due
+                lastStep = checkpointStep if checkpointFile and checkpointStep and checkpointStep > step else numOfSteps
+                steps = fastForwarder.getSteps(manager, min(lastStep, numOfSteps) - step)
+                fastForwarder.step(steps)
+                if steps > 1 and manager:
+                    manager.synchroniseVehicles()
+            else:
+                steps = 1
+                traci.simulationStep()
+        profiler.endStep()
+        step += steps
+        if checkpointFile and step == checkpointStep:
+            saveCheckpoint(checkpointFile, manager, mapName=mapName, scenarioNum=scenarioNum)
+            logging.info("Saved a checkpoint to %s after %s steps", checkpointFile, step)
 
+    metrics = {
+        "mapName": mapName,
+        "scenarioNum": scenarioNum,
+        "numOfSteps": numOfSteps,
+        "trafficScale": trafficScale,
+        "seed": seed,
+        "warmStartFile": warmStartFile,
+        "fastForwardedSteps": fastForwarder.stepsSkipped if fastForwarder else 0,
+        "outputFileLocation": outputFileLocation,
+    }
     # If we have a manager, try to get some stats
     if manager:
         logging.info("Max number of stopped cars: %s", manager.maxStoppedVehicles)
         logging.info("Average length of platoon: %s", manager.getAverageLengthOfAllPlatoons())
-    traci.close()
\ No newline at end of file
+        metrics["totalMaxStoppedVehicles"] = sum(manager.maxStoppedVehicles.values())
+        metrics["maxStoppedVehiclesOnAnEdge"] = max(manager.maxStoppedVehicles.values(), default=0)
+        metrics["averagePlatoonLength"] = manager.getAverageLengthOfAllPlatoons()
+        if not manager.scheduler.isEveryStep():
+            logging.info("Work skipped by the scheduler: %s", manager.scheduler.totalSkipped)
+            for task, count in manager.scheduler.totalSkipped.items():
+                metrics["skipped: %s" % task] = count
+    if recorder:
+        recorder.close()
+        metrics.update(recorder.getSummary())
+    if profile:
+        profiler.disable()
+        logging.info("Profile of run:\n%s", profiler.getReport())
+        metrics.update(profiler.getSummary())
+        if profiler.profileStats and profileOutput:
+            profiler.profileStats.dump_stats(profileOutput)
+    traci.close()
+    tracer.close()
+    topology.close()
+    metrics["wallTime"] = time.time() - startTime
+    if analyse:
+        # SUMO has finished writing its outputs once the connection is closed
+        metrics.update(analyseOutputs(outputLocation, metricsDirectory, metricsFormat))
+    if runKey:
+        metrics["cacheHit"] = False
+        outputFiles = getWrittenFiles(outputLocation, outputSnapshot, exclude=[outputFileLocation])
+        runCache.put(runKey, metrics, outputFiles, getWrittenFiles(metricsDirectory, metricsSnapshot, exclude=outputFiles))
+    return metrics
\ No newline at end of file
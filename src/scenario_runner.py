@@ -1,26 +1,60 @@
-from scenario_manager import runScenario, SCENARIO_NUMBER_CONFIGS, SCENARIO_LOCATION_CONFIG
+from scenario_manager import runScenario, getScenarioLocations, SCENARIO_NUMBER_CONFIGS
+from backend import BACKENDS, FAKE, SOCKET
+from metrics import CSV, FORMATS
+from tracing import TRACE_LEVELS
+from scheduler import addSchedulerArguments, createScheduler
+from runcache import addRunCacheArguments, createRunCache
 
-import sys
+import argparse
 import logging
 
-numOfSteps = None
-mapName = None
-scenarioNum = None
-
 # Check if we've passed any arguments on the command line
+parser = argparse.ArgumentParser(description="Runs a platooning/CIM scenario")
+parser.add_argument("mapName", nargs="?", help="available maps are: %s" % ", ".join(getScenarioLocations().keys()))
+parser.add_argument("scenarioNum", nargs="?", type=int, help="available numbers are: %s" % ", ".join(str(n) for n in SCENARIO_NUMBER_CONFIGS.keys()))
+parser.add_argument("numOfSteps", nargs="?", type=int)
+parser.add_argument("--interactive", action="store_true", help="prompt for the map name and scenario number if they aren't given")
+# The fake backend needs a network built in code so can't be selected here
+parser.add_argument("--backend", default=SOCKET, choices=[b for b in BACKENDS if b != FAKE])
+parser.add_argument("--gui", action="store_true", help="run using sumo-gui rather than headless sumo")
+parser.add_argument("--metrics", dest="metricsDirectory", help="directory to stream per step metrics to")
+parser.add_argument("--metrics-format", dest="metricsFormat", default=CSV, choices=FORMATS)
+parser.add_argument("--profile", action="store_true", help="time every step and report percentiles and TraCI call counts at the end")
+parser.add_argument("--profile-steps", dest="profileSteps", nargs=2, type=int, metavar=("FIRST", "LAST"), help="also run cProfile over these steps")
+parser.add_argument("--profile-output", dest="profileOutput", help="file to save the cProfile stats to")
+parser.add_argument("--trace", dest="traceLevel", default="off", choices=list(TRACE_LEVELS.keys()), help="how much platoon and intersection detail to trace")
+parser.add_argument("--trace-file", dest="traceFile", help="file to write traces to (full traces go to output/trace.log by default)")
+parser.add_argument("--save-checkpoint", dest="saveCheckpoint", nargs=2, metavar=("STEP", "FILE"), help="save a checkpoint after this many steps")
+parser.add_argument("--warm-start", dest="warmStartFile", help="start from a checkpoint saved by an earlier run of the same map and scenario")
+parser.add_argument("--fast-forward", dest="fastForward", action="store_true", help="advance several steps at once while there is nothing to control")
+parser.add_argument("--tripinfo", action="store_true", help="also have SUMO write its tripinfo output")
+parser.add_argument("--fcd", action="store_true", help="also have SUMO write its floating car data output")
+parser.add_argument("--analyse", action="store_true", help="summarise SUMO's emissions (and tripinfo/fcd) outputs once the run ends")
+addSchedulerArguments(parser)
+addRunCacheArguments(parser)
+args = parser.parse_args()
+logging.info("Found arguments %s passed in", args)
+
+mapName = args.mapName
+scenarioNum = args.scenarioNum
 
-if len(sys.argv) > 1:
-    logging.info("Found arguments %s passed in", sys.argv)
-    mapName = sys.argv[1]
-    scenarioNum = int(sys.argv[2])
-    if sys.argv[3]:
-        numOfSteps = int(sys.argv[3])
-        
-if not mapName:
-    mapName = input("Please enter map name, available maps are: %s: " % ", ".join( SCENARIO_LOCATION_CONFIG.keys()))
-if not scenarioNum:
-    scenarioNum = int(input("Please enter scenario number, available numbers are: %s: " % ", ".join( str(n) for n in SCENARIO_NUMBER_CONFIGS.keys())))
+# Only prompt when asked to, so that scripted and batch runs fail straight away instead of waiting on input
+if mapName is None or scenarioNum is None:
+    if not args.interactive:
+        parser.error("mapName and scenarioNum are required unless --interactive is given")
+    if mapName is None:
+        mapName = input("Please enter map name, available maps are: %s: " % ", ".join( getScenarioLocations().keys()))
+    if scenarioNum is None:
+        scenarioNum = int(input("Please enter scenario number, available numbers are: %s: " % ", ".join( str(n) for n in SCENARIO_NUMBER_CONFIGS.keys())))
 
-if numOfSteps:
-    runScenario(mapName, scenarioNum, numOfSteps)
-runScenario(mapName, scenarioNum)
\ No newline at end of file
+runArgs = dict(backend=args.backend, gui=args.gui, metricsDirectory=args.metricsDirectory, metricsFormat=args.metricsFormat,
+               profile=args.profile or bool(args.profileSteps), profileSteps=args.profileSteps, profileOutput=args.profileOutput,
+               traceLevel=args.traceLevel, traceFile=args.traceFile, warmStartFile=args.warmStartFile,
+               scheduler=createScheduler(args), fastForward=args.fastForward,
+               tripinfo=args.tripinfo, fcd=args.fcd, analyse=args.analyse, runCache=createRunCache(args))
+if args.saveCheckpoint:
+    runArgs["checkpointStep"] = int(args.saveCheckpoint[0])
+    runArgs["checkpointFile"] = args.saveCheckpoint[1]
+if args.numOfSteps:
+    runArgs["numOfSteps"] = args.numOfSteps
+runScenario(mapName, scenarioNum, **runArgs)
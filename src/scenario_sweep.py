@@ -0,0 +1,106 @@
+from scenario_manager import runScenario, getMainProjectDirectory, getNetFileLocation, getScenarioLocations, SCENARIO_NUMBER_CONFIGS
+from topology import loadTopology
+from backend import BACKENDS, FAKE, SOCKET
+from runcache import addRunCacheArguments, createRunCache
+
+from collections import namedtuple
+import argparse
+import csv
+import itertools
+import logging
+import multiprocessing
+import os
+
+sweepRunTuple = namedtuple("sweepRunTuple", "runID mapName scenarioNum trafficScale seed numOfSteps")
+
+DEFAULT_SWEEP_OUTPUT_LOCATION = "output/sweep"
+SWEEP_RESULTS_FILE_NAME = "results.csv"
+
+def buildSweep(mapNames=None, scenarioNums=None, trafficScales=(None,), seeds=(None,), numOfSteps=5000):
+    """ Builds every combination of the given parameters, by default every map and
+    scenario number is included. A traffic scale of None uses the map's default.
+    """
+    mapNames = mapNames or list(getScenarioLocations().keys())
+    scenarioNums = scenarioNums or list(SCENARIO_NUMBER_CONFIGS.keys())
+    runs = []
+    for mapName, scenarioNum, trafficScale, seed in itertools.product(mapNames, scenarioNums, trafficScales, seeds):
+        runID = "%s_%s_scale%s_seed%s" % (mapName, scenarioNum, trafficScale if trafficScale is not None else "default", seed)
+        runs.append(sweepRunTuple(runID, mapName, scenarioNum, trafficScale, seed, numOfSteps))
+    return runs
+
+def _runSweepWorker(args):
+    """ Runs a single scenario of a sweep, each worker process has its own SUMO instance
+    with its own connection label, port and output directory.
+    """
+    run, backend, outputDirectory, analyse, runCache = args
+    port = None
+    if backend == SOCKET:
+        from sumolib.miscutils import getFreeSocketPort
+        port = getFreeSocketPort()
+    runOutputDirectory = os.path.join(outputDirectory, run.runID)
+    try:
+        metrics = runScenario(run.mapName, run.scenarioNum, run.numOfSteps, backend=backend, trafficScale=run.trafficScale,
+                              seed=run.seed, outputDirectory=runOutputDirectory, label=run.runID, port=port,
+                              metricsDirectory=runOutputDirectory, tripinfo=analyse, analyse=analyse, runCache=runCache)
+        metrics["error"] = None
+    except Exception as e:
+        logging.exception("Run %s failed", run.runID)
+        metrics = {"error": repr(e)}
+    metrics["runID"] = run.runID
+    return metrics
+
+def runSweep(runs, processes=None, backend=SOCKET, outputDirectory=None, analyse=False, runCache=None):
+    """ Runs all the given runs in a process pool (one process per CPU by default) and
+    writes the metrics for every run into a single results table. Returns the results.
+    If analyse is set each run's emissions and trip outputs are summarised into the table too.
+    If a run cache is given (shared by every worker) runs that have already been done are restored from it.
+    """
+    if outputDirectory is None:
+        outputDirectory = os.path.join(getMainProjectDirectory(), DEFAULT_SWEEP_OUTPUT_LOCATION)
+    os.makedirs(outputDirectory, exist_ok=True)
+
+    # Compile each network's topology up front so the workers only ever read the caches
+    for netFile in sorted({getNetFileLocation(run.mapName, run.scenarioNum) for run in runs}):
+        loadTopology(netFile).close()
+
+    # Each run gets a fresh process so no simulation state is shared between runs
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        results = pool.map(_runSweepWorker, [(run, backend, outputDirectory, analyse, runCache) for run in runs], chunksize=1)
+
+    resultsFileLocation = os.path.join(outputDirectory, SWEEP_RESULTS_FILE_NAME)
+    writeResultsTable(results, resultsFileLocation)
+    logging.info("Sweep of %s runs complete, results written to %s", len(runs), resultsFileLocation)
+    if runCache:
+        logging.info("%s runs were restored from the run cache", sum(1 for result in results if result.get("cacheHit")))
+    return results
+
+def writeResultsTable(results, fileLocation):
+    """ Writes the metrics of every run into a CSV file, one row per run.
+    """
+    fieldNames = []
+    for result in results:
+        for key in result:
+            if key not in fieldNames:
+                fieldNames.append(key)
+    with open(fileLocation, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldNames)
+        writer.writeheader()
+        writer.writerows(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs every combination of the given maps, scenarios, traffic scales and seeds in parallel")
+    parser.add_argument("--maps", nargs="+", choices=list(getScenarioLocations().keys()), help="defaults to every map")
+    parser.add_argument("--scenarios", nargs="+", type=int, choices=list(SCENARIO_NUMBER_CONFIGS.keys()), help="defaults to every scenario")
+    parser.add_argument("--scales", nargs="+", type=float, default=[None], help="defaults to each map's own traffic scale")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[None])
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--processes", type=int, help="defaults to the number of CPUs")
+    parser.add_argument("--backend", default=SOCKET, choices=[b for b in BACKENDS if b != FAKE])
+    parser.add_argument("--output", help="directory for the results table and each run's outputs")
+    parser.add_argument("--analyse", action="store_true", help="add each run's emissions and trip totals to the results table")
+    addRunCacheArguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    sweep = buildSweep(args.maps, args.scenarios, args.scales, args.seeds, args.steps)
+    runSweep(sweep, args.processes, args.backend, args.output, args.analyse, createRunCache(args))
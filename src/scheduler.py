@@ -0,0 +1,93 @@
+# The control tasks run by the simulation manager each step
+FORMATION = "formation"
+MERGE = "merge"
+PLATOON_UPDATE = "platoonUpdate"
+FOLLOWER_CONTROL = "followerControl"
+INTERSECTION = "intersection"
+TASKS = (FORMATION, MERGE, PLATOON_UPDATE, FOLLOWER_CONTROL, INTERSECTION)
+
+class ControlScheduler():
+    """
+    Decides how often each part of the simulation manager's control pipeline runs.
+    Every task has its own interval (in steps):
+    - formation: placing vehicles that aren't in a platoon into one
+    - merge: merging platoons that have stopped behind another
+    - platoonUpdate: updating platoons that are cruising steadily
+    - followerControl: setting the lanes and speeds of the followers of those platoons
+    Platoons that are dirty (their lead vehicle's speed or lane has changed, their members
+    have changed or they are under an intersection's control) are always updated on the
+    step they change. Intersection controllers run every step but, if a horizon is given,
+    only control platoons within that many metres of the junction.
+    The default of every task running every step, with no horizon, matches running without
+    a scheduler. The work skipped on each step is counted per task.
+    """
+
+    def __init__(self, formationInterval=1, mergeInterval=1, platoonUpdateInterval=1, followerInterval=1,
+                 intersectionHorizon=None, speedTolerance=0.1):
+        """
+        speedTolerance is how far (in m/s) a lead vehicle's speed can drift from the speed
+        its platoon was last updated with before the platoon is dirty
+        """
+        for interval in (formationInterval, mergeInterval, platoonUpdateInterval, followerInterval):
+            if interval < 1:
+                raise ValueError("Scheduler intervals must be at least 1 step")
+        self.intervals = {
+            FORMATION: formationInterval,
+            MERGE: mergeInterval,
+            PLATOON_UPDATE: platoonUpdateInterval,
+            FOLLOWER_CONTROL: followerInterval,
+        }
+        self.intersectionHorizon = intersectionHorizon
+        self.speedTolerance = speedTolerance
+        self.step = 0
+        self.skippedLastStep = dict.fromkeys(TASKS, 0)
+        self.totalSkipped = dict.fromkeys(TASKS, 0)
+        self._skippedThisStep = dict.fromkeys(TASKS, 0)
+
+    def endStep(self):
+        """
+        Moves on to the next step, this should be called once the step's control has finished
+        """
+        self.skippedLastStep = self._skippedThisStep
+        for task, count in self._skippedThisStep.items():
+            self.totalSkipped[task] = self.totalSkipped[task] + count
+        self._skippedThisStep = dict.fromkeys(TASKS, 0)
+        self.step = self.step + 1
+
+    def getSkippedLastStep(self):
+        """
+        Gets the total amount of work (vehicles, platoons or merge checks) skipped in the last step
+        """
+        return sum(self.skippedLastStep.values())
+
+    def isDue(self, task):
+        """
+        Returns True if the given task runs in full on this step
+        """
+        return self.step % self.intervals[task] == 0
+
+    def isEveryStep(self):
+        """
+        Returns True if nothing is ever skipped
+        """
+        return self.intersectionHorizon is None and all(interval == 1 for interval in self.intervals.values())
+
+    def skipped(self, task, count=1):
+        self._skippedThisStep[task] = self._skippedThisStep[task] + count
+
+def addSchedulerArguments(parser):
+    """
+    Adds the options for each task's interval (and the intersection horizon) to an argparse parser
+    """
+    parser.add_argument("--formation-interval", dest="formationInterval", type=int, default=1, help="place vehicles into platoons every N steps")
+    parser.add_argument("--merge-interval", dest="mergeInterval", type=int, default=1, help="merge stopped platoons every N steps")
+    parser.add_argument("--platoon-update-interval", dest="platoonUpdateInterval", type=int, default=1, help="update steady platoons every N steps")
+    parser.add_argument("--follower-interval", dest="followerInterval", type=int, default=1, help="control the followers of steady platoons every N steps")
+    parser.add_argument("--intersection-horizon", dest="intersectionHorizon", type=float, help="only control platoons within this many metres of a junction")
+
+def createScheduler(args):
+    """
+    Creates a scheduler from the options added by addSchedulerArguments
+    """
+    return ControlScheduler(args.formationInterval, args.mergeInterval, args.platoonUpdateInterval,
+                            args.followerInterval, args.intersectionHorizon)
@@ -1,20 +1,41 @@
 import logging
-import traci
-from sumolib import checkBinary
+from backend import traci, SOCKET
 
 def flatten(l):
     # A basic function to flatten a list
     return [item for sublist in l for item in sublist]
 
-def setUpSimulation(configFile, trafficScale = 1, outputFileLocation="output/additional.xml"):
-    # Check SUMO has been set up properly
-    sumoBinary = checkBinary("sumo-gui")
+def setUpSimulation(configFile, trafficScale = 1, outputFileLocation="output/additional.xml", backend=SOCKET, gui=False,
+                    seed=None, label=None, port=None, extraOptions=None):
+    # Select how we talk to SUMO, either over a socket, in-process with libsumo or
+    # against a fake backend (given either by name or as a populated instance)
+    traci.use(backend)
+    if traci.getName() == SOCKET:
+        # Check SUMO has been set up properly
+        from sumolib import checkBinary
+        sumoBinary = checkBinary("sumo-gui" if gui else "sumo")
+    elif gui:
+        raise ValueError("The SUMO GUI can only be used with the %s backend" % SOCKET)
+    else:
+        # The binary is ignored when running in-process
+        sumoBinary = "sumo"
 
-    # Set up logger
+    # Set up logger, tracing of platoons and intersections is configured separately (see tracing.py)
     logging.basicConfig(format='%(asctime)s %(message)s')
     root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
+    root.setLevel(logging.INFO)
 
     # Start Simulation and step through
-    traci.start([sumoBinary, "-c", configFile, "--step-length", "0.1", "--collision.action", "none", "--start",
-                 "--additional-files", outputFileLocation, "--duration-log.statistics", "--scale", str(trafficScale)])
\ No newline at end of file
+    cmd = [sumoBinary, "-c", configFile, "--step-length", "0.1", "--collision.action", "none", "--start",
+           "--additional-files", outputFileLocation, "--duration-log.statistics", "--scale", str(trafficScale)]
+    if seed is not None:
+        cmd.extend(["--seed", str(seed)])
+    # Any other SUMO options, ex. extra outputs
+    cmd.extend(extraOptions or [])
+    # A label and port are only needed when several simulations are connected to at once
+    connectionArgs = dict()
+    if label:
+        connectionArgs["label"] = label
+    if port:
+        connectionArgs["port"] = port
+    traci.start(cmd, **connectionArgs)
@@ -1,125 +1,428 @@
 from intersectionController import IntersectionController
-from platoon import Platoon
+from platoon import Platoon, updateFollowers
+from laneindex import LaneIndex, getMinGap
 from vehicle import Vehicle
-from simlib import flatten
+from statecache import stateCache, LEADER_LOOKAHEAD
+from routes import routeRegistry
+from commandbuffer import commandBuffer
+from profiling import profiler
+from scheduler import ControlScheduler, FORMATION, MERGE, PLATOON_UPDATE, FOLLOWER_CONTROL, INTERSECTION
 
-import traci
+from backend import traci
+
+# Vehicles are assumed to drive no faster than this many times a lane's speed limit when working
+# out the soonest they could reach an intersection
+MAX_SPEED_FACTOR = 1.2
 
 class SimulationManager():
 
-    def __init__(self, pCreation=True, iCoordination=True, iZipping=True, maxVehiclesPerPlatoon=0):
+    def __init__(self, pCreation=True, iCoordination=True, iZipping=True, maxVehiclesPerPlatoon=0, metrics=None, conflicts=None, topology=None, scheduler=None):
+        """
+        conflicts gives the movement conflicts at each traffic light (see topology.Topology.getConflicts),
+        so that intersection controllers can let platoons on movements that don't conflict cross at
+        the same time. If the network's compiled topology is given, lane lengths, controlled lanes
+        and conflicts are read from it rather than requested from SUMO.
+        scheduler (a ControlScheduler) sets how often each part of the control runs, by
+        default everything runs every step.
+        """
         self.intersections = []
         self.platoons = list()
+        # Indexes kept up to date by the platoons themselves, active platoons are
+        # held in a dict so that they keep the order they were created in
+        self._activePlatoons = dict()
+        self._platoonByVehicle = dict()
+        self._platoonsByLane = dict()
+        # The platoons on each lane in order of position, built the first time it's needed each step
+        self._laneIndex = None
+        # The controllers serving each lane, and the platoons that have moved onto one of
+        # their lanes since they last looked (admitted at the next intersection update)
+        self._controllersByLane = dict()
+        self._pendingAdmissions = dict()
         self.platoonCreation = pCreation
-        self.vehicles = list()
+        # Registry of every vehicle currently in the simulation, keyed by vehicle ID
+        self.vehicles = dict()
         self.maxStoppedVehicles = dict()
         self.maxVehiclesPerPlatoon = maxVehiclesPerPlatoon
+        # An optional MetricsRecorder that time series are recorded to every step
+        self.metrics = metrics
+        self.scheduler = scheduler or ControlScheduler()
+        # Totals for platoons that have been removed from self.platoons once inactive,
+        # these are still needed to calculate the average platoon length
+        self._retiredPlatoonCount = 0
+        self._retiredPlatoonVehicleCount = 0
+        # Set once the simulation has been advanced several steps at once, the departed and
+        # arrived lists then only cover the last step so vehicles are checked against SUMO's
+        self._resynchronise = False
+        stateCache.reset()
+        stateCache.setTopology(topology)
+        commandBuffer.reset()
+        for vehicleID in traci.vehicle.getIDList():
+            self.vehicles[vehicleID] = Vehicle(vehicleID)
         if iCoordination:
+            if conflicts is None and topology:
+                conflicts = topology.getConflicts()
             for intersection in traci.trafficlight.getIDList():
-                controller = IntersectionController(intersection, iZipping)
+                controlledLanes = topology.getControlledLanes(intersection) if topology and topology.hasTrafficLight(intersection) else None
+                controller = IntersectionController(intersection, iZipping, conflicts.get(intersection) if conflicts else None, controlledLanes)
                 self.intersections.append(controller)
+                for lane in controller.lanesServed:
+                    self._controllersByLane.setdefault(lane, []).append(controller)
+
+    def __getstate__(self):
+        # The metrics recorder holds open files so it isn't saved in checkpoints
+        state = self.__dict__.copy()
+        state["metrics"] = None
+        state["_laneIndex"] = None
+        return state
 
     def createPlatoon(self, vehicles):
         # Creates a platoon with the given vehicles
-        platoon = Platoon(vehicles, maxVehicles=self.maxVehiclesPerPlatoon)
-        self.platoons.append(platoon)
+        return Platoon(vehicles, maxVehicles=self.maxVehiclesPerPlatoon, manager=self)
 
     def getActivePlatoons(self):
         # Gets all active platoons
-        return [p for p in self.platoons if p.isActive()]
+        return list(self._activePlatoons)
 
     def getAllVehiclesInPlatoons(self):
         # Gets all vehicles in every active platoon
-        return flatten(p.getAllVehiclesByName() for p in self.getActivePlatoons())
+        return list(self._platoonByVehicle)
 
     def getAverageLengthOfAllPlatoons(self):
-        if self.platoons:
-            count = 0
-            length = len(self.platoons)
-            for platoon in self.platoons:
-                if platoon._disbandReason != "Merged" and platoon._disbandReason != "Reform required due to new leader":
-                    count = count + platoon.getNumberOfVehicles()
-                else:
-                    length = length - 1
+        count = self._retiredPlatoonVehicleCount
+        length = self._retiredPlatoonCount
+        for platoon in self.platoons:
+            if self._countsTowardsAverageLength(platoon):
+                count = count + platoon.getNumberOfVehicles()
+                length = length + 1
+        if length:
             return count/length
 
+    def _compactPlatoons(self):
+        # Removes inactive platoons, keeping only the totals needed for statistics
+        activePlatoons = []
+        for platoon in self.platoons:
+            if platoon.isActive():
+                activePlatoons.append(platoon)
+            elif self._countsTowardsAverageLength(platoon):
+                self._retiredPlatoonCount = self._retiredPlatoonCount + 1
+                self._retiredPlatoonVehicleCount = self._retiredPlatoonVehicleCount + platoon.getNumberOfVehicles()
+        self.platoons = activePlatoons
+
+    def _countsTowardsAverageLength(self, platoon):
+        return platoon._disbandReason != "Merged" and platoon._disbandReason != "Reform required due to new leader"
+
+    def getMergeCandidate(self, platoon):
+        # Gets the platoon the given platoon could merge into, the one directly in front of
+        # it if it is close enough for its lead vehicle to see as its leader and has room for
+        # all its vehicles. Like SUMO's leader the platoon may be on the same lane index of
+        # the next edge on the route if the lead vehicle's lane is clear
+        lead = platoon.getLeadVehicle()
+        nextEdge = routeRegistry.getNextEdge(lead.getRouteID(), lead.getRouteIndex())
+        nextLane = "%s_%s" % (nextEdge, lead.getLaneIndex()) if nextEdge else None
+        ahead = self.getPlatoonAhead(lead.getLane(), lead.getLanePosition() + getMinGap(lead), LEADER_LOOKAHEAD, nextLane)
+        if ahead and ahead.canAddVehicles(platoon.getAllVehicles()):
+            return ahead
+
+    def getPlatoonAhead(self, lane, position, distance, nextLane=None):
+        # Gets the platoon directly in front of a position on a lane if the back of its
+        # rear vehicle is within distance metres of it, carrying on along nextLane if
+        # given (see laneindex.LaneIndex)
+        if self._laneIndex is None:
+            # Vehicles left out of platoons (ex. while formation is skipped) block the way
+            unplaced = []
+            if len(self._platoonByVehicle) != len(self.vehicles):
+                unplaced = [v for v in self.vehicles.values() if v.getName() not in self._platoonByVehicle]
+            self._laneIndex = LaneIndex(self._activePlatoons, unplaced)
+        return self._laneIndex.getPlatoonAhead(lane, position, distance, nextLane)
+
     def getPlatoonByLane(self, lane):
         # Gets platoons corresponding to a given lane
-        return [p for p in self.getActivePlatoons() if lane == p.getLane()]
+        return list(self._platoonsByLane.get(lane, ()))
 
     def getPlatoonByVehicle(self, v):
-        return [p for p in self.getActivePlatoons() if v in p.getAllVehiclesByName()]
+        platoon = self._platoonByVehicle.get(v)
+        return [platoon] if platoon else []
 
-    def getReleventPlatoon(self, vehicle):
+    def getReleventPlatoon(self, vehicle, joining=None):
         # Returns a single platoon that is most relevent to the given
         # vehicle by looking to see if the car in front is part of a platoon
         # It also checks that the platoon is heading in the right direction
+        # and has room for it alongside any vehicles already waiting to join it
         leadVeh = vehicle.getLeader()
         if leadVeh and leadVeh[1] < 10:
             possiblePlatoon = self.getPlatoonByVehicle(leadVeh[0])
             if possiblePlatoon:
-                if possiblePlatoon[0].checkVehiclePathsConverge([vehicle]) and vehicle not in possiblePlatoon[0].getAllVehicles() and possiblePlatoon[0].canAddVehicles([vehicle]):
+                waiting = joining.get(possiblePlatoon[0], []) if joining else []
+                if possiblePlatoon[0].checkVehiclePathsConverge([vehicle]) and vehicle not in possiblePlatoon[0].getAllVehicles() and possiblePlatoon[0].canAddVehicles(waiting + [vehicle]):
                     return possiblePlatoon[0]
 
+    def platoonCreated(self, platoon):
+        # Called by a platoon when it is created (including when one is split off another),
+        # adds it to each index
+        self.platoons.append(platoon)
+        self._activePlatoons[platoon] = None
+        if self._laneIndex is not None:
+            self._laneIndex.add(platoon)
+        for v in platoon.getAllVehicles():
+            self._platoonByVehicle[v.getName()] = platoon
+        self._platoonsByLane.setdefault(platoon.getLane(), set()).add(platoon)
+        self._routeToControllers(platoon)
+
+    def platoonDisbanded(self, platoon):
+        # Called by a platoon when it is disbanded, removes it from each index
+        if platoon not in self._activePlatoons:
+            return
+        del self._activePlatoons[platoon]
+        if self.metrics:
+            self.metrics.recordDisband(platoon)
+        for v in platoon.getAllVehicles():
+            if self._platoonByVehicle.get(v.getName()) is platoon:
+                del self._platoonByVehicle[v.getName()]
+        self._removeFromLaneIndex(platoon, platoon.getLane())
+
+    def platoonLaneChanged(self, platoon, previousLane):
+        # Called by a platoon when its lead vehicle moves onto a new lane
+        if platoon in self._activePlatoons:
+            self._removeFromLaneIndex(platoon, previousLane)
+            self._platoonsByLane.setdefault(platoon.getLane(), set()).add(platoon)
+            self._routeToControllers(platoon)
+
+    def platoonVehicleAdded(self, platoon, vehicle):
+        # Called by a platoon when a vehicle joins it
+        if platoon in self._activePlatoons:
+            self._platoonByVehicle[vehicle.getName()] = platoon
+
+    def _routeToControllers(self, platoon):
+        # Queues the platoon to be admitted by any controllers serving its lane
+        for controller in self._controllersByLane.get(platoon.getLane(), ()):
+            self._pendingAdmissions.setdefault(controller, dict())[platoon] = None
+
+    def _removeFromLaneIndex(self, platoon, lane):
+        platoonsInLane = self._platoonsByLane.get(lane)
+        if platoonsInLane:
+            platoonsInLane.discard(platoon)
+            if not platoonsInLane:
+                del self._platoonsByLane[lane]
+
+    def resetStatistics(self):
+        """
+        Clears the statistics gathered so far (stopped vehicles and retired platoons), ex. once
+        a run has been warmed up
+        """
+        self.maxStoppedVehicles = dict()
+        self._retiredPlatoonCount = 0
+        self._retiredPlatoonVehicleCount = 0
+
+    def isIdle(self):
+        """
+        Returns True if no control action is pending: no vehicles waiting to join platoons,
+        no platoons waiting to merge or being handled by an intersection controller, and every
+        platoon with followers steady (see Platoon.isSteady). Nothing then needs controlling
+        until the time given by getTimeToNextAction.
+        """
+        if self._pendingAdmissions or (self.platoonCreation and len(self._platoonByVehicle) != len(self.vehicles)):
+            return False
+        for controller in self.intersections:
+            if controller.platoons:
+                return False
+        for platoon in self._activePlatoons:
+            if platoon.canMerge() or (platoon.getNumberOfVehicles() > 1 and not platoon.isSteady()):
+                return False
+        return True
+
+    def getTimeToNextAction(self):
+        """
+        Gets the soonest (in seconds) the manager may need to act again while it is idle: a
+        vehicle reaching a lane controlled by an intersection controller (see
+        getTimeToIntersections) or the lead vehicle of a platoon with followers reaching the
+        end of its lane, where the platoon's paths are checked and its followers change lane.
+        None if neither will happen.
+        """
+        soonest = self.getTimeToIntersections()
+        for platoon in self._activePlatoons:
+            if platoon.getNumberOfVehicles() > 1:
+                lead = platoon.getLeadVehicle()
+                speed = lead.getSpeed()
+                time = (stateCache.getLaneLength(lead.getLane()) - lead.getLanePosition()) / speed if speed > 0 else 0
+                if soonest is None or time < soonest:
+                    soonest = time
+        return soonest
+
+    def getTimeToIntersections(self):
+        """
+        Gets the soonest (in seconds) any vehicle could reach a lane controlled by an
+        intersection controller, following its route at up to MAX_SPEED_FACTOR times the
+        speed limit. None if no vehicle will reach one.
+        """
+        if not self._controllersByLane:
+            return None
+        controlledEdges = {lane.rsplit("_", 1)[0] for lane in self._controllersByLane}
+        soonest = None
+        for v in self.vehicles.values():
+            if not v.isActive():
+                continue
+            lane = v.getLane()
+            if v.getEdge() in controlledEdges:
+                return 0
+            distance = stateCache.getLaneLength(lane) - v.getLanePosition()
+            speedLimit = stateCache.getLaneMaxSpeed(lane)
+            reached = False
+            for edge in v.getRemainingRoute()[1:]:
+                if edge in controlledEdges:
+                    reached = True
+                    break
+                edgeLane = "%s_0" % edge
+                distance = distance + stateCache.getLaneLength(edgeLane)
+                speedLimit = max(speedLimit, stateCache.getLaneMaxSpeed(edgeLane))
+            if reached:
+                speed = max(v.getSpeed(), min(v.getMaxSpeed(), speedLimit * MAX_SPEED_FACTOR))
+                time = distance / speed if speed > 0 else 0
+                if soonest is None or time < soonest:
+                    soonest = time
+        return soonest
+
+    def synchroniseVehicles(self):
+        """
+        Should be called after the simulation has been advanced several steps at once, so that
+        vehicles which departed or arrived during any of them are found on the next step
+        """
+        self._resynchronise = True
+
+    def _updateVehicles(self):
+        # Registers vehicles that entered the map in the last step and releases
+        # the rows of those that left before removing them
+        if self._resynchronise:
+            self._resynchronise = False
+            present = set(traci.vehicle.getIDList())
+            arrived = {vehicleID for vehicleID in self.vehicles if vehicleID not in present}
+            departed = [vehicleID for vehicleID in present if vehicleID not in self.vehicles]
+        else:
+            arrived = set(traci.simulation.getArrivedIDList())
+            departed = traci.simulation.getDepartedIDList()
+        for vehicleID in departed:
+            if vehicleID not in arrived and vehicleID not in self.vehicles:
+                self.vehicles[vehicleID] = Vehicle(vehicleID)
+        for vehicleID in arrived:
+            vehicle = self.vehicles.pop(vehicleID, None)
+            if vehicle:
+                vehicle.release()
+
     def handleSimulationStep(self):
-        allVehicles = traci.vehicle.getIDList()
-        # Check mark vehicles as in-active if they are outside the map
-        stoppedCount = dict()
-        for v in self.vehicles:
-            if v.getName() not in allVehicles:
-                v.setInActive()
-            # Get information concerning the number of vehicles queueing on each lane
-            if v.isActive() and v.getSpeed() == 0:
-                lane = v.getEdge()
-                if lane in stoppedCount:
-                    stoppedCount[lane] = stoppedCount[lane] + 1
-                else:
-                    stoppedCount[lane] = 1
+        scheduler = self.scheduler
+        self._laneIndex = None
+        with profiler.phase("vehicleState"):
+            self._updateVehicles()
+            # Take a snapshot of all subscribed vehicle states for this step
+            stateCache.update()
+
+        with profiler.phase("queueStatistics"):
+            stoppedCount = dict()
+            for v in self.vehicles.values():
+                # Get information concerning the number of vehicles queueing on each lane
+                if v.getSpeed() == 0:
+                    lane = v.getEdge()
+                    if lane in stoppedCount:
+                        stoppedCount[lane] = stoppedCount[lane] + 1
+                    else:
+                        stoppedCount[lane] = 1
 
-        # Gather statistics for amount of vehicles stopped per lane
-        for lane in stoppedCount:
-            if lane in self.maxStoppedVehicles:
-                if stoppedCount[lane] > self.maxStoppedVehicles[lane]:
+            # Gather statistics for amount of vehicles stopped per lane
+            for lane in stoppedCount:
+                if lane in self.maxStoppedVehicles:
+                    if stoppedCount[lane] > self.maxStoppedVehicles[lane]:
+                        self.maxStoppedVehicles[lane] = stoppedCount[lane]
+                else:
                     self.maxStoppedVehicles[lane] = stoppedCount[lane]
-            else:
-                self.maxStoppedVehicles[lane] = stoppedCount[lane]
 
-        # Update all platoons active status
-        for p in self.getActivePlatoons():
-            p.updateIsActive()
+        with profiler.phase("platoonCreation"):
+            # Update all platoons active status
+            for p in self.getActivePlatoons():
+                p.updateIsActive()
 
-        if self.platoonCreation:
-            # See whether there are any vehicles that are not
-            # in a platoon that should be in one
-            vehiclesNotInPlatoons = [v for v in allVehicles if v not in self.getAllVehiclesInPlatoons()]
-
-            for vehicleID in vehiclesNotInPlatoons:
-                vehicle = Vehicle(vehicleID)
-                self.vehicles.append(vehicle)
-                vehicleLane = vehicle.getLane()
-                # If we're not in a starting segment (speed starts as 0)
-                possiblePlatoon = self.getReleventPlatoon(vehicle)
-                if possiblePlatoon:
-                    possiblePlatoon.addVehicle(vehicle)
-                else:
-                    self.createPlatoon([vehicle, ])
+            if self.platoonCreation and not scheduler.isDue(FORMATION):
+                scheduler.skipped(FORMATION, len(self.vehicles) - len(self._platoonByVehicle))
+            elif self.platoonCreation:
+                # See whether there are any vehicles that are not
+                # in a platoon that should be in one
+                vehiclesNotInPlatoons = [v for v in self.vehicles.values() if v.getName() not in self._platoonByVehicle]
+
+                # Vehicles joining an existing platoon are added to it together once every
+                # vehicle has been placed, so each platoon is only updated once. They are
+                # indexed straight away so vehicles behind them can join the same platoon
+                joining = dict()
+                for vehicle in vehiclesNotInPlatoons:
+                    # If we're not in a starting segment (speed starts as 0)
+                    possiblePlatoon = self.getReleventPlatoon(vehicle, joining)
+                    if possiblePlatoon:
+                        joining.setdefault(possiblePlatoon, []).append(vehicle)
+                        self._platoonByVehicle[vehicle.getName()] = possiblePlatoon
+                    else:
+                        self.createPlatoon([vehicle, ])
+                for platoon, vehicles in joining.items():
+                    platoon.addVehicles(vehicles)
 
         # If we're doing intersection management, update each controller and add any new platoons into their
         # control
         if self.intersections:
-            for inControl in self.intersections:
-                inControl.removeIrreleventPlatoons()
-                inControl.findAndAddReleventPlatoons(self.getActivePlatoons())
-                inControl.update()
+            with profiler.phase("intersections"):
+                time = traci.simulation.getTime()
+                for inControl in self.intersections:
+                    inControl.removeIrreleventPlatoons()
+                    # Only platoons that have moved onto one of its lanes are offered to each controller
+                    candidates = self._pendingAdmissions.pop(inControl, None)
+                    if candidates:
+                        inControl.findAndAddReleventPlatoons(list(candidates))
+                    inControl.update(time, scheduler.intersectionHorizon)
+                    scheduler.skipped(INTERSECTION, inControl.skippedLastStep)
 
         if self.platoonCreation:
-            # Handles a single step of the simulation
-            # Update all active platoons in the scenario
-            for platoon in self.getActivePlatoons():
-                platoon.update()
-                if platoon.canMerge() and platoon.isActive():
-                    lead = platoon.getLeadVehicle().getLeader()
-                    if lead:
-                        leadPlatoon = self.getPlatoonByVehicle(lead[0])
-                        if leadPlatoon and leadPlatoon[0].canAddVehicles(platoon._vehicles):
-                            leadPlatoon[0].mergePlatoon(platoon)
\ No newline at end of file
+            with profiler.phase("platoonUpdate"):
+                # Handles a single step of the simulation
+                # Update all active platoons in the scenario, platoons cruising steadily
+                # are only updated when the scheduler says they are due
+                updateAll = scheduler.isDue(PLATOON_UPDATE)
+                followersDue = scheduler.isDue(FOLLOWER_CONTROL)
+                mergeDue = scheduler.isDue(MERGE)
+                dirtyPlatoons = []
+                for platoon in self.getActivePlatoons():
+                    if not (updateAll and followersDue):
+                        if platoon.isDirty(scheduler.speedTolerance):
+                            dirtyPlatoons.append(platoon)
+                        elif not updateAll:
+                            scheduler.skipped(PLATOON_UPDATE)
+                            continue
+                    platoon.update()
+                    if platoon.canMerge() and platoon.isActive():
+                        if not mergeDue:
+                            scheduler.skipped(MERGE)
+                            continue
+                        leadPlatoon = self.getMergeCandidate(platoon)
+                        if leadPlatoon:
+                            leadPlatoon.mergePlatoon(platoon)
+
+            with profiler.phase("followerControl"):
+                # The followers of every platoon are controlled together in one pass, or
+                # only those of dirty platoons (including any merged into since their
+                # update) when steady platoons aren't due
+                activePlatoons = self.getActivePlatoons()
+                if followersDue:
+                    updateFollowers(activePlatoons)
+                else:
+                    dirtyPlatoons = set(dirtyPlatoons)
+                    dirtyPlatoons = [p for p in activePlatoons if p in dirtyPlatoons or p._dirty]
+                    updateFollowers(dirtyPlatoons)
+                    scheduler.skipped(FOLLOWER_CONTROL, len(activePlatoons) - len(dirtyPlatoons))
+
+        self._compactPlatoons()
+
+        with profiler.phase("commandFlush"):
+            # Send all the vehicle commands gathered during this step
+            commandBuffer.flush()
+
+        scheduler.endStep()
+
+        if self.metrics:
+            with profiler.phase("metrics"):
+                self.metrics.recordStep(traci.simulation.getTime(), self, stoppedCount,
+                                        commandBuffer.issuedLastStep, commandBuffer.suppressedLastStep,
+                                        scheduler.getSkippedLastStep())
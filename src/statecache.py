@@ -0,0 +1,96 @@
+from backend import traci, constants as tc
+from routes import routeRegistry
+from vehiclestore import VehicleStore
+
+# The variables that are subscribed to for every tracked vehicle, these cover every
+# getter in the Vehicle class that changes from step to step
+VEHICLE_SUBSCRIPTION_VARIABLES = (tc.VAR_SPEED, tc.VAR_ROAD_ID, tc.VAR_LANE_ID, tc.VAR_LANE_INDEX,
+                                  tc.VAR_LANEPOSITION, tc.VAR_ROUTE_INDEX, tc.VAR_ROUTE_ID, tc.VAR_LEADER)
+LEADER_LOOKAHEAD = 20
+
+class StateCache():
+    """
+    A per-step snapshot of the state of every tracked vehicle.
+    Each vehicle is subscribed to once, then all results are retrieved with a single
+    call after each simulation step and written into the vehicle store. This means the
+    number of TraCI calls made per step grows with the number of vehicles rather than
+    the number of getter calls.
+    """
+
+    def __init__(self):
+        self._laneLengths = dict()
+        self._laneMaxSpeeds = dict()
+        self._subscribed = set()
+        self._topology = None
+        self.store = VehicleStore()
+
+    def getLaneLength(self, lane):
+        """
+        Gets the length of a lane, lane lengths do not change during a run so these are
+        only ever requested once (and not at all if the lane is in the topology)
+        """
+        if lane not in self._laneLengths:
+            if self._topology and self._topology.hasLane(lane):
+                self._laneLengths[lane] = self._topology.getLaneLength(lane)
+            else:
+                self._laneLengths[lane] = traci.lane.getLength(lane)
+        return self._laneLengths[lane]
+
+    def getLaneMaxSpeed(self, lane):
+        """
+        Gets the speed limit of a lane, these are also only requested once
+        """
+        if lane not in self._laneMaxSpeeds:
+            if self._topology and self._topology.hasLane(lane):
+                self._laneMaxSpeeds[lane] = self._topology.getLaneMaxSpeed(lane)
+            else:
+                self._laneMaxSpeeds[lane] = traci.lane.getMaxSpeed(lane)
+        return self._laneMaxSpeeds[lane]
+
+    def isSubscribed(self, vehicleID):
+        return vehicleID in self._subscribed
+
+    def reset(self):
+        """
+        Clears all cached state, this should be called at the start of every run
+        """
+        self._laneLengths.clear()
+        self._laneMaxSpeeds.clear()
+        self._subscribed.clear()
+        self._topology = None
+        routeRegistry.reset()
+        # Handles from a previous run keep the old store, so their rows are never
+        # released into this one
+        self.store = VehicleStore()
+
+    def setTopology(self, topology):
+        """
+        Sets the compiled network topology (see topology.Topology) lane details are read from
+        """
+        self._topology = topology
+
+    def subscribe(self, vehicleID):
+        """
+        Subscribes to all the variables needed for a vehicle (including its leader).
+        Both are done in a single subscription as a second subscription to the same
+        vehicle would replace the first.
+        """
+        if vehicleID not in self._subscribed:
+            traci.vehicle.subscribe(vehicleID, VEHICLE_SUBSCRIPTION_VARIABLES,
+                                    parameters={tc.VAR_LEADER: ("d", LEADER_LOOKAHEAD)})
+            self._subscribed.add(vehicleID)
+
+    def update(self):
+        """
+        Retrieves the results of every subscription, this should be called once after each
+        simulation step
+        """
+        results = traci.vehicle.getAllSubscriptionResults()
+        for row in self.store.update(results):
+            route = traci.vehicle.getRoute(self.store.name[row])
+            self.store.setRoute(row, route, routeRegistry.intern(route))
+        # Subscriptions are removed by SUMO once a vehicle leaves the simulation
+        if len(results) != len(self._subscribed):
+            self._subscribed.intersection_update(results)
+
+stateCache = StateCache()
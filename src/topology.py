@@ -0,0 +1,313 @@
+from array import array
+import argparse
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ElementTree
+
+MAGIC = b"PLTOPO01"
+# The cache file sits next to the network it was compiled from
+CACHE_EXTENSION = ".topology"
+_HEADER = struct.Struct("<8s32sI4x")
+_SECTION = struct.Struct("<4scxxxQ")
+
+def hashFile(fileLocation):
+    """
+    Gets the SHA-256 digest of a file, used to tell whether a cache is out of date
+    """
+    digest = hashlib.sha256()
+    with open(fileLocation, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+def getCacheLocation(netFile):
+    return os.path.splitext(netFile)[0] + CACHE_EXTENSION
+
+def _parseNetwork(netFile):
+    """
+    Streams through a .net.xml file collecting everything the topology cache holds. Each
+    element directly under the root is cleared, and dropped from the root, once it has been
+    read so memory use doesn't grow with the size of the network.
+    """
+    lanes = dict()
+    edgeLanes = dict()
+    successors = dict()
+    incomingLanes = dict()
+    internalLanes = dict()
+    foes = dict()
+    connectionsByLane = dict()
+    tlsLinks = dict()
+    depth = 0
+    context = ElementTree.iterparse(netFile, events=("start", "end"))
+    event, root = next(context)
+    for event, element in context:
+        if event == "start":
+            depth = depth + 1
+            continue
+        depth = depth - 1
+        tag = element.tag
+        if tag == "lane":
+            lanes[element.get("id")] = (float(element.get("length")), float(element.get("speed")))
+        elif tag == "edge":
+            edgeLanes[element.get("id")] = [lane.get("id") for lane in element.iter("lane")]
+        elif tag == "junction":
+            junction = element.get("id")
+            if not junction.startswith(":"):
+                incomingLanes[junction] = element.get("incLanes", "").split()
+                internalLanes[junction] = element.get("intLanes", "").split()
+                for request in element.iter("request"):
+                    # The foes string has one character per link, with link 0 last
+                    linkFoes = request.get("foes")[::-1]
+                    foes[(junction, int(request.get("index")))] = {j for j, c in enumerate(linkFoes) if c == "1"}
+        elif tag == "connection":
+            fromEdge = element.get("from")
+            toEdge = element.get("to")
+            if not fromEdge.startswith(":") and not toEdge.startswith(":"):
+                lane = "%s_%s" % (fromEdge, element.get("fromLane"))
+                tls = element.get("tl")
+                connectionsByLane.setdefault(lane, []).append((tls, element.get("via")))
+                edgeSuccessors = successors.setdefault(fromEdge, [])
+                if toEdge not in edgeSuccessors:
+                    edgeSuccessors.append(toEdge)
+                if tls:
+                    tlsLinks.setdefault(tls, dict())[int(element.get("linkIndex"))] = lane
+        if depth == 0:
+            element.clear()
+            root.clear()
+
+    # Traffic lights control their lanes in link index order (as getControlledLanes gives them)
+    controlledLanes = {tls: [links[i] for i in sorted(links)] for tls, links in tlsLinks.items()}
+    return lanes, edgeLanes, successors, controlledLanes, _buildConflicts(incomingLanes, internalLanes, foes, connectionsByLane)
+
+def _buildConflicts(incomingLanes, internalLanes, foes, connectionsByLane):
+    """
+    Works out which incoming lanes of each traffic light conflict. Each connection is given
+    its junction link index and two lanes conflict if any of their links are foes in the
+    junction's right of way requests. The link index is the position of the connection's
+    internal lane (its via attribute) in the junction's intLanes. The linkIndex attribute
+    can't be used as it is the connection's signal index, which isn't the same once a
+    traffic light's signals have been renumbered or it is joined over several junctions.
+    Networks built without internal lanes fall back to counting the connections over the
+    junction's incoming lanes in order, as SUMO does.
+    """
+    linksByTls = dict()
+    for junction, junctionLanes in incomingLanes.items():
+        internalIndex = {lane: i for i, lane in enumerate(internalLanes.get(junction, ()))}
+        index = 0
+        for lane in junctionLanes:
+            for tls, via in connectionsByLane.get(lane, ()):
+                if tls:
+                    link = internalIndex.get(via, index)
+                    linksByTls.setdefault(tls, dict()).setdefault(lane, set()).add((junction, link))
+                index = index + 1
+
+    conflicts = dict()
+    for tls, links in linksByTls.items():
+        conflicts[tls] = dict()
+        for lane, laneLinks in links.items():
+            laneFoes = {(junction, j) for junction, i in laneLinks for j in foes.get((junction, i), ())}
+            conflicting = {other for other, otherLinks in links.items() if otherLinks & laneFoes}
+            conflicting.add(lane)
+            conflicts[tls][lane] = conflicting
+    return conflicts
+
+def _packNames(names):
+    return array("B", "\n".join(names).encode("utf-8"))
+
+def _packLists(lists, index):
+    """
+    Packs a list of lists of names as offsets into a flat array of indexes
+    """
+    offsets = array("i", [0])
+    values = array("i")
+    for names in lists:
+        values.extend(index[name] for name in names)
+        offsets.append(len(values))
+    return offsets, values
+
+def compileTopology(netFile, cacheFile=None):
+    """
+    Parses a .net.xml file and writes its topology to a binary cache file: lane lengths and
+    speed limits, the lanes of each edge, the edges following each edge, the lanes controlled
+    by each traffic light and which of those lanes conflict. Returns the cache's location.
+    """
+    cacheFile = cacheFile or getCacheLocation(netFile)
+    lanes, edgeLanes, successors, controlledLanes, conflicts = _parseNetwork(netFile)
+    laneNames = list(lanes)
+    laneIndex = {lane: i for i, lane in enumerate(laneNames)}
+    edgeNames = list(edgeLanes)
+    edgeIndex = {edge: i for i, edge in enumerate(edgeNames)}
+    # Successors may be edges without lanes of their own in the file, so add any missing
+    for edgeSuccessors in successors.values():
+        for edge in edgeSuccessors:
+            if edge not in edgeIndex:
+                edgeIndex[edge] = len(edgeNames)
+                edgeNames.append(edge)
+                edgeLanes[edge] = []
+    tlsNames = list(controlledLanes)
+
+    conflictTls = array("i")
+    conflictLanes = array("i")
+    conflictLists = []
+    for t, tls in enumerate(tlsNames):
+        for lane, conflicting in conflicts.get(tls, dict()).items():
+            conflictTls.append(t)
+            conflictLanes.append(laneIndex[lane])
+            conflictLists.append(sorted(conflicting))
+
+    sections = [
+        (b"lnam", _packNames(laneNames)),
+        (b"llen", array("d", [lanes[lane][0] for lane in laneNames])),
+        (b"lspd", array("d", [lanes[lane][1] for lane in laneNames])),
+        (b"enam", _packNames(edgeNames)),
+        (b"tnam", _packNames(tlsNames)),
+        (b"ctls", conflictTls),
+        (b"clan", conflictLanes),
+    ]
+    for name, (offsets, values) in ((b"elan", _packLists([edgeLanes[edge] for edge in edgeNames], laneIndex)),
+                                    (b"esuc", _packLists([successors.get(edge, ()) for edge in edgeNames], edgeIndex)),
+                                    (b"tlan", _packLists([controlledLanes[tls] for tls in tlsNames], laneIndex)),
+                                    (b"cfoe", _packLists(conflictLists, laneIndex))):
+        sections.append((name[:3] + b"o", offsets))
+        sections.append((name[:3] + b"v", values))
+
+    # Written to a temporary file first so that processes reading the cache never see
+    # a partly written one
+    temporaryFile = "%s.%s.tmp" % (cacheFile, os.getpid())
+    with open(temporaryFile, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, hashFile(netFile), len(sections)))
+        for name, values in sections:
+            data = values.tobytes()
+            f.write(_SECTION.pack(name, values.typecode.encode("ascii"), len(data)))
+            f.write(data)
+            # Keep every section 8 byte aligned so it can be read in place
+            f.write(b"\0" * (-len(data) % 8))
+    os.replace(temporaryFile, cacheFile)
+    return cacheFile
+
+class Topology():
+    """
+    Read-only view of a compiled topology cache. The file is memory mapped so lane lengths
+    and the like are read straight from it, and every process using the same network
+    shares one copy through the page cache.
+    """
+
+    def __init__(self, cacheFile):
+        self._file = open(cacheFile, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.netHash, sectionCount = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a topology cache" % cacheFile)
+        self._sections = dict()
+        offset = _HEADER.size
+        self._view = view = memoryview(self._map)
+        for i in range(sectionCount):
+            name, typecode, size = _SECTION.unpack_from(self._map, offset)
+            offset = offset + _SECTION.size
+            self._sections[name] = view[offset:offset + size].cast(typecode.decode("ascii"))
+            offset = offset + size + (-size % 8)
+
+        self._laneNames = self._unpackNames(b"lnam")
+        self._laneIndex = {lane: i for i, lane in enumerate(self._laneNames)}
+        self._edgeNames = self._unpackNames(b"enam")
+        self._edgeIndex = {edge: i for i, edge in enumerate(self._edgeNames)}
+        self._tlsNames = self._unpackNames(b"tnam")
+        self._tlsIndex = {tls: i for i, tls in enumerate(self._tlsNames)}
+        self._laneLengths = self._sections[b"llen"]
+        self._laneSpeeds = self._sections[b"lspd"]
+
+    def _unpackNames(self, section):
+        data = bytes(self._sections[section])
+        return data.decode("utf-8").split("\n") if data else []
+
+    def _getList(self, section, i, names):
+        offsets = self._sections[section + b"o"]
+        values = self._sections[section + b"v"]
+        return [names[v] for v in values[offsets[i]:offsets[i + 1]]]
+
+    def close(self):
+        for section in self._sections.values():
+            section.release()
+        self._sections = dict()
+        self._laneLengths = self._laneSpeeds = None
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def hasLane(self, lane):
+        return lane in self._laneIndex
+
+    def getLaneLength(self, lane):
+        return self._laneLengths[self._laneIndex[lane]]
+
+    def getLaneMaxSpeed(self, lane):
+        return self._laneSpeeds[self._laneIndex[lane]]
+
+    def getEdgeLanes(self, edge):
+        return self._getList(b"ela", self._edgeIndex[edge], self._laneNames)
+
+    def getSuccessors(self, edge):
+        """
+        Gets the edges that can be reached directly from the given edge
+        """
+        return self._getList(b"esu", self._edgeIndex[edge], self._edgeNames)
+
+    def hasTrafficLight(self, tlsID):
+        return tlsID in self._tlsIndex
+
+    def getControlledLanes(self, tlsID):
+        """
+        Gets the lanes controlled by a traffic light in link index order, the same as
+        traci.trafficlight.getControlledLanes
+        """
+        return self._getList(b"tla", self._tlsIndex[tlsID], self._laneNames)
+
+    def getConflicts(self):
+        """
+        Gets the lanes each controlled lane conflicts with (including itself) at every
+        traffic light, as {tlsID: {lane: frozenset of lanes}}
+        """
+        conflicts = {tls: dict() for tls in self._tlsNames}
+        tlsIndexes = self._sections[b"ctls"]
+        laneIndexes = self._sections[b"clan"]
+        for i in range(len(tlsIndexes)):
+            lane = self._laneNames[laneIndexes[i]]
+            conflicts[self._tlsNames[tlsIndexes[i]]][lane] = frozenset(self._getList(b"cfo", i, self._laneNames))
+        return conflicts
+
+def loadTopology(netFile):
+    """
+    Loads the topology of a network, compiling it first if there is no cache for it yet
+    or the network file has changed since the cache was written
+    """
+    cacheFile = getCacheLocation(netFile)
+    if os.path.exists(cacheFile):
+        try:
+            topology = Topology(cacheFile)
+        except (ValueError, KeyError, struct.error):
+            logging.info("%s could not be read, recompiling it", cacheFile)
+        else:
+            if topology.netHash == hashFile(netFile):
+                return topology
+            topology.close()
+            logging.info("%s has changed, recompiling its topology", netFile)
+    compileTopology(netFile, cacheFile)
+    return Topology(cacheFile)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compiles the topology cache of every map (or the given .net.xml files)")
+    parser.add_argument("netFiles", nargs="*")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+    netFiles = args.netFiles
+    if not netFiles:
+        mapsDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "maps")
+        netFiles = sorted(glob.glob(os.path.join(mapsDirectory, "*", "*.net.xml")))
+    for netFile in netFiles:
+        loadTopology(netFile).close()
+        logging.info("Compiled %s", getCacheLocation(netFile))
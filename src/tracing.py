@@ -0,0 +1,73 @@
+import logging
+import logging.handlers
+import queue
+
+OFF = 0
+SUMMARY = 1
+FULL = 2
+TRACE_LEVELS = {"off": OFF, "summary": SUMMARY, "full": FULL}
+DEFAULT_BUFFER_CAPACITY = 1000
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue as they are, so the message is only formatted by the
+    listener thread rather than in the simulation loop
+    """
+
+    def prepare(self, record):
+        return record
+
+class Tracer():
+    """
+    Tiered tracing of platoons and intersections.
+    off: nothing is traced and call sites skip all work (check tracer.summary / tracer.full first)
+    summary: platoon creation and disbanding plus one line per intersection per step
+    full: everything, including the state of every vehicle at each intersection
+    If a trace file is given records are queued and written to it by a background thread
+    through a buffer, otherwise they go to the normal logging output.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("trace")
+        self.logger.setLevel(logging.INFO)
+        self._handlers = []
+        self._listener = None
+        self._setLevel(OFF)
+
+    def _setLevel(self, level):
+        self.level = level
+        self.summary = level >= SUMMARY
+        self.full = level >= FULL
+
+    def close(self):
+        """
+        Writes out any buffered records and closes the trace file
+        """
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+        for handler in self._handlers:
+            self.logger.removeHandler(handler)
+            handler.close()
+        self._handlers = []
+        self.logger.propagate = True
+        self._setLevel(OFF)
+
+    def configure(self, level=OFF, traceFile=None, bufferCapacity=DEFAULT_BUFFER_CAPACITY):
+        self.close()
+        if isinstance(level, str):
+            level = TRACE_LEVELS[level]
+        self._setLevel(level)
+        if level and traceFile:
+            fileHandler = logging.FileHandler(traceFile, mode="w")
+            fileHandler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            bufferedHandler = logging.handlers.MemoryHandler(bufferCapacity, flushLevel=logging.ERROR, target=fileHandler)
+            records = queue.SimpleQueue()
+            queueHandler = _DeferredQueueHandler(records)
+            self._listener = logging.handlers.QueueListener(records, bufferedHandler)
+            self._listener.start()
+            self.logger.addHandler(queueHandler)
+            self.logger.propagate = False
+            self._handlers = [queueHandler, bufferedHandler, fileHandler]
+
+tracer = Tracer()
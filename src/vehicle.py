@@ -1,63 +1,124 @@
-import traci
+from array import array
+
+from backend import traci
+from statecache import stateCache
+from commandbuffer import commandBuffer
+from routes import routeRegistry
+
+class _ReleasedStore():
+    """
+    Stands in for the vehicle store in the handles of vehicles whose rows have been released,
+    they are never active and reading any other state from them raises
+    """
+    active = array("b", [0])
+
+    def __reduce__(self):
+        # Handles saved in checkpoints are restored pointing at the same stand in
+        return "_releasedStore"
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        raise RuntimeError("Reading %s of a vehicle that has left the simulation" % name)
+
+_releasedStore = _ReleasedStore()
 
 class Vehicle():
-    
+    """
+    A handle to a vehicle's row in the vehicle store, all of the vehicle's state lives
+    in the store's columns rather than on this object
+    """
+    __slots__ = ("_name", "_row", "_store")
+
     def __init__(self, vehicle):
-        self._active = True
-        self._acceleration = traci.vehicle.getAcceleration(vehicle)
-        self._length = traci.vehicle.getLength(vehicle)
-        self._maxSpeed = traci.vehicle.getMaxSpeed(vehicle)
         self._name = vehicle
-        self._route = traci.vehicle.getRoute(vehicle)
-        self._previouslySetValues = dict()
+        store = stateCache.store
+        # Vehicles on the same route share the registry's copy of it
+        routeID = routeRegistry.intern(traci.vehicle.getRoute(vehicle))
+        self._row = store.allocate(vehicle, traci.vehicle.getLength(vehicle), traci.vehicle.getMaxSpeed(vehicle),
+                                   traci.vehicle.getAcceleration(vehicle), routeRegistry.getRoute(routeID), routeID)
+        self._store = store
+        stateCache.subscribe(vehicle)
+
+    def release(self):
+        """
+        Frees the vehicle's row once it has left the simulation, so it can be reused straight
+        away. The handle is inactive from then on and reading its state raises.
+        """
+        if self._store is not _releasedStore:
+            self._store.release(self._row)
+            self._store = _releasedStore
+            self._row = 0
 
     def getAcceleration(self):
-        return self._acceleration
+        return self._store.acceleration[self._row]
 
     def isActive(self):
-        return self._active
-    
+        return self._store.active[self._row] == 1
+
     def getEdge(self):
-        return traci.vehicle.getRoadID(self.getName())
+        return self._store.edge[self._row]
 
     def getLane(self):
-        return traci.vehicle.getLaneID(self.getName())
+        return self._store.lane[self._row]
 
     def getLaneIndex(self):
-        return traci.vehicle.getLaneIndex(self.getName())
+        return self._store.laneIndex[self._row]
 
     def getLanePosition(self):
-        return traci.vehicle.getLanePosition(self.getName())
+        return self._store.lanePosition[self._row]
 
     def getLanePositionFromFront(self):
-        return traci.lane.getLength(self.getLane()) - self.getLanePosition()
+        return stateCache.getLaneLength(self.getLane()) - self.getLanePosition()
+
+    def getLastSetValue(self, attr):
+        """
+        Gets the value last sent for the given setter (e.g. "setSpeed"), None if it has
+        never been sent
+        """
+        return self._store.getLastCommanded(self._row, attr)
 
     def getLeader(self):
-        return traci.vehicle.getLeader(self.getName(), 20)
+        return self._store.leader[self._row]
 
     def getLength(self):
-        return self._length
+        return self._store.length[self._row]
 
     def getMaxSpeed(self):
-        return self._maxSpeed
+        return self._store.maxSpeed[self._row]
 
     def getName(self):
         return self._name
 
+    def getRow(self):
+        """
+        Gets the row in the vehicle store holding this vehicle's state, -1 once it has been released
+        """
+        return -1 if self._store is _releasedStore else self._row
+
     def getRemainingRoute(self):
-        return self._route[traci.vehicle.getRouteIndex(self.getName()):]
+        return self._store.route[self._row][self._store.routeIndex[self._row]:]
 
     def getRoute(self):
-        return self._route
+        return self._store.route[self._row]
+
+    def getRouteID(self):
+        """
+        Gets the ID the route registry gave this vehicle's route
+        """
+        return self._store.routeID[self._row]
+
+    def getRouteIndex(self):
+        return self._store.routeIndex[self._row]
 
     def getSpeed(self):
-        return traci.vehicle.getSpeed(self.getName())
+        return self._store.speed[self._row]
 
     def setColor(self, color):
         self._setAttr("setColor", color)
 
     def setInActive(self):
-        self._active = False
+        self._store.active[self._row] = 0
 
     def setImperfection(self, imperfection):
         self._setAttr("setImperfection", imperfection)
@@ -66,7 +127,7 @@ class Vehicle():
         self._setAttr("setMinGap", minGap)
 
     def setTargetLane(self, lane):
-        traci.vehicle.changeLane(self.getName(), lane, 0.5)
+        commandBuffer.queue(self.getName(), "changeLane", lane, 0.5)
 
     def setTau(self, tau):
         self._setAttr("setTau", tau)
@@ -84,8 +145,5 @@ class Vehicle():
         # Only set an attribute if the value is different from the previous value set
         # This improves performance
         if self.isActive():
-            if attr in self._previouslySetValues:
-                if self._previouslySetValues[attr] == arg:
-                    return
-            self._previouslySetValues[attr] = arg
-            getattr(traci.vehicle, attr)(self.getName(), arg)
\ No newline at end of file
+            if self._store.setCommanded(self._row, attr, arg):
+                commandBuffer.queue(self.getName(), attr, arg)
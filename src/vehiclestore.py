@@ -0,0 +1,173 @@
+from array import array
+
+from backend import constants as tc
+
+# Per vehicle state held in typed arrays, one column per variable
+NUMERIC_COLUMNS = (
+    ("speed", "d"),
+    ("laneIndex", "l"),
+    ("lanePosition", "d"),
+    ("routeIndex", "l"),
+    ("routeID", "l"),
+    ("length", "d"),
+    ("maxSpeed", "d"),
+    ("acceleration", "d"),
+    # The leader column's gap as a number, NO_LEADER if there isn't one
+    ("leaderGap", "d"),
+)
+# Values that aren't numbers are kept in lists instead
+OBJECT_COLUMNS = ("name", "edge", "lane", "leader", "route", "routeName")
+# The last value sent for each setter, NaN means nothing has been sent yet
+COMMAND_COLUMNS = {
+    "setSpeed": "commandedSpeed",
+    "setSpeedMode": "commandedSpeedMode",
+    "setSpeedFactor": "commandedSpeedFactor",
+    "setTau": "commandedTau",
+    "setMinGap": "commandedMinGap",
+    "setImperfection": "commandedImperfection",
+}
+COMMAND_OBJECT_COLUMNS = {
+    "setColor": "commandedColor",
+}
+UNSET = float("nan")
+NO_LEADER = float("inf")
+
+class VehicleStore():
+    """
+    Struct of arrays holding the state of every tracked vehicle. Each vehicle is given a
+    row when it is created, and every column (speed, lane position, ...) is a typed array
+    indexed by that row. Subscription results are written into the columns in bulk once
+    per step, so reading a value is a single array lookup. Rows are recycled once the
+    Vehicle handle using them is released.
+    """
+
+    def __init__(self):
+        self.rowsByName = dict()
+        self._freeRows = []
+        # Counts every route change so that anything derived from routes can tell it is out of date
+        self.routeChanges = 0
+        self.active = array("b")
+        for column, typecode in NUMERIC_COLUMNS:
+            setattr(self, column, array(typecode))
+        for column in COMMAND_COLUMNS.values():
+            setattr(self, column, array("d"))
+        for column in OBJECT_COLUMNS:
+            setattr(self, column, [])
+        for column in COMMAND_OBJECT_COLUMNS.values():
+            setattr(self, column, [])
+
+    def _addRow(self):
+        # Every column grows by one, arrays over-allocate so this is amortised
+        self.active.append(0)
+        for column, typecode in NUMERIC_COLUMNS:
+            getattr(self, column).append(0)
+        for column in COMMAND_COLUMNS.values():
+            getattr(self, column).append(UNSET)
+        for column in OBJECT_COLUMNS:
+            getattr(self, column).append(None)
+        for column in COMMAND_OBJECT_COLUMNS.values():
+            getattr(self, column).append(None)
+        return len(self.active) - 1
+
+    def allocate(self, name, length, maxSpeed, acceleration, route, routeID):
+        """
+        Gives a vehicle a row, reusing a released row if there is one
+        """
+        row = self._freeRows.pop() if self._freeRows else self._addRow()
+        self.rowsByName[name] = row
+        self.active[row] = 1
+        self.name[row] = name
+        self.length[row] = length
+        self.maxSpeed[row] = maxSpeed
+        self.acceleration[row] = acceleration
+        self.route[row] = route
+        self.routeID[row] = routeID
+        self.leaderGap[row] = NO_LEADER
+        return row
+
+    def release(self, row):
+        """
+        Frees a row so that it can be given to another vehicle
+        """
+        name = self.name[row]
+        if self.rowsByName.get(name) == row:
+            del self.rowsByName[name]
+        self.active[row] = 0
+        for column in COMMAND_COLUMNS.values():
+            getattr(self, column)[row] = UNSET
+        # Drop references so that old routes and leaders can be garbage collected
+        for column in OBJECT_COLUMNS:
+            getattr(self, column)[row] = None
+        for column in COMMAND_OBJECT_COLUMNS.values():
+            getattr(self, column)[row] = None
+        self._freeRows.append(row)
+
+    def getLastCommanded(self, row, attr):
+        """
+        Gets the last value sent for the given setter, or None if it has never been sent
+        """
+        if attr in COMMAND_COLUMNS:
+            value = getattr(self, COMMAND_COLUMNS[attr])[row]
+            return None if value != value else value
+        return getattr(self, COMMAND_OBJECT_COLUMNS[attr])[row]
+
+    def setCommanded(self, row, attr, value):
+        """
+        Records the value sent for a setter, returning False if it is the same as the
+        value last sent (so the command can be skipped)
+        """
+        if attr in COMMAND_COLUMNS:
+            column = getattr(self, COMMAND_COLUMNS[attr])
+        else:
+            column = getattr(self, COMMAND_OBJECT_COLUMNS[attr])
+        if column[row] == value:
+            return False
+        column[row] = value
+        return True
+
+    def setRoute(self, row, route, routeID):
+        """
+        Replaces the route of a row after the vehicle has been rerouted
+        """
+        self.route[row] = route
+        self.routeID[row] = routeID
+        self.routeChanges = self.routeChanges + 1
+
+    def getRowCount(self):
+        return len(self.active) - len(self._freeRows)
+
+    def update(self, results):
+        """
+        Writes a step's subscription results (as returned by getAllSubscriptionResults)
+        into the columns. Returns the rows of any vehicles whose route has changed, as
+        their new routes need to be requested.
+        """
+        rowsByName = self.rowsByName
+        speed, laneIndex, lanePosition, routeIndex = self.speed, self.laneIndex, self.lanePosition, self.routeIndex
+        edge, lane, leader, leaderGap, routeName = self.edge, self.lane, self.leader, self.leaderGap, self.routeName
+        rerouted = []
+        for vehicleID, vehicleResults in results.items():
+            row = rowsByName.get(vehicleID)
+            if row is None:
+                continue
+            speed[row] = vehicleResults[tc.VAR_SPEED]
+            laneIndex[row] = vehicleResults[tc.VAR_LANE_INDEX]
+            lanePosition[row] = vehicleResults[tc.VAR_LANEPOSITION]
+            routeIndex[row] = vehicleResults[tc.VAR_ROUTE_INDEX]
+            edge[row] = vehicleResults[tc.VAR_ROAD_ID]
+            lane[row] = vehicleResults[tc.VAR_LANE_ID]
+            # Depending on the SUMO version no leader is either None or an empty ID
+            vehicleLeader = vehicleResults[tc.VAR_LEADER]
+            if vehicleLeader and vehicleLeader[0]:
+                leader[row] = vehicleLeader
+                leaderGap[row] = vehicleLeader[1]
+            else:
+                leader[row] = None
+                leaderGap[row] = NO_LEADER
+            # Rerouting gives a vehicle a new route ID, the first ID seen is the route it was created with
+            vehicleRouteName = vehicleResults[tc.VAR_ROUTE_ID]
+            if vehicleRouteName != routeName[row]:
+                if routeName[row] is not None:
+                    rerouted.append(row)
+                routeName[row] = vehicleRouteName
+        return rerouted
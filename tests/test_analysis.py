@@ -0,0 +1,41 @@
+import csv
+import os
+
+import pytest
+
+from analysis import analyseEmissions, analyseFcd, analyseOutputs, analyseTripinfo
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "analysis")
+
+def fixture(fileName):
+    return os.path.join(FIXTURES, fileName)
+
+def readTable(fileLocation):
+    with open(fileLocation, newline="") as f:
+        return list(csv.DictReader(f))
+
+def test_emissions_are_totalled_over_edges_and_intervals():
+    totals = analyseEmissions(fixture("emissionsOutput.xml"))
+    assert totals == {"CO2": 3000, "CO": 60, "HC": 3, "PMx": 1.5, "NOx": 12, "fuel": 1200, "sampledSeconds": 300}
+
+def test_trips_are_averaged():
+    summary = analyseTripinfo(fixture("tripinfo.xml"))
+    assert summary == {"trips": 2, "mean duration": 50, "mean waitingTime": 15, "mean timeLoss": 21,
+                       "mean departDelay": 1, "mean routeLength": 400}
+
+def test_fcd_samples_are_grouped_by_edge_and_interval():
+    summary = analyseFcd(fixture("fcd.xml"), interval=60)
+    assert summary == {"fcdSamples": 4, "fcdMeanSpeed": pytest.approx(8)}
+
+def test_outputs_are_analysed_into_tables(tmp_path):
+    summary = analyseOutputs(FIXTURES, str(tmp_path), fcdInterval=60)
+    assert summary["total CO2"] == 3000 and summary["trips"] == 2 and summary["fcdSamples"] == 4
+
+    intervals = readTable(str(tmp_path / "intervalEmissions.csv"))
+    assert [(float(row["begin"]), int(row["edges"]), float(row["CO2"])) for row in intervals] == [(0, 2, 1500), (300, 1, 1500)]
+    edges = readTable(str(tmp_path / "edgeEmissions.csv"))
+    assert [(row["edge"], float(row["fuel"])) for row in edges] == [("northIn", 400), ("westOut", 200), ("northIn", 600)]
+    # Vehicles in the first minute are on two edges, the one in the next on a single edge
+    fcdEdges = readTable(str(tmp_path / "fcdEdges.csv"))
+    assert [(float(row["begin"]), row["edge"], int(row["samples"]), float(row["meanSpeed"])) for row in fcdEdges] == [
+        (0, "northIn", 2, 8), (0, "westOut", 1, 14), (60, "westOut", 1, 2)]
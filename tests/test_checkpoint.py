@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from backend import traci
+from checkpoint import loadCheckpoint, saveCheckpoint
+from fakebackend import FakeTraCI
+from simulationmanager import SimulationManager
+from statecache import stateCache
+
+def buildJunction(signalled):
+    # Two flows crossing at a traffic light, vehicles form platoons while queueing at a red light
+    sim = FakeTraCI()
+    for direction in ("north", "west"):
+        sim.addEdge(direction + "In", 200, 2)
+        sim.addEdge(direction + "Out", 200, 2)
+    sim.addTrafficLight("J", ["northIn_0", "northIn_1", "westIn_0", "westIn_1"], signalled=signalled)
+    sim.addFlow("northFlow", ["northIn", "westOut"], 0, 5000, 1500)
+    sim.addFlow("westFlow", ["westIn", "northOut"], 0, 5000, 1500)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    return sim
+
+def getKeyName(key):
+    return key.getID() if hasattr(key, "getID") else key.getName()
+
+def getState(manager, sim):
+    # Everything the control decides on, along with where SUMO has put each vehicle
+    platoons = sorted((p.getID(), [v.getName() for v in p.getAllVehicles()], p.getTargetSpeed(), p._followerSpeed,
+                       sorted(p._controlledLanes), p.canMerge()) for p in manager.getActivePlatoons())
+    controllers = []
+    for controller in manager.intersections:
+        reservations = controller.reservations
+        controllers.append((controller.name, [p.getID() for p in controller.platoons],
+                            [v.getName() for v in controller.getVehicleZipOrderThroughJunc()],
+                            {lane: list(zip(reservations._starts[lane], reservations._ends[lane], map(getKeyName, reservations._keys[lane])))
+                             for lane in sorted(reservations._starts)}))
+    vehicles = sorted((v.id, v.lane.id, v.pos, v.speed) for v in sim.vehicles.values())
+    return platoons, controllers, vehicles
+
+def runSteps(manager, sim, steps):
+    states = []
+    for i in range(steps):
+        manager.handleSimulationStep()
+        traci.simulationStep()
+        states.append(getState(manager, sim))
+    return states
+
+@pytest.mark.parametrize("zipping", [False, True])
+def test_restored_checkpoint_carries_on_the_same(tmp_path, zipping):
+    checkpointFile = str(tmp_path / "checkpoint.pkl")
+    sim = buildJunction(not zipping)
+    manager = SimulationManager(True, zipping, zipping, 0)
+    runSteps(manager, sim, 300)
+    saveCheckpoint(checkpointFile, manager, mapName="junction")
+    savedState = getState(manager, sim)
+    # New platoons are given random colours
+    random.seed(1)
+    expected = runSteps(manager, sim, 200)
+    if zipping:
+        assert any(controller[2] for states in expected for controller in states[1])
+    else:
+        assert any(len(platoon[1]) > 1 for states in expected for platoon in states[0])
+
+    sim = buildJunction(not zipping)
+    restored, time, info = loadCheckpoint(checkpointFile)
+    assert info == {"mapName": "junction"}
+    assert getState(restored, sim) == savedState
+    random.seed(1)
+    assert runSteps(restored, sim, 200) == expected
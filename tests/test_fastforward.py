@@ -0,0 +1,73 @@
+from backend import traci
+from fakebackend import FakeTraCI
+from fastforward import DepartureSchedule, FastForward, flowTuple
+from simulationmanager import SimulationManager
+from statecache import stateCache
+
+def test_departure_schedule():
+    schedule = DepartureSchedule(flows=[flowTuple(10, 40, 10)], departures=[25, 5])
+    assert schedule.getNextDeparture(0) == 5
+    assert schedule.getNextDeparture(6) == 10
+    # A departure at the given time happens in the coming step
+    assert schedule.getNextDeparture(10) == 10
+    assert schedule.getNextDeparture(11) == 20
+    assert schedule.getNextDeparture(21) == 25
+    assert schedule.getNextDeparture(41) is None
+    # Scaling the traffic up shortens the period of flows
+    assert DepartureSchedule(flows=[flowTuple(10, 40, 10)], scale=2).getNextDeparture(11) == 15
+    # Flows that depart at random could depart on any step while they run
+    schedule = DepartureSchedule(departures=[50], randomFlows=[(20, 30)])
+    assert schedule.getNextDeparture(0) == 20
+    assert schedule.getNextDeparture(22) == 22
+    assert schedule.getNextDeparture(30) == 50
+
+def startManager(sim):
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    return SimulationManager(True, False, False, 0)
+
+def test_steady_platoon_is_idle_until_its_lead_reaches_the_end_of_its_lane():
+    sim = FakeTraCI()
+    sim.addEdge("A", 1000)
+    sim.addEdge("B", 1000)
+    sim.addVehicle("v0", ["A", "B"], departPos=100)
+    sim.addVehicle("v1", ["A", "B"], departPos=92)
+    manager = startManager(sim)
+    fastForwarder = FastForward(DepartureSchedule())
+    for i in range(3):
+        traci.simulationStep()
+        manager.handleSimulationStep()
+    assert len(manager.getActivePlatoons()) == 1
+    platoon = manager.getActivePlatoons()[0]
+    assert platoon.getNumberOfVehicles() == 2 and platoon.isSteady()
+    assert manager.isIdle()
+
+    lead = platoon.getLeadVehicle()
+    stepsToLaneEnd = (1000 - lead.getLanePosition()) / lead.getSpeed() / traci.simulation.getDeltaT()
+    steps = fastForwarder.getSteps(manager, 1000)
+    assert 1 < steps < stepsToLaneEnd
+    # The lead vehicle slowing down means the platoon has something to do again
+    sim.lanes["A_0"].maxSpeed = 10
+    traci.simulationStep()
+    manager.handleSimulationStep()
+    assert not manager.isIdle() and fastForwarder.getSteps(manager, 1000) == 1
+
+def test_vehicles_are_resynchronised_after_a_jump():
+    sim = FakeTraCI()
+    sim.addEdge("A", 400)
+    sim.addFlow("flow", ["A"], begin=0, end=200, vehsPerHour=60)
+    manager = startManager(sim)
+    fastForwarder = FastForward(DepartureSchedule(flows=[flowTuple(0, 200, 60)]))
+    step = 0
+    while step < 300:
+        manager.handleSimulationStep()
+        # Every vehicle that departed or arrived during a jump has been found
+        assert set(manager.vehicles) == set(traci.vehicle.getIDList())
+        assert stateCache.store.getRowCount() == len(manager.vehicles)
+        steps = fastForwarder.getSteps(manager, 300 - step)
+        fastForwarder.step(steps)
+        if steps > 1:
+            manager.synchroniseVehicles()
+        step += steps
+    assert fastForwarder.jumps > 0 and fastForwarder.stepsSkipped > 100
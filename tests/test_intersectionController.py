@@ -0,0 +1,104 @@
+from backend import traci
+from fakebackend import FakeTraCI
+from intersectionController import IntersectionController
+from platoon import Platoon
+from statecache import stateCache
+from vehicle import Vehicle
+
+def startQueue(numOfVehicles):
+    """
+    Starts a fake simulation with a queue of vehicles on the single lane approaching a junction
+    """
+    sim = FakeTraCI()
+    sim.addEdge("A", 300)
+    sim.addEdge("B", 300)
+    sim.addTrafficLight("J", ["A_0"], signalled=False)
+    for i in range(numOfVehicles):
+        sim.addVehicle("v%s" % i, ["A", "B"], departPos=200 - i * 6)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    traci.simulationStep()
+    vehicles = [Vehicle("v%s" % i) for i in range(numOfVehicles)]
+    stateCache.update()
+    return vehicles
+
+def step(controller):
+    traci.simulationStep()
+    stateCache.update()
+    controller.removeIrreleventPlatoons()
+    controller.update()
+
+def test_vehicles_rejoining_after_a_split_are_ordered():
+    vehicles = startQueue(7)
+    controller = IntersectionController("J", controlledLanes=["A_0"])
+    platoon = Platoon(vehicles)
+    controller.addPlatoon(platoon)
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == vehicles
+
+    tail = platoon.split(3)
+    controller.addPlatoon(tail)
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == vehicles
+
+    # The tail is removed from the controller once disbanded, and its vehicles rejoin the front platoon
+    tail.disband()
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == vehicles[:3]
+    platoon.addVehicles(vehicles[3:])
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == vehicles
+    assert all(v.getLastSetValue("setSpeed") is not None for v in vehicles)
+
+def test_vehicles_split_off_are_dropped_with_their_platoon():
+    vehicles = startQueue(5)
+    controller = IntersectionController("J", controlledLanes=["A_0"])
+    platoon = Platoon(vehicles)
+    controller.addPlatoon(platoon)
+    step(controller)
+
+    # The tail isn't under this controller, so its vehicles leave the crossing order
+    platoon.split(2)
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == vehicles[:2]
+
+def test_platoons_beyond_the_horizon_give_up_their_slot():
+    vehicles = startQueue(3)
+    controller = IntersectionController("J", zip=False, controlledLanes=["A_0"])
+    platoon = Platoon(vehicles)
+    controller.addPlatoon(platoon)
+    step(controller)
+    assert controller.reservations.getLatestEnd() is not None
+
+    # The platoon is about 100m from the junction
+    traci.simulationStep()
+    stateCache.update()
+    controller.update(horizon=50)
+    assert controller.skippedLastStep == 1
+    assert not controller.reservations.getLatestEnd()
+
+def test_crossing_order_follows_vehicles_overtaking_on_other_lanes():
+    sim = FakeTraCI()
+    sim.addEdge("A", 300, 2)
+    sim.addEdge("B", 300, 2)
+    sim.addTrafficLight("J", ["A_0", "A_1"], signalled=False)
+    sim.addVehicle("slow", ["A", "B"], departPos=100, departLane=0, maxSpeed=5)
+    sim.addVehicle("fast", ["A", "B"], departPos=80, departLane=1, maxSpeed=20)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    traci.simulationStep()
+    slow, fast = Vehicle("slow"), Vehicle("fast")
+    stateCache.update()
+    controller = IntersectionController("J", controlledLanes=["A_0", "A_1"])
+    controller.addPlatoon(Platoon([slow]))
+    controller.addPlatoon(Platoon([fast]))
+    step(controller)
+    assert controller.getVehicleZipOrderThroughJunc() == [slow, fast]
+
+    # The commands the controller sends are never flushed, so the fast vehicle overtakes
+    for i in range(40):
+        step(controller)
+    assert fast.getLanePosition() > slow.getLanePosition()
+    assert controller.getVehicleZipOrderThroughJunc() == [fast, slow]
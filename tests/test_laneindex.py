@@ -0,0 +1,52 @@
+from backend import traci
+from fakebackend import FakeTraCI
+from laneindex import LaneIndex
+from platoon import Platoon
+from statecache import stateCache
+from vehicle import Vehicle
+
+def startVehicles(positions):
+    # Starts a vehicle on edge A or B at each of the given (edge, position)s
+    sim = FakeTraCI()
+    sim.addEdge("A", 100)
+    sim.addEdge("B", 100)
+    for i, (edge, position) in enumerate(positions):
+        sim.addVehicle("v%s" % i, ["A", "B"] if edge == "A" else ["B"], departPos=position)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    traci.simulationStep()
+    vehicles = [Vehicle("v%s" % i) for i in range(len(positions))]
+    stateCache.update()
+    return vehicles
+
+def test_platoon_ahead_on_the_same_lane():
+    vehicles = startVehicles([("A", 50), ("A", 80), ("A", 74)])
+    ahead = Platoon(vehicles[1:])
+    index = LaneIndex([Platoon(vehicles[:1]), ahead])
+    position = vehicles[0].getLanePosition()
+    rear = vehicles[2]
+    gap = rear.getLanePosition() - rear.getLength() - position
+    assert index.getPlatoonAhead("A_0", position, gap) is ahead
+    assert index.getPlatoonAhead("A_0", position, gap - 1) is None
+
+def test_platoon_ahead_on_the_next_lane():
+    vehicles = startVehicles([("A", 90), ("B", 12), ("B", 6)])
+    ahead = Platoon(vehicles[1:])
+    index = LaneIndex([Platoon(vehicles[:1]), ahead])
+    position = vehicles[0].getLanePosition()
+    rear = vehicles[2]
+    gap = 100 - position + rear.getLanePosition() - rear.getLength()
+    # Only found if the search is allowed past the end of the lane, and is close enough
+    assert index.getPlatoonAhead("A_0", position, 20) is None
+    assert index.getPlatoonAhead("A_0", position, gap, "B_0") is ahead
+    assert index.getPlatoonAhead("A_0", position, gap - 1, "B_0") is None
+    # Beyond the search distance before the end of the lane is even reached
+    assert index.getPlatoonAhead("A_0", 50, 20, "B_0") is None
+
+def test_vehicles_outside_platoons_block_the_way():
+    vehicles = startVehicles([("A", 50), ("A", 60), ("B", 10)])
+    index = LaneIndex([Platoon(vehicles[:1]), Platoon(vehicles[2:])], vehicles[1:2])
+    assert index.getPlatoonAhead("A_0", vehicles[0].getLanePosition(), 100, "B_0") is None
+    # Nothing further along the lane, so the next lane is searched
+    assert index.getPlatoonAhead("A_0", vehicles[1].getLanePosition(), 100, "B_0") is not None
@@ -0,0 +1,60 @@
+import os
+import shutil
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+import netgenerator
+import scenario_manager
+from netgenerator import buildGrid, findGeneratedMaps
+
+def test_generated_nodes_and_edges_are_valid(tmp_path):
+    nodes, edges, flows = buildGrid(2, 3, horizontalLanes=2)
+    nodeFile = str(tmp_path / "grid.nod.xml")
+    edgeFile = str(tmp_path / "grid.edg.xml")
+    netgenerator._writeNodes(nodeFile, nodes)
+    netgenerator._writeEdges(edgeFile, edges, 13.89)
+
+    nodeElements = ElementTree.parse(nodeFile).getroot().findall("node")
+    nodeIDs = [node.get("id") for node in nodeElements]
+    assert len(set(nodeIDs)) == len(nodeIDs) == 2 * 3 + 2 * (2 + 3)
+    assert sum(1 for node in nodeElements if node.get("type") == "traffic_light") == 6
+    edgeElements = ElementTree.parse(edgeFile).getroot().findall("edge")
+    edgeIDs = [edge.get("id") for edge in edgeElements]
+    assert len(set(edgeIDs)) == len(edgeIDs)
+    # Every road goes both ways between two known junctions
+    roads = {(edge.get("from"), edge.get("to")) for edge in edgeElements}
+    assert all(fromNode in nodeIDs and toNode in nodeIDs and (toNode, fromNode) in roads for fromNode, toNode in roads)
+    assert {edge.get("numLanes") for edge in edgeElements if edge.get("from").startswith("W")} == {"2"}
+    # Flows enter and leave at the fringe
+    assert all(fromEdge in edgeIDs and toEdge in edgeIDs for flowID, fromEdge, toEdge, vehsPerHour in flows)
+    assert len(flows) == 2 * (2 + 3)
+    with pytest.raises(ValueError):
+        buildGrid(0, 1)
+
+def test_generated_maps_are_registered_when_first_needed(tmp_path, monkeypatch):
+    mapDirectory = tmp_path / "Grid1x1L1"
+    mapDirectory.mkdir()
+    netgenerator._writeGeneratedMapInfo(str(mapDirectory), "Grid1x1L1", 2)
+    (tmp_path / "Broken").mkdir()
+    (tmp_path / "Broken" / netgenerator.GENERATED_MAP_FILE_NAME).write_text("{")
+    assert findGeneratedMaps(str(tmp_path)) == [("Grid1x1L1", "Grid1x1L1", 2)]
+
+    monkeypatch.setattr(scenario_manager, "SCENARIO_LOCATION_CONFIG", dict(scenario_manager.SCENARIO_LOCATION_CONFIG))
+    monkeypatch.setattr(scenario_manager, "_registeredMapsDirectories", set())
+    assert "Grid1x1L1" not in scenario_manager.SCENARIO_LOCATION_CONFIG
+    scenario_manager.registerGeneratedMaps(str(tmp_path))
+    assert scenario_manager.SCENARIO_LOCATION_CONFIG["Grid1x1L1"] == scenario_manager.scenarioMapConfigTuple("Grid1x1L1", 2)
+    # Hand made maps keep their names
+    assert scenario_manager.SCENARIO_LOCATION_CONFIG["Blackwell"].mapName == "BlackwellTunnelNorthApproach"
+
+def test_generated_scenario_is_written(tmp_path):
+    # Building the network needs SUMO's netconvert
+    sumolib = pytest.importorskip("sumolib")
+    if not shutil.which(sumolib.checkBinary("netconvert")):
+        pytest.skip("netconvert is not installed")
+    name = netgenerator.generateGrid(str(tmp_path), 1, 2)
+    for mapName in (name, name + netgenerator.NO_TLS_MODIFIER):
+        for extension in (".net.xml", ".rou.xml", ".sumocfg"):
+            assert os.path.exists(os.path.join(str(tmp_path), mapName, mapName + extension))
+    assert findGeneratedMaps(str(tmp_path)) == [(name, name, 1)]
@@ -0,0 +1,68 @@
+import pytest
+
+import platoon as platoonModule
+from backend import traci
+from commandbuffer import commandBuffer
+from fakebackend import FakeTraCI
+from platoon import Platoon
+from statecache import stateCache
+from vehicle import Vehicle
+
+def startPlatoon(numOfVehicles):
+    sim = FakeTraCI()
+    sim.addEdge("A", 300, 2)
+    sim.addEdge("B", 300, 2)
+    for i in range(numOfVehicles):
+        sim.addVehicle("v%s" % i, ["A", "B"], departPos=200 - i * 6, departLane=i % 2)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    commandBuffer.reset()
+    traci.simulationStep()
+    vehicles = [Vehicle("v%s" % i) for i in range(numOfVehicles)]
+    for i in range(5):
+        traci.simulationStep()
+        stateCache.update()
+    platoon = Platoon(vehicles)
+    platoon.update()
+    return platoon, vehicles
+
+def runFollowerPass(updateFollowers, platoon):
+    # Starts each pass from nothing having been sent
+    store = stateCache.store
+    for row in range(len(store.commandedSpeed)):
+        store.commandedSpeed[row] = float("nan")
+    commandBuffer.reset()
+    updateFollowers([platoon])
+    commands = dict(commandBuffer._commands)
+    commandBuffer.reset()
+    return commands
+
+def test_array_pass_sends_the_same_commands_as_the_loop():
+    pytest.importorskip("numpy")
+    platoon, vehicles = startPlatoon(6)
+    # Followers on a controlled lane are left alone and those that have left are skipped
+    platoon.addControlledLanes({"A_1"})
+    vehicles[4].release()
+
+    commands = runFollowerPass(platoonModule._updateFollowersLoop, platoon)
+    assert commands == runFollowerPass(platoonModule._updateFollowersArrays, platoon)
+    assert ("v1", "changeLane") in commands and ("v4", "changeLane") not in commands
+    assert ("v1", "setSpeed") not in commands and ("v2", "setSpeed") in commands
+
+def test_platoon_reads_skip_vehicles_that_have_left():
+    platoon, vehicles = startPlatoon(4)
+    vehicles[0].release()
+    vehicles[-1].release()
+    # Until it is disbanded on its next update the platoon only reads from its active vehicles
+    assert platoon.isDirty()
+    assert platoon.getLength() > 0
+    assert platoon.getMaxSpeed() == vehicles[1].getMaxSpeed()
+    assert not platoon.checkVehiclePathsConverge([vehicles[1]])
+    platoonModule.updateFollowers([platoon])
+
+    for v in vehicles[1:3]:
+        v.release()
+    assert platoon.getLength() == 0
+    platoon.updateIsActive()
+    assert not platoon.isActive()
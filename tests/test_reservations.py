@@ -0,0 +1,72 @@
+import pytest
+
+from reservations import ETA_TOLERANCE, ReservationTable
+
+NORTH, SOUTH, EAST = "north_0", "south_0", "east_0"
+
+def createTable():
+    # North and south can cross together, east conflicts with both
+    conflicts = {NORTH: frozenset([EAST]), SOUTH: frozenset([EAST]), EAST: frozenset([NORTH, SOUTH])}
+    return ReservationTable([NORTH, SOUTH, EAST], conflicts)
+
+def test_conflicting_lanes_cross_one_after_another():
+    table = createTable()
+    assert table.reserve("a", NORTH, 10, 5) == 10
+    assert table.reserve("b", EAST, 12, 5) == 15
+    assert table.reserve("c", NORTH, 11, 2) == 20
+
+def test_lanes_that_dont_conflict_cross_together():
+    table = createTable()
+    assert table.reserve("a", NORTH, 10, 5) == 10
+    assert table.reserve("b", SOUTH, 10, 5) == 10
+    # Without conflicts every lane conflicts with every other
+    table = ReservationTable([NORTH, SOUTH])
+    table.reserve("a", NORTH, 10, 5)
+    assert table.reserve("b", SOUTH, 10, 5) == 15
+
+def test_slot_is_kept_while_arrival_stays_within_tolerance():
+    table = createTable()
+    table.reserve("a", NORTH, 10, 5)
+    assert table.reserve("b", EAST, 10, 5) == 15
+    table.recalculatedLastStep = 0
+    assert table.reserve("b", EAST, 10 + ETA_TOLERANCE / 2, 5) == 15
+    assert table.recalculatedLastStep == 0
+    # Arriving later than the slot starts gives a new one
+    assert table.reserve("b", EAST, 15 + ETA_TOLERANCE * 2, 5) == 15 + ETA_TOLERANCE * 2
+    assert table.recalculatedLastStep == 1
+
+def test_released_slots_can_be_taken():
+    table = createTable()
+    table.reserve("a", NORTH, 10, 5)
+    table.reserve("b", SOUTH, 10, 5)
+    table.release("a")
+    table.release("a")
+    assert table.reserve("c", EAST, 10, 5) == 15
+    table.release("b")
+    table.release("c")
+    assert table.getLatestEnd() is None
+    assert table.reserve("d", EAST, 10, 5) == 10
+
+def test_slots_starting_together_are_released_by_key():
+    table = createTable()
+    table.reserve("a", NORTH, 10, 5)
+    table.reserve("b", NORTH, 15, 0)
+    table.reserve("c", NORTH, 15, 5)
+    table.release("c")
+    assert table._keys[NORTH] == ["a", "b"]
+
+def test_expired_slots_are_dropped():
+    table = createTable()
+    table.reserve("a", NORTH, 10, 5)
+    table.expire(16)
+    table.release("a")
+    assert table.reserve("b", EAST, 10, 5) == 10
+
+def test_releasing_a_missing_slot_raises():
+    table = createTable()
+    table.reserve("a", NORTH, 10, 5)
+    del table._keys[NORTH][0]
+    del table._starts[NORTH][0]
+    del table._ends[NORTH][0]
+    with pytest.raises(RuntimeError):
+        table.release("a")
@@ -0,0 +1,47 @@
+from routes import RouteRegistry
+
+def test_routes_are_interned():
+    registry = RouteRegistry()
+    first = registry.intern(["A", "B", "C"])
+    assert registry.intern(("A", "B", "C")) == first
+    other = registry.intern(["A", "B", "D"])
+    assert other != first and registry.getRouteCount() == 2
+    # Vehicles on the same route share one tuple
+    assert registry.getRoute(first) is registry.getRoute(registry.intern(["A", "B", "C"]))
+    assert registry.getNextEdge(first, 1) == "C" and registry.getNextEdge(first, 2) is None
+    assert registry.getEdgeIndex(other, "D") == 2 and registry.getEdgeIndex(other, "C") is None
+
+def test_convergence_is_remembered_per_lead_route_index_and_follower_route():
+    registry = RouteRegistry()
+    lead = registry.intern(["A", "B", "C"])
+    convergent = registry.intern(["Z", "A", "B", "C"])
+    divergent = registry.intern(["A", "B", "D"])
+
+    # Both go onto B after the lead's first edge, only one of them onto C after that
+    assert registry.converges(lead, 0, [convergent, divergent])
+    assert registry.getFirstDiverging(lead, 1, [convergent, divergent]) == 1
+    assert registry.getFirstDiverging(lead, 1, [divergent, convergent]) == 0
+    # Nothing left to diverge onto once the lead is on its last edge
+    assert registry.converges(lead, 2, [divergent])
+    assert registry._convergence == {(lead, 0, convergent): True, (lead, 0, divergent): True,
+                                     (lead, 1, convergent): True, (lead, 1, divergent): False,
+                                     (lead, 2, divergent): True}
+
+    # A remembered result is used without looking at the routes again
+    registry._convergence[(lead, 0, divergent)] = False
+    assert registry.getFirstDiverging(lead, 0, [convergent, divergent]) == 1
+
+def test_rerouted_vehicles_get_a_new_key():
+    registry = RouteRegistry()
+    lead = registry.intern(["A", "B", "C"])
+    follower = registry.intern(["A", "B", "D"])
+    assert not registry.converges(lead, 1, [follower])
+    # Rerouting onto the lead's route interns to the lead's ID, so the old result isn't reused
+    rerouted = registry.intern(["A", "B", "C"])
+    assert rerouted == lead and registry.converges(lead, 1, [rerouted])
+    # A new route gets its own ID
+    rerouted = registry.intern(["B", "C", "E"])
+    assert rerouted not in (lead, follower) and registry.converges(lead, 1, [rerouted])
+
+    registry.reset()
+    assert registry.getRouteCount() == 0 and registry.intern(["A", "B", "D"]) == 0
@@ -0,0 +1,63 @@
+import os
+
+import runcache
+from runcache import RunCache, getRunKey
+
+def writeMap(directory, routes="<routes/>"):
+    files = {
+        "map.sumocfg": '<configuration><input><net-file value="map.net.xml"/><route-files value="map.rou.xml"/></input></configuration>',
+        "map.net.xml": "<net/>",
+        "map.rou.xml": routes,
+        "additional.xml": "<additional/>",
+    }
+    for name, contents in files.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(contents)
+    return os.path.join(directory, "map.sumocfg"), os.path.join(directory, "additional.xml")
+
+def getKey(configFile, additionalFile, seed=1, backend="traci"):
+    return getRunKey(configFile, additionalFile, (True, False), 100, 1.0, seed, backend=backend)
+
+def test_run_key_changes_with_inputs_and_sumo_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(runcache, "_sumoVersions", {"traci": "Eclipse SUMO sumo Version 1.18.0"})
+    configFile, additionalFile = writeMap(str(tmp_path))
+    key = getKey(configFile, additionalFile)
+    assert getKey(configFile, additionalFile) == key
+    assert getKey(configFile, additionalFile, seed=2) != key
+    assert getKey(configFile, additionalFile, backend="fake") != key
+
+    # Any file the config lists is part of the key
+    writeMap(str(tmp_path), routes='<routes><flow id="f"/></routes>')
+    changedRoutes = getKey(configFile, additionalFile)
+    assert changedRoutes != key
+
+    monkeypatch.setitem(runcache._sumoVersions, "traci", "Eclipse SUMO sumo Version 1.19.0")
+    assert getKey(configFile, additionalFile) != changedRoutes
+
+def test_hits_restore_metrics_and_files(tmp_path):
+    cache = RunCache(str(tmp_path / "cache"))
+    output = tmp_path / "output.xml"
+    output.write_text("<emissions/>")
+    assert cache.get("run") is None
+    cache.put("run", {"averageSpeed": 10}, outputFiles=[str(output)])
+
+    restored = tmp_path / "restored"
+    assert cache.get("run", str(restored)) == {"averageSpeed": 10}
+    assert (restored / "output.xml").read_text() == "<emissions/>"
+    assert cache.get("other") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_least_recently_used_runs_are_evicted(tmp_path):
+    output = tmp_path / "output.xml"
+    output.write_text("x" * 1000)
+    cache = RunCache(str(tmp_path / "cache"), maxSize=2500)
+    for i, key in enumerate(("a", "b")):
+        cache.put(key, {}, outputFiles=[str(output)])
+        # Modification times can be too coarse to tell entries put straight after each other apart
+        entryFile = os.path.join(cache.directory, key, runcache.ENTRY_FILE_NAME)
+        os.utime(entryFile, (i, i))
+    # Using the first run makes the second the least recently used
+    assert cache.get("a") is not None
+    cache.put("c", {}, outputFiles=[str(output)])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
@@ -0,0 +1,61 @@
+import pytest
+
+from backend import traci
+from commandbuffer import commandBuffer
+from fakebackend import FakeTraCI
+from scheduler import ControlScheduler, FOLLOWER_CONTROL, FORMATION, PLATOON_UPDATE
+from simulationmanager import SimulationManager
+from statecache import stateCache
+
+def test_tasks_are_due_every_interval():
+    scheduler = ControlScheduler(formationInterval=3)
+    due = []
+    for i in range(7):
+        due.append(scheduler.isDue(FORMATION))
+        assert scheduler.isDue(PLATOON_UPDATE)
+        scheduler.endStep()
+    assert due == [True, False, False, True, False, False, True]
+    assert not scheduler.isEveryStep() and ControlScheduler().isEveryStep()
+    with pytest.raises(ValueError):
+        ControlScheduler(mergeInterval=0)
+
+def startCruising(scheduler):
+    # Two vehicles cruising together along a long edge, with a third to depart later
+    sim = FakeTraCI()
+    sim.addEdge("A", 2000)
+    sim.addVehicle("v0", ["A"], departPos=100)
+    sim.addVehicle("v1", ["A"], departPos=92)
+    sim.addVehicle("v2", ["A"], depart=0.15, departPos=85)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    return sim, SimulationManager(True, False, False, 0, scheduler=scheduler)
+
+def run(sim, manager, steps):
+    # Gets the platoon updates skipped and the commands sent on each step
+    skipped = []
+    commands = []
+    for i in range(steps):
+        traci.simulationStep()
+        manager.handleSimulationStep()
+        skipped.append(manager.scheduler.skippedLastStep[PLATOON_UPDATE])
+        commands.append(commandBuffer.issuedLastStep)
+    return skipped, commands
+
+def test_steady_platoons_are_only_controlled_when_due_and_dirty_ones_straight_away():
+    scheduler = ControlScheduler(formationInterval=2, platoonUpdateInterval=4, followerInterval=4)
+    sim, manager = startCruising(scheduler)
+    skipped, commands = run(sim, manager, 12)
+    assert [p.getNumberOfVehicles() for p in manager.getActivePlatoons()] == [3]
+    # v2 departs on the second step and waits for formation to next be due to join, its
+    # platoon is then controlled straight away as its membership has changed
+    assert scheduler.totalSkipped[FORMATION] == 1
+    assert skipped == [0, 1, 0, 1, 0, 1, 1, 1, 0, 1, 1, 1]
+    # Otherwise nothing is sent to the platoon's followers until it is due
+    assert scheduler.totalSkipped[FOLLOWER_CONTROL] == 8
+    assert [count > 0 for count in commands] == [count == 0 for count in skipped]
+
+    # A lead vehicle slowing down makes its platoon dirty, so control resumes on every step
+    sim.lanes["A_0"].maxSpeed = 5
+    skipped, commands = run(sim, manager, 3)
+    assert skipped == [0, 0, 0] and all(commands)
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from topology import Topology, compileTopology, getCacheLocation, loadTopology
+
+# A traffic light J with incoming edges A, B and C. The links through J (the order of its
+# internal lanes) are A, C, B while its signals are numbered B, C, A, so neither matches
+# the order the lanes come into the junction. A's link and B's link are foes.
+NETWORK = """<net version="1.9">
+    <edge id=":J_0" function="internal"><lane id=":J_0_0" index="0" speed="10.00" length="8.00"/></edge>
+    <edge id=":J_1" function="internal"><lane id=":J_1_0" index="0" speed="10.00" length="8.00"/></edge>
+    <edge id=":J_2" function="internal"><lane id=":J_2_0" index="0" speed="10.00" length="8.00"/></edge>
+    <edge id="A" from="a" to="J"><lane id="A_0" index="0" speed="13.89" length="%s"/></edge>
+    <edge id="B" from="b" to="J"><lane id="B_0" index="0" speed="13.89" length="100.00"/></edge>
+    <edge id="C" from="c" to="J"><lane id="C_0" index="0" speed="13.89" length="100.00"/></edge>
+    <edge id="D" from="J" to="d">
+        <lane id="D_0" index="0" speed="22.22" length="200.00"/>
+        <lane id="D_1" index="1" speed="22.22" length="200.00"/>
+    </edge>
+    <tlLogic id="J" type="static" programID="0" offset="0"><phase duration="30" state="GGG"/></tlLogic>
+    <junction id="a" type="dead_end" incLanes="" intLanes=""/>
+    <junction id="J" type="traffic_light" incLanes="A_0 B_0 C_0" intLanes=":J_0_0 :J_2_0 :J_1_0">
+        <request index="0" response="000" foes="100" cont="0"/>
+        <request index="1" response="000" foes="000" cont="0"/>
+        <request index="2" response="001" foes="001" cont="0"/>
+    </junction>
+    <connection from="A" to="D" fromLane="0" toLane="0" via=":J_0_0" tl="J" linkIndex="2" dir="s" state="O"/>
+    <connection from="B" to="D" fromLane="0" toLane="1" via=":J_1_0" tl="J" linkIndex="0" dir="s" state="O"/>
+    <connection from="C" to="D" fromLane="0" toLane="0" via=":J_2_0" tl="J" linkIndex="1" dir="s" state="O"/>
+    <connection from=":J_0" to="D" fromLane="0" toLane="0" dir="s" state="M"/>
+</net>
+"""
+
+def writeNetwork(directory, laneLength=100.0):
+    netFile = os.path.join(directory, "junction.net.xml")
+    with open(netFile, "w") as f:
+        f.write(NETWORK % ("%.2f" % laneLength))
+    return netFile
+
+def test_compiled_topology_is_read_back(tmp_path):
+    topology = Topology(compileTopology(writeNetwork(str(tmp_path))))
+    assert topology.getLaneLength("A_0") == 100 and topology.getLaneMaxSpeed("D_1") == 22.22
+    assert topology.hasLane(":J_0_0") and not topology.hasLane("E_0")
+    assert topology.getEdgeLanes("D") == ["D_0", "D_1"]
+    assert topology.getSuccessors("A") == ["D"] and topology.getSuccessors("D") == []
+    assert topology.hasTrafficLight("J")
+    # Controlled lanes are in signal order, like traci.trafficlight.getControlledLanes
+    assert topology.getControlledLanes("J") == ["B_0", "C_0", "A_0"]
+    # Conflicts come from the junction's link order, not the signal or incoming lane order
+    assert topology.getConflicts() == {"J": {"A_0": frozenset({"A_0", "B_0"}),
+                                             "B_0": frozenset({"A_0", "B_0"}),
+                                             "C_0": frozenset({"C_0"})}}
+    topology.close()
+
+def test_cache_is_recompiled_when_the_network_changes(tmp_path):
+    netFile = writeNetwork(str(tmp_path))
+    topology = loadTopology(netFile)
+    assert os.path.exists(getCacheLocation(netFile))
+    assert topology.getLaneLength("A_0") == 100
+    topology.close()
+
+    writeNetwork(str(tmp_path), laneLength=150)
+    topology = loadTopology(netFile)
+    assert topology.getLaneLength("A_0") == 150
+    topology.close()
+
+    # A cache that can't be read is compiled again
+    with open(getCacheLocation(netFile), "wb") as f:
+        f.write(b"not a topology" * 8)
+    with pytest.raises(ValueError):
+        Topology(getCacheLocation(netFile))
+    topology = loadTopology(netFile)
+    assert topology.getLaneLength("A_0") == 150
+    topology.close()
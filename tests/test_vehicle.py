@@ -0,0 +1,51 @@
+import pickle
+
+import pytest
+
+from backend import traci
+from fakebackend import FakeTraCI
+from statecache import stateCache
+from vehicle import Vehicle
+
+def test_released_vehicles_are_inactive_and_cant_be_read():
+    sim = FakeTraCI()
+    sim.addEdge("A", 100)
+    sim.addVehicle("v0", ["A"], departPos=50)
+    traci.use(sim)
+    traci.start(["sumo"])
+    stateCache.reset()
+    traci.simulationStep()
+    vehicle = Vehicle("v0")
+    stateCache.update()
+    assert vehicle.isActive() and vehicle.getLane() == "A_0"
+
+    vehicle.release()
+    assert "v0" not in stateCache.store.rowsByName
+    assert not vehicle.isActive()
+    assert vehicle.getName() == "v0"
+    with pytest.raises(RuntimeError):
+        vehicle.getLane()
+    # Setters are ignored as the vehicle isn't active
+    vehicle.setSpeed(10)
+    # A released handle is still released once restored from a checkpoint
+    restored = pickle.loads(pickle.dumps(vehicle, pickle.HIGHEST_PROTOCOL))
+    assert not restored.isActive()
+
+def test_manager_releases_the_rows_of_arrived_vehicles():
+    from simulationmanager import SimulationManager
+    sim = FakeTraCI()
+    sim.addEdge("A", 20)
+    sim.addVehicle("v0", ["A"], departPos=10)
+    traci.use(sim)
+    traci.start(["sumo"])
+    manager = SimulationManager()
+    traci.simulationStep()
+    manager.handleSimulationStep()
+    vehicle = manager.vehicles["v0"]
+    # Held on to so its row is only freed by the manager and not by garbage collection
+    while traci.simulation.getMinExpectedNumber() > 0:
+        traci.simulationStep()
+        manager.handleSimulationStep()
+    assert "v0" not in manager.vehicles
+    assert not vehicle.isActive()
+    assert stateCache.store.getRowCount() == 0